@@ -0,0 +1,367 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    in-place frame averaging and software dark/flat-field correction.
+
+    the accumulator and its scratch planes are allocated once, for the first frame; every frame
+    after that is folded in with a few in-place ufuncs straight from the pinned ring buffer, so
+    averaging 64 frames costs no more memory than averaging 2.
+
+        acc = cam.accumulate(MEAN, n=64, sigma=3)
+        acc.wait()
+        image = acc.image()
+
+        cal = Calibration.from_frames(darks=dark_stack, flats=flat_stack)
+        cal.save('cal.npz')
+        acc = cam.accumulate(EMA, alpha=0.05, calibration=cal)
+
+    modes:
+        mean    running mean of n frames (or until stop()), float32
+        sum     sum of n frames, uint32 (float32 with a calibration)
+        ema     exponential moving average with weight alpha, float32, runs until stop()
+
+    RGB32 frames are accumulated as their whole BGRA bytes: folding contiguous rows is about 1.5x
+    faster than skipping every fourth byte. result(), image() and variance drop the alpha plane.
+"""
+# ============= standard library imports ========================
+import threading
+# ============= local library imports  ==========================
+
+MEAN = 'mean'
+SUM = 'sum'
+EMA = 'ema'
+MODES = (MEAN, SUM, EMA)
+
+# frames folded in before sigma clipping starts; the spread of fewer frames says little
+MIN_CLIP_FRAMES = 5
+# smallest variance a sample is judged against, one quantization step squared; keeps noiseless
+# pixels from rejecting every change
+VARIANCE_FLOOR = 1.
+DEFAULT_TIMEOUT = 60.
+
+
+def sample_view(data):
+    """
+        the samples of a frame as a zero-copy view, RGB32 as its (h, w, 4) BGRA bytes
+    """
+    if data.dtype == 'uint32':
+        return data.view('uint8').reshape(data.shape + (4,))
+    return data
+
+
+def _visible(data):
+    # BGRA accumulators without their alpha plane
+    return data[..., :3] if data.ndim == 3 and data.shape[2] == 4 else data
+
+
+class Calibration(object):
+    """
+        dark and flat maps, applied as (x - dark) * gain with gain = mean(flat - dark) / (flat - dark)
+        precomputed per pixel. the maps have the shape of the frames, (h, w, 3) for color frames.
+    """
+
+    def __init__(self, dark=None, flat=None):
+        """
+        :param dark: dark frame (mean of frames taken with the shutter closed)
+        :param flat: flat frame (mean of frames of an even field), not dark subtracted
+        """
+        from numpy import asarray, float32, maximum
+
+        self.dark = None if dark is None else asarray(dark, dtype=float32)
+        self.flat = None if flat is None else asarray(flat, dtype=float32)
+        self.gain = None
+        if self.flat is not None:
+            signal = self.flat - self.dark if self.dark is not None else self.flat.copy()
+            # dead pixels would otherwise divide by zero
+            maximum(signal, 1e-3, out=signal)
+            # color planes keep their own level, or the correction would change the white balance
+            axes = (0, 1) if signal.ndim == 3 else None
+            self.gain = signal.mean(axis=axes, dtype='float64').astype(float32) / signal
+
+    @classmethod
+    def from_frames(cls, darks=None, flats=None):
+        """
+        :param darks: (n, ...) stack of dark frames
+        :param flats: (n, ...) stack of flat frames
+        """
+        return cls(None if darks is None else darks.mean(axis=0, dtype='float32'),
+                   None if flats is None else flats.mean(axis=0, dtype='float32'))
+
+    @classmethod
+    def load(cls, path):
+        from numpy import load
+
+        with load(path) as f:
+            return cls(f['dark'] if 'dark' in f else None, f['flat'] if 'flat' in f else None)
+
+    def save(self, path):
+        """
+            write the maps into an .npz file; the SDK's own correction files are written with
+            ToupCamCamera.export_ffc / export_dfc
+        """
+        from numpy import savez
+
+        maps = {k: v for k, v in (('dark', self.dark), ('flat', self.flat)) if v is not None}
+        savez(path, **maps)
+
+    @property
+    def shape(self):
+        m = self.dark if self.dark is not None else self.flat
+        return None if m is None else m.shape
+
+    def apply(self, data, out=None):
+        """
+        :param data: frame samples, see sample_view; the alpha plane of BGRA samples is left alone
+        :param out: float32 array of the same shape to write into
+        :return: the corrected float32 samples
+        """
+        from numpy import empty, float32, multiply, subtract
+
+        if out is None:
+            out = empty(data.shape, dtype=float32)
+        if data.ndim == 3 and data.shape[2] == 4:
+            self.apply(data[..., :3], out[..., :3])
+            return out
+
+        if self.dark is not None:
+            subtract(data, self.dark, out=out, casting='unsafe')
+        else:
+            out[...] = data
+        if self.gain is not None:
+            multiply(out, self.gain, out=out)
+        return out
+
+
+class Accumulator(object):
+    """
+        running mean, sum or EMA of frames into one preallocated accumulator, optionally
+        sigma-clipped and dark/flat corrected. feed it with add(), or start() it on a camera to
+        fold in every live frame on the acquisition thread.
+    """
+
+    def __init__(self, cam=None, mode=MEAN, n=None, alpha=0.1, sigma=None, calibration=None):
+        """
+        :param cam: ToupCamCamera for start()
+        :param mode: MEAN, SUM or EMA
+        :param n: stop after n frames (MEAN and SUM), None runs until stop()
+        :param alpha: EMA weight of the newest frame
+        :param sigma: reject samples further than sigma standard deviations from the running value
+            (MEAN and EMA); a rejected sample counts as the running value
+        :param calibration: Calibration applied to every frame before it is folded in
+        """
+        if mode not in MODES:
+            raise ValueError(f'mode needs to be one of {MODES}, got {mode!r}')
+        if sigma is not None and mode == SUM:
+            raise ValueError('sigma clipping needs a running value, use MEAN or EMA')
+        if n is not None and mode == EMA:
+            raise ValueError('an EMA has no frame count, stop() it instead')
+
+        self.cam = cam
+        self.mode = mode
+        self.n = n
+        self.alpha = alpha
+        self.sigma = sigma
+        self.calibration = calibration
+
+        self.count = 0
+        self.rejected = 0
+        # frames whose shape did not match the accumulator, e.g. after a ROI change
+        self.skipped = 0
+        # hardware timestamps of the first and the newest folded frame
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        self.data = None
+        self._dtype = None
+        self._calibrated = None
+        self._delta = None
+        self._square = None
+        self._limit = None
+        self._mask = None
+        self._spread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.cam.add_frame_listener(self._on_frame)
+        return self
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self.cam.remove_frame_listener(self._on_frame)
+        self._done.set()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.rejected = 0
+            self.skipped = 0
+            self.first_timestamp = self.last_timestamp = None
+            self._done.clear()
+
+    def wait(self, timeout=DEFAULT_TIMEOUT):
+        """
+        :return: True if n frames were folded in (or stop() was called)
+        """
+        return self._done.wait(timeout)
+
+    def add(self, data, timestamp=None):
+        """
+            fold one frame in
+        :param data: frame data as delivered by the ring, or already a sample_view
+        :return: False if the frame did not match the accumulator
+        """
+        x = sample_view(data)
+        with self._lock:
+            if self.data is None:
+                self._allocate(x.shape)
+            elif x.shape != self.data.shape:
+                self.skipped += 1
+                return False
+
+            if not self.count:
+                self._dtype = x.dtype
+            if self.calibration is not None:
+                x = self.calibration.apply(x, out=self._calibrated)
+
+            if not self.count:
+                self.data[...] = x
+                if self._spread is not None:
+                    self._spread.fill(0)
+            elif self.mode == SUM:
+                self.data += x
+            else:
+                self._fold(x)
+
+            self.count += 1
+            if timestamp is not None:
+                if self.first_timestamp is None:
+                    self.first_timestamp = timestamp
+                self.last_timestamp = timestamp
+            if self.n is not None and self.count >= self.n:
+                self._done.set()
+        return True
+
+    def result(self):
+        """
+        :return: a copy of the accumulator, float32 or for an uncalibrated SUM uint32
+        """
+        with self._lock:
+            return None if self.data is None else _visible(self.data).copy()
+
+    def image(self, dtype=None):
+        """
+            the accumulated frame rounded back to frame samples; a SUM is divided by its count
+        :param dtype: defaults to the dtype of the accumulated frames
+        """
+        from numpy import clip, iinfo, rint
+
+        with self._lock:
+            if self.data is None:
+                return
+            data = _visible(self.data)
+            data = data / self.count if self.mode == SUM else data.copy()
+            dtype = dtype or self._dtype
+        info = iinfo(dtype)
+        return clip(rint(data, out=data), info.min, info.max).astype(dtype)
+
+    @property
+    def variance(self):
+        """
+            per sample variance of the folded frames, only kept with sigma clipping
+        """
+        with self._lock:
+            if self._spread is None:
+                return
+            spread = _visible(self._spread)
+            if self.mode == MEAN:
+                return spread / max(1, self.count - 1)
+            return spread.copy()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # private
+    def _allocate(self, shape):
+        from numpy import empty, float32, uint32, zeros
+
+        integer = self.mode == SUM and self.calibration is None
+        self.data = zeros(shape, dtype=uint32 if integer else float32)
+        # zeros, the alpha plane of BGRA samples is never written by the calibration
+        self._calibrated = zeros(shape, dtype=float32) if self.calibration is not None else None
+        if self.mode != SUM:
+            self._delta = empty(shape, dtype=float32)
+        if self.sigma is not None:
+            # MEAN keeps Welford's sum of squared deviations, EMA an exponentially weighted variance
+            self._spread = zeros(shape, dtype=float32)
+            self._square = empty(shape, dtype=float32)
+            self._limit = empty(shape, dtype=float32)
+            self._mask = empty(shape, dtype=bool)
+
+    def _fold(self, x):
+        from numpy import copyto, count_nonzero, greater, maximum, multiply, subtract
+
+        k = self.count + 1
+        acc = self.data
+        delta = self._delta
+        if x.dtype != delta.dtype:
+            # one converting copy, then the arithmetic runs float32 to float32
+            copyto(delta, x, casting='unsafe')
+            x = delta
+        subtract(x, acc, out=delta)
+
+        spread = self._spread
+        if spread is not None:
+            square = multiply(delta, delta, out=self._square)
+            if k > MIN_CLIP_FRAMES:
+                # |delta| > sigma * std  <=>  delta ** 2 > sigma ** 2 * variance
+                scale = self.sigma ** 2 / (k - 1) if self.mode == MEAN else self.sigma ** 2
+                limit = multiply(spread, scale, out=self._limit)
+                maximum(limit, self.sigma ** 2 * VARIANCE_FLOOR, out=limit)
+                mask = greater(square, limit, out=self._mask)
+                rejected = count_nonzero(mask)
+                if rejected:
+                    self.rejected += rejected
+                    copyto(delta, 0, where=mask)
+                    copyto(square, 0, where=mask)
+
+            if self.mode == MEAN:
+                # Welford: M2 += delta * (x - new mean) = delta ** 2 * (k - 1) / k
+                square *= (k - 1) / k
+                spread += square
+            else:
+                # var = (1 - a) * (var + a * delta ** 2)
+                square *= self.alpha
+                spread += square
+                spread *= 1 - self.alpha
+
+        delta *= 1 / k if self.mode == MEAN else self.alpha
+        acc += delta
+
+    def _on_frame(self, frame):
+        # acquisition thread
+        self.add(frame.data, frame.timestamp)
+        if self.n is not None and self.count >= self.n:
+            self.stop()
+
+# ============= EOF =============================================
@@ -0,0 +1,111 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import os
+
+from numpy import dtype as np_dtype, empty, memmap, searchsorted
+# ============= local library imports  ==========================
+from frames import Frame
+from recorder import read_header, read_index
+
+
+class FrameArchive(object):
+    """
+        random access to a recording written by Recorder (see recorder.py).
+
+        the frames are memory mapped read-only, so archive[i], archive[i:j] and between() return
+        zero-copy views and only the pages that are actually touched are read from disk.
+
+        archive = FrameArchive('run1.tcr')
+        frames, index = archive.between(t0, t0 + 1000000)
+        frames.mean(axis=0)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = header = read_header(path)
+        self.shape = tuple(header['shape'])
+        self.dtype = np_dtype(header['dtype'])
+        self.frame_nbytes = header['frame_nbytes']
+        self.raw = header.get('raw', False)
+        self.raw_format = header.get('raw_format')
+        self.bitdepth = header.get('bitdepth', 8)
+
+        index = read_index(path, header)
+        offset = header['header_size']
+        # a recording that was cut short can end in a partial frame or index record
+        n = min(len(index), (os.path.getsize(path) - offset) // self.frame_nbytes)
+        self.index = index[:n]
+
+        if n:
+            self.frames = memmap(path, dtype=self.dtype, mode='r', offset=offset, shape=(n,) + self.shape)
+        else:
+            # an empty file can not be mapped
+            self.frames = empty((0,) + self.shape, dtype=self.dtype)
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        """
+        :param item: frame number or slice
+        :return: read-only view of the frame data
+        """
+        return self.frames[item]
+
+    def frame(self, i):
+        """
+        :return: Frame of frame number i, for code that consumes live frames
+        """
+        rec = self.index[i]
+        return Frame(None, -1, self.frames[i], int(rec['seq']), int(rec['timestamp']), int(rec['flag']))
+
+    def find(self, timestamp):
+        """
+        :param timestamp: hardware timestamp in microseconds
+        :return: number of the first frame at or after timestamp
+        """
+        return int(searchsorted(self.timestamps, timestamp))
+
+    def between(self, start, end):
+        """
+            the frames with start <= timestamp < end
+        :param start: hardware timestamp in microseconds
+        :param end: hardware timestamp in microseconds
+        :return: (frames view, index records)
+        """
+        i, j = self.find(start), self.find(end)
+        return self.frames[i:j], self.index[i:j]
+
+    def close(self):
+        # dropping the views unmaps the file once no one else holds one
+        self.frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f'FrameArchive({self.path!r}, frames={len(self)}, shape={self.shape}, dtype={self.dtype})'
+
+# ============= EOF =============================================
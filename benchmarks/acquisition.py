@@ -0,0 +1,287 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    acquisition benchmark suite.
+
+    drives ToupCamCamera through each consumer stage at several resolutions and reports per stage:
+        fps                 frames the stage sustained per second
+        latency_p50/p99_us  publish (end of the SDK callback) to consumer pickup
+        cpu_us_per_frame    consumer thread cpu time spent in the stage
+        wall_us_per_frame   wall time spent in the stage
+        alloc_kib_per_frame peak transient allocation of one stage call (tracemalloc pass)
+        dropped/overwritten acquisition counters while the stage ran
+
+    the acquire stage does no work and also reports the process cpu spent per frame by the
+    acquisition callback itself (callback_cpu_us_per_frame).
+
+    without a camera (or with --backend simulated) it runs against simulated.SimulatedLibrary,
+    whose frame rate (--fps) caps the fps a stage can reach.
+
+    python -m benchmarks.acquisition --seconds 5 --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+STAGES = ('acquire', 'cv', 'pil', 'jpeg', 'save')
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100. * (len(values) - 1))))
+    return values[k]
+
+
+def load_backend(name):
+    """
+        import core with the requested backend. auto uses the native library if it loads and sees
+        a camera, the simulator otherwise.
+    :return: name of the backend in use
+    """
+    if name != 'auto':
+        os.environ['TOUPCAM_BACKEND'] = name
+    else:
+        os.environ.setdefault('TOUPCAM_BACKEND', 'native')
+    import core
+    if name != 'auto':
+        return name
+
+    try:
+        # the library is only loaded on first use
+        core.lib.backend
+    except OSError:
+        core.use_backend('simulated')
+        return 'simulated'
+
+    if os.environ['TOUPCAM_BACKEND'] == 'native' and not core.lib.Toupcam_EnumV2(None):
+        core.use_backend('simulated')
+        return 'simulated'
+    return os.environ['TOUPCAM_BACKEND']
+
+
+def make_stages(tmpdir):
+    def acquire(cam, frame):
+        pass
+
+    def cv(cam, frame):
+        cam.get_cv_image(frame.data)
+
+    def pil(cam, frame):
+        cam.get_pilimage(frame)
+
+    def jpeg(cam, frame):
+        buf = io.BytesIO()
+        cam.get_pilimage(frame).save(buf, 'JPEG', quality=75)
+
+    def save(cam, frame):
+        cam.get_pilimage(frame).save(os.path.join(tmpdir, 'frame.jpg'), 'JPEG', quality=75)
+
+    return {'acquire': acquire, 'cv': cv, 'pil': pil, 'jpeg': jpeg, 'save': save}
+
+
+class Consumer(object):
+    """
+        waits for published frames and runs a stage on the newest one, like a polling consumer
+        that is woken up instead of sleeping
+    """
+
+    def __init__(self, cam, stage, trace_allocations=False):
+        self.cam = cam
+        self.stage = stage
+        self.trace_allocations = trace_allocations
+
+        self.published = {}
+        self.latencies = []
+        self.cpu = 0
+        self.wall = 0
+        self.allocations = []
+        self.frames = 0
+
+        self._event = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def on_frame(self, frame):
+        # acquisition thread, end of the callback
+        self.published[frame.seq] = time.perf_counter()
+        self._event.set()
+
+    def start(self):
+        self._running = True
+        self.cam.add_frame_listener(self.on_frame)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._event.set()
+        self._thread.join()
+        self.cam.remove_frame_listener(self.on_frame)
+
+    def _run(self):
+        cam = self.cam
+        stage = self.stage
+        last = None
+        while self._running:
+            self._event.wait(1)
+            self._event.clear()
+            frame = cam.acquire_frame()
+            if frame is None:
+                continue
+
+            with frame:
+                if frame.seq == last:
+                    continue
+                last = frame.seq
+
+                t = self.published.pop(frame.seq, None)
+                if t is not None:
+                    self.latencies.append((time.perf_counter() - t) * 1e6)
+
+                if self.trace_allocations:
+                    tracemalloc.reset_peak()
+                    base = tracemalloc.get_traced_memory()[0]
+
+                c0, w0 = time.thread_time(), time.perf_counter()
+                stage(cam, frame)
+                self.cpu += time.thread_time() - c0
+                self.wall += time.perf_counter() - w0
+
+                if self.trace_allocations:
+                    self.allocations.append(tracemalloc.get_traced_memory()[1] - base)
+                self.frames += 1
+
+            # frames that were never picked up
+            if len(self.published) > 1000:
+                self.published.clear()
+
+
+def run_stage(cam, name, stage, seconds, trace_allocations=False):
+    consumer = Consumer(cam, stage, trace_allocations)
+    cam.counters.reset()
+    consumer.start()
+    c0, t0 = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    consumer.stop()
+    c1, t1 = time.process_time(), time.perf_counter()
+    counters = cam.get_counters()
+
+    n = max(consumer.frames, 1)
+    result = {'stage': name,
+              'frames': consumer.frames,
+              'fps': consumer.frames / (t1 - t0),
+              'latency_p50_us': percentile(consumer.latencies, 50),
+              'latency_p99_us': percentile(consumer.latencies, 99),
+              'cpu_us_per_frame': consumer.cpu * 1e6 / n,
+              'wall_us_per_frame': consumer.wall * 1e6 / n,
+              'dropped': counters['dropped'],
+              'overwritten': counters['overwritten']}
+    if name == 'acquire':
+        # the consumer does no work, so the process cpu is the acquisition callback's
+        result['callback_cpu_us_per_frame'] = ((c1 - c0) - consumer.cpu) * 1e6 / max(counters['received'], 1)
+    if trace_allocations:
+        result['alloc_kib_per_frame'] = sum(consumer.allocations) / n / 1024.
+    return result
+
+
+def run(resolutions, stages, seconds, allocations=True):
+    from camera import ToupCamCamera
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        funcs = make_stages(tmpdir)
+        for resolution in resolutions:
+            cam = ToupCamCamera(resolution=resolution)
+            try:
+                if not cam.open():
+                    raise RuntimeError(f'failed to open camera at resolution {resolution}')
+                w, h = (v.value for v in cam.get_size())
+                # let the stream settle
+                time.sleep(0.5)
+
+                for name in stages:
+                    r = run_stage(cam, name, funcs[name], seconds)
+                    if allocations:
+                        tracemalloc.start()
+                        try:
+                            a = run_stage(cam, name, funcs[name], min(seconds, 1), True)
+                        finally:
+                            tracemalloc.stop()
+                        r['alloc_kib_per_frame'] = a['alloc_kib_per_frame']
+
+                    r.update(resolution=resolution, width=w, height=h)
+                    results.append(r)
+                    print('{:>5}x{:<5} {:<8} {:>7.1f} fps  p50 {:>8.0f} us  p99 {:>8.0f} us  '
+                          'cpu {:>8.0f} us/frame'.format(w, h, name, r['fps'], r['latency_p50_us'],
+                                                         r['latency_p99_us'], r['cpu_us_per_frame']),
+                          file=sys.stderr)
+            finally:
+                cam.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ToupCamCamera acquisition benchmarks')
+    parser.add_argument('--backend', default='auto', choices=('auto', 'native', 'simulated'))
+    parser.add_argument('--resolutions', default='0,1,2', help='comma separated resolution indices')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma separated subset of ' + ','.join(STAGES))
+    parser.add_argument('--seconds', type=float, default=5, help='measurement time per stage')
+    parser.add_argument('--no-allocations', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--fps', type=float, help='simulated frame rate, raise it to find where a stage saturates')
+    parser.add_argument('--json', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f'unknown stages {sorted(unknown)}')
+
+    if args.fps:
+        os.environ['TOUPCAM_SIM_FPS'] = str(args.fps)
+    backend = load_backend(args.backend)
+    resolutions = [int(r) for r in args.resolutions.split(',')]
+    # keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(resolutions, stages, args.seconds, not args.no_allocations)
+
+    report = {'backend': backend,
+              'seconds': args.seconds,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'timestamp': time.time(),
+              'results': results}
+
+    if args.json:
+        with open(args.json, 'w') as wfile:
+            json.dump(report, wfile, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
+# ============= EOF =============================================
@@ -0,0 +1,92 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    compare pull mode and push mode acquisition.
+
+    latency is measured from the hardware timestamp to the moment the frame is published to
+    listeners. the camera and host clocks are not synchronized, so latencies are reported
+    relative to the fastest frame of the run (offset = min(host - hardware)).
+    cpu is the process cpu time spent per received frame.
+
+    python -m benchmarks.acquisition_modes [--seconds 10] [--resolution 2] [--json]
+"""
+import argparse
+import json
+import time
+
+from benchmarks.acquisition import percentile
+from camera import ToupCamCamera, PULL_MODE, PUSH_MODE
+from core import TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP
+
+
+def run(mode, duration, resolution):
+    offsets = []
+
+    def on_frame(frame):
+        if frame.flag & TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP:
+            offsets.append(time.perf_counter() * 1e6 - frame.timestamp)
+
+    cam = ToupCamCamera(resolution=resolution, mode=mode)
+    cam.add_frame_listener(on_frame)
+    try:
+        if not cam.open():
+            raise RuntimeError(f'failed to start {mode} mode')
+
+        # let the stream settle before measuring
+        time.sleep(1)
+        cam.counters.reset()
+        del offsets[:]
+
+        c0, t0 = time.process_time(), time.perf_counter()
+        time.sleep(duration)
+        c1, t1 = time.process_time(), time.perf_counter()
+        counters = cam.get_counters()
+    finally:
+        cam.close()
+
+    n = max(counters['received'], 1)
+    base = min(offsets) if offsets else 0
+    latencies = [o - base for o in offsets]
+    return {'mode': mode,
+            'fps': counters['received'] / (t1 - t0),
+            'latency_p50_us': percentile(latencies, 50),
+            'latency_p99_us': percentile(latencies, 99),
+            'cpu_us_per_frame': (c1 - c0) * 1e6 / n,
+            'dropped': counters['dropped']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10., help='measured time per mode')
+    parser.add_argument('--resolution', type=int, default=2, help='resolution index')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = [run(mode, args.seconds, args.resolution) for mode in (PULL_MODE, PUSH_MODE)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:<6}{:>10}{:>18}{:>18}{:>16}{:>10}'.format('mode', 'fps', 'latency p50 us', 'latency p99 us',
+                                                        'cpu us/frame', 'dropped'))
+    for r in results:
+        print('{mode:<6}{fps:>10.1f}{latency_p50_us:>18.0f}{latency_p99_us:>18.0f}'
+              '{cpu_us_per_frame:>16.0f}{dropped:>10}'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
+# ============= EOF =============================================
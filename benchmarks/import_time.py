@@ -0,0 +1,96 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    cold start cost of the package's modules.
+
+    every module is imported in a fresh interpreter, so nothing is shared between runs. reported
+    are the median wall time of the import, the time until the first camera enumeration, and the
+    heavy third-party modules the import itself pulled in (none of them should be needed before
+    the first frame; the simulated backend loads numpy when it is first used).
+
+    python -m benchmarks.import_time [--runs 7] [--backend simulated] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ('core', 'camera_enumeration', 'camera', 'group', 'recorder')
+HEAVY = ('numpy', 'cv2', 'PIL', 'asyncio')
+
+PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+enum = None
+if {enumerate}:
+    from camera_enumeration import EnumCameras
+    EnumCameras()
+    enum = time.perf_counter() - t0
+import json
+print(json.dumps([t1 - t0, enum, heavy]))
+"""
+
+
+def probe(module, enumerate_cameras, env):
+    code = PROBE.format(module=module, enumerate=enumerate_cameras, heavy=HEAVY)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(module, runs, env):
+    imports, enums, heavy = [], [], []
+    for _ in range(runs):
+        t, enum, heavy = probe(module, module in ('camera_enumeration', 'camera'), env)
+        imports.append(t * 1e3)
+        if enum is not None:
+            enums.append(enum * 1e3)
+
+    return {'module': module,
+            'import_ms': statistics.median(imports),
+            'first_enum_ms': statistics.median(enums) if enums else None,
+            'heavy_modules': heavy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--backend', default='simulated', choices=('native', 'simulated'))
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, TOUPCAM_BACKEND=args.backend)
+    results = [measure(m, args.runs, env) for m in args.modules]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"module":<20}{"import ms":>12}{"first enum ms":>16}  heavy modules')
+    for r in results:
+        enum = '' if r['first_enum_ms'] is None else f'{r["first_enum_ms"]:.1f}'
+        print(f'{r["module"]:<20}{r["import_ms"]:>12.1f}{enum:>16}  {", ".join(r["heavy_modules"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
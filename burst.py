@@ -0,0 +1,100 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import ctypes
+import threading
+# ============= local library imports  ==========================
+
+DEFAULT_TIMEOUT = 10.
+
+
+class StackCapture(object):
+    """
+        n frames pulled straight into consecutive planes of one preallocated stack.
+
+        the acquisition thread fills the planes in order; nothing is allocated per frame.
+    """
+
+    def __init__(self, n, shape, dtype, out=None):
+        """
+        :param n: number of frames
+        :param shape: (h, w) of one frame as pulled from the SDK
+        :param dtype: dtype of the SDK frame, uint32 for RGB32
+        :param out: optional stack to fill, (n, h, w) of dtype, or for RGB32 its (n, h, w, 4) uint8 view
+        """
+        from numpy import dtype as np_dtype, empty, uint8, uint32, uint64, zeros
+
+        dtype = np_dtype(dtype)
+        shape = (n,) + tuple(shape)
+        if out is None:
+            out = empty(shape, dtype=dtype)
+        elif dtype == uint32 and out.dtype == uint8 and out.shape == shape + (4,):
+            out = out.view(uint32).reshape(shape)
+        if out.shape != shape or out.dtype != dtype or not out.flags.c_contiguous:
+            raise ValueError(f'out needs to be a contiguous {shape} {dtype} array, got {out.shape} {out.dtype}')
+
+        self.n = n
+        self.data = out
+        self.nbytes = out[0].nbytes if n else 0
+        self.timestamps = zeros(n, dtype=uint64)
+        self.seqs = zeros(n, dtype=uint32)
+        self.count = 0
+        self.failed = 0
+        self._pointers = [ctypes.c_void_p(out[i].ctypes.data) for i in range(n)]
+        self._done = threading.Event()
+        if not n:
+            self._done.set()
+
+    @property
+    def stack(self):
+        """
+            the filled stack, RGB32 frames as (n, h, w, 4) BGRA bytes
+        """
+        data = self.data
+        if data.dtype == 'uint32':
+            return data.view('uint8').reshape(data.shape + (4,))
+        return data
+
+    @property
+    def pending(self):
+        return self.count < self.n
+
+    def pointer(self, i):
+        return self._pointers[i]
+
+    def done(self, i, info, ok):
+        """
+            called by the acquisition thread after frame i was pulled
+        """
+        if not ok:
+            # the slot is filled by the next frame
+            self.failed += 1
+            return
+
+        self.timestamps[i] = info.timestamp
+        self.seqs[i] = info.seq
+        self.count = i + 1
+        if self.count == self.n:
+            self._done.set()
+
+    def wait(self, timeout=DEFAULT_TIMEOUT):
+        """
+        :return: True if all n frames arrived
+        """
+        return self._done.wait(timeout)
+
+# ============= EOF =============================================
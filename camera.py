@@ -18,203 +18,1095 @@
 # ============= standard library imports ========================
 import ctypes
 import os
+import sys
+import threading
+import time
+from collections import deque
 
-from PIL import Image
-import cv2
-from numpy import zeros, uint8, uint32
-from io import StringIO
+from io import BytesIO
 # ============= local library imports  ==========================
-from core import lib, TOUPCAM_EVENT_IMAGE, TOUPCAM_EVENT_STILLIMAGE, success, HToupCam
+from core import lib, TOUPCAM_EVENT_EXPOSURE, TOUPCAM_EVENT_IMAGE, TOUPCAM_EVENT_STILLIMAGE, \
+    TOUPCAM_EVENT_TEMPTINT, TOUPCAM_FRAMEINFO_FLAG_SEQ, TOUPCAM_OPTION_BINNING, TOUPCAM_OPTION_BITDEPTH, \
+    TOUPCAM_OPTION_RAW, TOUPCAM_OPTION_RGB, TOUPCAM_OPTION_TRIGGER, success, HToupCam, ToupcamFrameInfoV2
+from burst import StackCapture, DEFAULT_TIMEOUT
+from camera_enumeration import registry
+from conversion import FrameConverter, BGR, RGB
+from demosaic import bayer_pattern, fourcc_to_str
+from frames import BufferPool, Frame, FrameCounters, FrameRing, DEFAULT_SLOTS
+from properties import Settings, EXPOSURE_PROPERTIES, TEMPTINT_PROPERTIES, reshapes
+from toupcamflags import ToupCamFlags
+from streams import AwaitableFuture, FrameStream, LATEST
+from writer import StillWriter
+
+PULL_MODE = 'pull'
+PUSH_MODE = 'push'
 
 
 class ToupCamCamera(object):
-    _data = None
+    _ring = None
     _frame_fn = None
     _temptint_cb = None
     _save_path = None
+    # StackCapture being filled by burst() / trigger_sequence()
+    _burst = None
+    _capture = None
+    _stack = None
 
     resolution = None
     size = None
     frame_rate = None
     max_frame_rate = None
 
-    def __init__(self, resolution=None, bits=32, size=None):
+    raw = False
+    high_bitdepth = False
+    bitdepth = 8
+    raw_format = None
+    # (x, y, w, h) of the sensor region, None for the full frame
+    roi = None
+    # TOUPCAM_OPTION_BINNING value
+    binning = 1
+
+    def __init__(self, resolution=None, bits=32, size=None, buffer_count=DEFAULT_SLOTS, mode=PULL_MODE,
+                 raw=False, high_bitdepth=False, cid=None):
+        """
+        :param cid: id of the camera to open (CameraProperties.id), None opens the first camera
+        :param raw: pull the sensor's raw data (TOUPCAM_OPTION_RAW) instead of SDK processed RGB32.
+            frames are (h, w) uint8, or uint16 with high_bitdepth, and are only demosaiced when a
+            color image is asked for.
+        :param high_bitdepth: in raw mode, use the sensor's full bit depth (TOUPCAM_OPTION_BITDEPTH)
+        """
 
         if resolution is None and size is None:
             resolution = 2
 
         # int bits: 24, 32 or 8, means RGB24, RGB32 or 8 bits grey images. This parameter is ignored in RAW mode.
-        if bits not in (32,):
+        if not raw and bits not in (32,):
             raise ValueError('Bits needs to by 8 or 32')
 
+        self.raw = raw
+        self.high_bitdepth = high_bitdepth
+
         if size is None:
             self.resolution = resolution
         else:
             self.size = size
 
-        self.cam = self.get_camera()
+        self.cid = cid
+        self.cam = self.get_camera(cid)
+        self.settings = Settings(self)
         self.bits = bits
+        self.buffer_count = buffer_count
+        self.mode = mode
+        self.counters = FrameCounters()
+        self.last_still = None
+        self._last_seq = None
+        self._skipped = 0
+        self._frame_listeners = ()
+        self._snap_requests = deque()
+        self._still_pool = BufferPool()
+        self._writer = None
+        self._recorder = None
+        self._preview = None
+        self._statistics = None
+        # SharedFramePublisher while the ring lives in shared memory, see share()
+        self._publisher = None
+        self._pipelines = []
+        # Instruments while instrument() is on, the hot path tests it for None
+        self._instruments = None
+        # rings of the camera's listed resolutions not in use, {(shape, dtype): FrameRing}
+        self._rings = {}
+        # (index, seconds) of the last switch_resolution()
+        self.switch_latency = None
+        # held by the pull mode callback while it fills a ring slot, see _reshape
+        self._geometry_lock = threading.Lock()
+        self.converter = FrameConverter()
+        # (exposure time us, analog gain %), kept current for the recorder's frame index
+        self.exposure = (0, 0)
 
     # icamera interface
     def save(self, p, extension='JPEG', *args, **kw):
-        image = self.get_pil_image()
+        image = self.get_pilimage()
 
         image.save(p, extension, *args, **kw)
 
     def save_jpeg(self, p, quality=100):
-        im = self.get_pil_image()
+        im = self.get_pilimage()
         im.save(p, 'JPEG', quality=quality)
 
     def save_tiff(self, p):
-        im = self.get_pil_image()
+        im = self.get_pilimage()
         im.save(p, 'TIFF')
 
     def get_jpeg_data(self, data=None, quality=75):
 
-        im = self.get_pil_image(data)
+        """
+            the latest frame (or data) encoded as JPEG. every call encodes again; use preview()
+            to share encodes between several viewers.
+        :return: bytes
+        """
+        im = self.get_pilimage(data)
 
-        s = StringIO()
+        s = BytesIO()
         im.save(s, 'JPEG', quality=quality)
-        s.seek(0, os.SEEK_END)
-
         return s.getvalue()
 
     def get_cv_image(self, data=None):
-        # im = self._data
+        """
+            the latest frame (or data) as BGR for OpenCV. the latest frame is pinned while it is
+            copied out, so the result is never torn by the writer; pass a pinned Frame's data
+            (see acquire_frame) for a zero-copy view instead.
+        """
+        if self.raw:
+            return self.get_image(BGR, data)
+
         if data is None:
-            data = self._data
+            frame = self.acquire_frame()
+            if frame is None:
+                return
+            with frame:
+                data = frame.data
+                return data.view('uint8').reshape(data.shape + (-1,))[..., :3].copy()
 
-        raw = data.view(uint8).reshape(data.shape + (-1,))
-        bgr = raw[..., :3]
-        print(f"BGR shape:{bgr.shape}")
-        return bgr
+        raw = data.view('uint8').reshape(data.shape + (-1,))
+        return raw[..., :3]
 
     def get_pilimage(self, data=None):
-        # im = self._data
+        rgb = self.get_image(RGB, data)
+        if rgb is not None:
+            from PIL import Image
+
+            if rgb.dtype != 'uint8':
+                # PIL has no 16 bit RGB mode, keep the most significant 8 bits
+                rgb = (rgb >> (self.bitdepth - 8)).astype('uint8')
+            return Image.fromarray(rgb, 'RGB')
+
+    def get_image(self, fmt=RGB, data=None, out=None):
+        """
+            the latest frame (or data) converted to fmt in one pass. conversions of live frames
+            are cached per frame (see Frame.key) and shared by every caller.
+
+        :param fmt: RGB, BGR, RGBA or GRAY, see conversion.py
+        :param data: frame data or a Frame, defaults to the latest frame
+        :param out: optional preallocated output array
+        :return: read-only array for cached results, out otherwise
+        """
+        converter = self.converter
+        instruments = self._instruments
+        if instruments is not None:
+            t = time.perf_counter()
+
         if data is None:
-            data = self._data
+            frame = self.acquire_frame()
+            if frame is None:
+                return
+            with frame:
+                image = converter.convert(frame.data, fmt, frame.key, out)
+        elif isinstance(data, Frame):
+            image = converter.convert(data.data, fmt, data.key, out)
+        else:
+            image = converter.convert(data, fmt, out=out)
 
-        raw = data.view(uint8).reshape(data.shape + (-1,))
-        bgr = raw[..., :3]
-        image = Image.fromarray(bgr, 'RGB')
-        b, g, r = image.split()
-        return Image.merge('RGB', (r, g, b))
+        if instruments is not None:
+            instruments.convert(time.perf_counter() - t)
+        return image
 
     def get_image_data(self, *args, **kw):
-        d = self._data
-        return d
+        """
+            copy of the latest complete frame, taken while the frame is pinned. use acquire_frame()
+            for zero-copy access; an unpinned view would be overwritten once the writer has cycled
+            through the other slots.
+        """
+        frame = self.acquire_frame()
+        if frame is not None:
+            with frame:
+                return frame.data.copy()
+
+    def acquire_frame(self):
+        """
+            pin the latest complete frame. the returned Frame must be released (or used as a
+            context manager) so its slot can be reused by the acquisition callback.
+        :return: Frame or None
+        """
+        if self._ring is not None:
+            return self._ring.acquire_latest()
+
+    def get_counters(self):
+        """
+            snapshot of the acquisition counters
+        :return: dict with received, dropped, consumed and overwritten
+        """
+        return self.counters.snapshot()
+
+    def stats(self):
+        """
+            the acquisition counters, the ring occupancy and, with instrument() on, the frame
+            count and histograms, see instrumentation.py
+        :return: dict
+        """
+        stats = {'counters': self.counters.snapshot()}
+        ring = self._ring
+        if ring is not None:
+            stats['ring'] = {'slots': ring.nslots, 'pinned': ring.pinned}
+        instruments = self._instruments
+        if instruments is not None:
+            stats.update(instruments.snapshot())
+        return stats
+
+    def instrument(self, *exporters, enabled=True):
+        """
+            turn the hot path instrumentation on (or off), see instrumentation.py
+        :param exporters: e.g. LoggingExporter(), PrometheusExporter(port=9100), CallbackExporter(func)
+        :param enabled: False stops the exporters and takes the instrumentation out of the hot path
+        :return: Instruments, None when disabled
+        """
+        instruments = self._instruments
+        if not enabled:
+            self._instruments = None
+            if instruments is not None:
+                instruments.stop()
+            return
+
+        if instruments is None:
+            from instrumentation import Instruments
+
+            instruments = Instruments(self.stats)
+            self._instruments = instruments
+        for exporter in exporters:
+            instruments.add_exporter(exporter)
+        return instruments
+
+    @property
+    def instruments(self):
+        return self._instruments
 
     def close(self):
+        if self._recorder is not None:
+            self._recorder.stop()
+            self._recorder = None
+
+        if self._preview is not None:
+            self._preview.stop()
+            self._preview = None
+
+        if self._statistics is not None:
+            self._statistics.stop()
+
+        for pipeline in self._pipelines:
+            pipeline.stop()
+        self._pipelines = []
+
+        self.instrument(enabled=False)
+
         if self.cam:
             lib.Toupcam_Close(self.cam)
+        self._rings = {}
+
+        if self._publisher is not None:
+            # the SDK no longer writes into the shared slots
+            self._publisher.close()
+            self._publisher = None
 
-    def open(self):
-        if self.resolution:
+        if self._writer is not None:
+            # let queued stills finish writing
+            self._writer.shutdown()
+            self._writer = None
+
+    def open(self, mode=None):
+        """
+            start acquisition
+        :param mode: PULL_MODE or PUSH_MODE. defaults to the mode given to the constructor.
+            pull mode: the SDK signals TOUPCAM_EVENT_IMAGE and we pull the frame into a ring slot.
+            push mode: the SDK hands us its own buffer and we copy it into a ring slot once.
+        :return: True if the stream started
+        """
+        if mode is None:
+            mode = self.mode
+        if mode not in (PULL_MODE, PUSH_MODE):
+            raise ValueError(f'mode needs to be {PULL_MODE!r} or {PUSH_MODE!r}, got {mode!r}')
+        self.mode = mode
+        # only the pull mode callback is told about exposure and white balance changes
+        self.settings.events = mode == PULL_MODE
+
+        if self.resolution is not None:
             self.set_esize(self.resolution)
         else:
             self.set_size(*self.size)
+        if self.roi:
+            # a new resolution resets the ROI
+            self.settings.put('Roi', *self.roi)
+        if self.binning != 1:
+            self.settings.put_option(TOUPCAM_OPTION_BINNING, self.binning)
+
+        shape = self._frame_shape()
+        if self.raw:
+            dtype = self._setup_raw()
+        elif self.settings.get_option(TOUPCAM_OPTION_RAW):
+            # back from raw mode
+            self.settings.put_option(TOUPCAM_OPTION_RAW, 0)
+            # RGB32 frames from here on, nothing to demosaic
+            self.raw_format, self.bitdepth = None, 8
+            self.converter.bayer = None
+            dtype = 'uint32'
+        elif self.bits == 8:
+            dtype = 'uint8'
+        else:
+            dtype = 'uint32'
+
+        # Users have to make sure that the data buffer capacity is enough to save the image data.
+        # every slot is allocated here so the callback never has to.
+        ring = self._new_ring(shape, dtype)
+        self._retire_ring(self._ring)
+        self._ring = ring
+        self._new_stream()
+        self._skipped = 0
+        self._update_exposure()
+
+        bits = ctypes.c_int(self.bits)
+        if mode == PUSH_MODE:
+            result = self._start_push_mode(bits)
+        else:
+            result = self._start_pull_mode(bits)
+
+        return success(result)
+
+    def add_frame_listener(self, func):
+        """
+            call func(frame) on the acquisition thread every time a live frame is published.
+            the frame is only pinned while func runs; use frame.retain() to keep it longer.
+            func must be fast, it delays the delivery of the next frame.
+        """
+        self._frame_listeners = self._frame_listeners + (func,)
+
+    def remove_frame_listener(self, func):
+        self._frame_listeners = tuple(f for f in self._frame_listeners if f is not func)
+
+    def frames(self, policy=LATEST, maxsize=2):
+        """
+            async iterator of live frames, must be called from a running event loop
+
+            async with cam.frames(policy=QUEUE, maxsize=2) as stream:
+                async for frame in stream:
+                    ...
+
+            a stream keeps pinning frames until it is closed, so prefer the async with form
+            when the loop may break early.
+
+        :param policy: LATEST, QUEUE or BLOCK, see streams.py
+        :param maxsize: queue depth for QUEUE and BLOCK. queued frames stay pinned, so keep it
+            below buffer_count or the ring will skip frames.
+        :return: FrameStream
+        """
+        return FrameStream(self, policy, maxsize)
+
+    def snap(self, resolution=None, path=None, extension='JPEG', **kw):
+        """
+            request a still image
+            Toupcam_Snap(HToupCam h, unsigned nResolutionIndex);
+
+            the still is pulled into a reused buffer on the acquisition thread; encoding and
+            writing happen on the still writer's thread.
+
+        :param resolution: still resolution index, defaults to the current preview resolution
+        :param path: if given, save the still here before resolving the future
+        :param extension: PIL format name used with path, e.g. JPEG, TIFF, PNG
+        :param kw: passed on to PIL.Image.save, e.g. quality=95
+        :return: future resolved with the still Frame; it can be awaited from a coroutine.
+            release the frame when done so its buffer can be reused.
+        """
+        if resolution is None:
+            resolution = self.resolution or 0
+
+        future = AwaitableFuture()
+        request = (future, path, extension, kw)
+        self._snap_requests.append(request)
+        if not self._lib_func('Snap', ctypes.c_uint(resolution)):
+            self._snap_requests.remove(request)
+            future.set_exception(IOError(f'Toupcam_Snap failed, resolution={resolution}'))
+        return future
+
+    def burst(self, n, resolution=None, out=None, timeout=DEFAULT_TIMEOUT):
+        """
+            take n stills with one Toupcam_SnapN(HToupCam h, unsigned nResolutionIndex, unsigned nNumber)
+            and pull them straight into one preallocated stack
+
+        :param n: number of stills
+        :param resolution: still resolution index, defaults to the current preview resolution
+        :param out: stack to fill, see StackCapture. without it the stack of the previous burst
+            of the same size is reused, so copy results that have to outlive the next burst.
+        :param timeout: seconds to wait for the last still
+        :return: (stack (n, h, w[, c]), timestamps (n,) uint64 in microseconds)
+        """
+        if self._ring is None:
+            raise RuntimeError('camera is not open')
+        if resolution is None:
+            resolution = self.resolution or 0
+
+        size = self.get_still_resolution(resolution)
+        if size is None:
+            raise ValueError(f'invalid still resolution {resolution}')
+
+        w, h = size
+        capture = self._stack_capture(n, (h, w), out)
+        self._burst = capture
+        try:
+            if not self._lib_func('SnapN', ctypes.c_uint(resolution), ctypes.c_uint(n)):
+                raise IOError(f'Toupcam_SnapN failed, resolution={resolution}, n={n}')
+            if not capture.wait(timeout):
+                raise TimeoutError(f'burst received {capture.count} of {n} stills')
+        finally:
+            self._burst = None
+        return capture.stack, capture.timestamps
+
+    def trigger_sequence(self, n, out=None, timeout=DEFAULT_TIMEOUT):
+        """
+            software trigger n live frames and pull them straight into one preallocated stack.
+            the camera is put into trigger mode for the sequence and back into its previous mode
+            afterwards. frames of the sequence are not published to frame listeners.
+
+        :param out: stack to fill, see burst()
+        :return: (stack (n, h, w[, c]), timestamps (n,) uint64 in microseconds)
+        """
+        ring = self._ring
+        if ring is None:
+            raise RuntimeError('camera is not open')
+
+        mode = self.settings.get_option(TOUPCAM_OPTION_TRIGGER)
+        capture = self._stack_capture(n, ring.shape, out)
+        self._capture = capture
+        try:
+            if mode != 1:
+                self.set_trigger_mode(1)
+            if not self.trigger(n):
+                raise IOError(f'Toupcam_Trigger failed, n={n}')
+            if not capture.wait(timeout):
+                self.trigger(0)
+                raise TimeoutError(f'trigger sequence received {capture.count} of {n} frames')
+        finally:
+            self._capture = None
+            if mode != 1:
+                self.set_trigger_mode(mode)
+        return capture.stack, capture.timestamps
+
+    def record(self, path, video_path=None, **kw):
+        """
+            stream live frames into a raw container at path, see recorder.py
+        :param video_path: also encode the frames into this video file
+        :param kw: Recorder options, e.g. chunk_frames, max_chunks, fourcc
+        :return: the started Recorder. stop() it to finish the files; close() stops it too.
+        """
+        if self._recorder is not None and self._recorder.recording:
+            raise RuntimeError(f'already recording to {self._recorder.path}')
+
+        from recorder import Recorder
+
+        recorder = Recorder(self, **kw)
+        recorder.start(path, video_path)
+        self._recorder = recorder
+        return recorder
+
+    def preview(self, port=8080, host='127.0.0.1', **kw):
+        """
+            serve the live frames as MJPEG over HTTP, see preview.py
+        :param kw: PreviewServer options, e.g. tiers, max_fps
+        :return: the started PreviewServer. stop() it to shut it down; close() stops it too.
+        """
+        if self._preview is not None and self._preview.running:
+            raise RuntimeError(f'already serving a preview on {self._preview.address}')
+
+        from preview import PreviewServer
+
+        server = PreviewServer(self, host, port, **kw)
+        server.start()
+        self._preview = server
+        return server
+
+    @property
+    def statistics(self):
+        """
+            FrameStatistics of the live frames, see framestats.py
+        """
+        if self._statistics is None:
+            from framestats import FrameStatistics
+
+            self._statistics = FrameStatistics(self)
+        return self._statistics
 
-        args = self.get_size()
-        if not args:
+    def focus_sweep(self, metric='laplacian', roi=None, **kw):
+        """
+            score every live frame while the focus moves, see focus.py
+        :param metric: laplacian, tenengrad or clarity
+        :param roi: (x, y, w, h) scored region, None for the whole frame
+        :param kw: FocusSweep options, e.g. patience, falloff, position, on_peak
+        :return: the started FocusSweep, wait() for its best FocusScore
+        """
+        from focus import FocusScorer, FocusSweep
+
+        return FocusSweep(FocusScorer(self, metric, roi), **kw).start()
+
+    def pipeline(self, *stages, **kw):
+        """
+            run stages on a thread or process pool for every live frame, see pipeline.py
+        :param stages: stage functions, each gets the previous one's result, the first the frame data
+        :param kw: Pipeline options, e.g. executor, workers, max_in_flight, policy, on_result
+        :return: the started Pipeline. stop() it to finish; close() stops it too.
+        """
+        from pipeline import Pipeline
+
+        pipeline = Pipeline(self, stages, **kw).start()
+        self._pipelines = [p for p in self._pipelines if p._running] + [pipeline]
+        return pipeline
+
+    def accumulate(self, mode='mean', n=None, **kw):
+        """
+            fold every live frame into one preallocated accumulator, see accumulate.py
+        :param mode: mean, sum or ema
+        :param n: stop after n frames (mean and sum)
+        :param kw: Accumulator options, e.g. alpha, sigma, calibration
+        :return: the started Accumulator, wait() for it and take its image() or result()
+        """
+        from accumulate import Accumulator
+
+        return Accumulator(self, mode, n, **kw).start()
+
+    def share(self, name=None, capacity=0):
+        """
+            move the frame ring into shared memory so other processes can read the live frames
+            without copies, see sharedring.py. works before open() and on a running stream.
+        :param name: segment name the subscribers attach to, None picks one
+        :param capacity: bytes reserved per slot, e.g. for the full frame when a ROI is set
+        :return: SharedFramePublisher, its name is what SharedFrameSubscriber needs
+        """
+        if self._publisher is not None:
+            raise RuntimeError(f'frames are already shared as {self._publisher.name}')
+
+        from sharedring import SharedFramePublisher
+
+        self._publisher = SharedFramePublisher(name, self.buffer_count, capacity)
+        ring = self._ring
+        if ring is not None:
+            with self._geometry_lock:
+                self._ring = self._new_ring(ring.shape, ring.dtype)
+                self._new_stream()
+        return self._publisher
+
+    def unshare(self):
+        """
+            back to a private frame ring; the subscribers see the shared frames end
+        """
+        publisher, self._publisher = self._publisher, None
+        if publisher is None:
             return
+        ring = self._ring
+        if ring is not None:
+            with self._geometry_lock:
+                self._ring = self._new_ring(ring.shape, ring.dtype)
+                self._new_stream()
+        publisher.close()
+
+    def ffc_once(self):
+        """
+            Toupcam_FfcOnce(HToupCam h); flat field correction from the next frames, done by the SDK
+        """
+        return self._lib_func('FfcOnce')
 
-        h, w = args[1].value, args[0].value
+    def dfc_once(self):
+        """
+            Toupcam_DfcOnce(HToupCam h); dark field correction from the next frames, done by the SDK
+        """
+        return self._lib_func('DfcOnce')
+
+    def export_ffc(self, path):
+        """
+            Toupcam_FfcExport(HToupCam h, const TCHAR* filepath)
+        """
+        return self._lib_func('FfcExport', self._sdk_path(path))
 
-        shape = (h, w)
-        if self.bits == 8:
-            dtype = uint8
+    def import_ffc(self, path):
+        """
+            Toupcam_FfcImport(HToupCam h, const TCHAR* filepath)
+        """
+        return self._lib_func('FfcImport', self._sdk_path(path))
+
+    def export_dfc(self, path):
+        """
+            Toupcam_DfcExport(HToupCam h, const TCHAR* filepath)
+        """
+        return self._lib_func('DfcExport', self._sdk_path(path))
+
+    def import_dfc(self, path):
+        """
+            Toupcam_DfcImport(HToupCam h, const TCHAR* filepath)
+        """
+        return self._lib_func('DfcImport', self._sdk_path(path))
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            self._writer = StillWriter(self.get_pilimage)
+        return self._writer
+
+    def get_raw_format(self):
+        """
+            Toupcam_get_RawFormat(HToupCam h, unsigned* nFourCC, unsigned* bitsperpixel);
+        :return: (fourcc str, bits per pixel), e.g. ('RGGB', 12)
+        """
+        fourcc, bpp = ctypes.c_uint(), ctypes.c_uint()
+        if self._lib_func('get_RawFormat', ctypes.byref(fourcc), ctypes.byref(bpp)):
+            return fourcc_to_str(fourcc.value), bpp.value
+
+    # private
+    def _stack_capture(self, n, shape, out):
+        dtype = self._ring.dtype
+        if out is None:
+            # reuse the last stack of the same geometry instead of allocating hundreds of MB again
+            last = self._stack
+            if last is not None and last.shape == (n,) + tuple(shape) and last.dtype == dtype:
+                out = last
+        capture = StackCapture(n, shape, dtype, out)
+        self._stack = capture.data
+        return capture
+
+    def _frame_shape(self):
+        """
+            (h, w) of the frames the stream delivers with the current resolution, ROI and binning
+        """
+        if self.roi:
+            w, h = self.roi[2:]
         else:
-            dtype = uint32
+            w, h = self.settings.get('Size')
+        n = self.binning & 0x3f or 1
+        return h // n, w // n
 
-        # Users have to make sure that the data buffer capacity is enough to save the image data.
-        self._data = zeros(shape, dtype=dtype)
+    def _reshape(self, writes):
+        """
+            write ROI/binning changes and swap in a ring of the new frame size without restarting
+            the stream. the pull callback holds the geometry lock while it fills a slot, so no
+            frame is ever pulled into a slot of the wrong size; frames still queued in the SDK
+            are flushed.
+        """
+        if self._recorder is not None and self._recorder.recording:
+            raise RuntimeError('stop the recording before changing the ROI or binning')
 
-        bits = ctypes.c_int(self.bits)
+        ring = self._ring
+        if ring is None:
+            self.settings.write(writes)
+            return
+
+        with self._geometry_lock:
+            self._lib_func('Pause', 1)
+            try:
+                self.settings.write(writes)
+                self._lib_func('Flush')
+                shape = self._frame_shape()
+                if shape != ring.shape:
+                    # readers keep the frames they pinned, the old slots are freed with them
+                    self._ring = self._new_ring(shape, ring.dtype)
+                    self._retire_ring(ring)
+                    self._new_stream()
+            finally:
+                self._lib_func('Pause', 0)
+
+    def _new_stream(self):
+        """
+            forget the previous stream: its sequence numbering and the conversions and statistics
+            cached for it
+        """
+        self._last_seq = None
+        self.converter.clear()
+        if self._statistics is not None:
+            self._statistics.clear()
+
+    def _new_ring(self, shape, dtype):
+        if self._publisher is not None:
+            return self._publisher.ring(shape, dtype, self.buffer_count, self.counters)
+
+        from numpy import dtype as np_dtype
+
+        ring = self._rings.pop((tuple(shape), np_dtype(dtype)), None)
+        if ring is not None and ring.nslots == self.buffer_count:
+            ring.reset()
+            return ring
+        return FrameRing(shape, dtype, self.buffer_count, self.counters)
+
+    def _retire_ring(self, ring):
+        """
+            keep a ring that is no longer streamed into if it has the frame size of one of the
+            camera's resolutions, see switch_resolution
+        """
+        if ring is None or self._publisher is not None or type(ring) is not FrameRing:
+            return
+        if ring.shape in self._resolution_shapes():
+            self._rings[(ring.shape, ring.dtype)] = ring
+
+    def _resolution_shapes(self):
+        """
+            (h, w) of the full frames of every listed resolution at the current binning
+        """
+        props = self.get_properties()
+        n = self.binning & 0x3f or 1
+        return [(h // n, w // n) for w, h in (props.resolutions if props else ())]
+
+    def _setup_raw(self):
+        """
+            switch the stream to raw output. must run before Toupcam_StartXXX
+        :return: dtype of the raw frames
+        """
+        self.settings.put_option(TOUPCAM_OPTION_RAW, 1)
+        self.settings.put_option(TOUPCAM_OPTION_BITDEPTH, int(self.high_bitdepth))
+
+        fmt = self.get_raw_format()
+        if fmt:
+            self.raw_format, self.bitdepth = fmt
+        else:
+            self.raw_format, self.bitdepth = None, 16 if self.high_bitdepth else 8
+
+        # monochromatic sensors (YYYY) have nothing to demosaic
+        self.converter.bayer = bayer_pattern(self.raw_format)
+        return 'uint16' if self.bitdepth > 8 else 'uint8'
+
+    def _start_pull_mode(self, bits):
+        info = ToupcamFrameInfoV2()
+        info_ref = ctypes.byref(info)
+        still_info = ToupcamFrameInfoV2()
+        still_info_ref = ctypes.byref(still_info)
+        pool = self._still_pool
+        counters = self.counters
+        pull = lib.Toupcam_PullImageV2
+        pull_still = lib.Toupcam_PullStillImageV2
+        geometry_lock = self._geometry_lock
 
         def get_frame(nEvent, ctx):
             if nEvent == TOUPCAM_EVENT_IMAGE:
-                w, h = ctypes.c_uint(), ctypes.c_uint()
-
                 '''
                 :param HToupCam: handle to cam
-                :param pImageData: (void*) Data buffer. 
+                :param pImageData: (void*) Data buffer.
                 :param bits: (int) 24, 32 or 8, means RGB24, RGB32 or 8 bits grey images. This parameter is ignored in RAW mode.
-                :param pnWidth: (unsigned*) width of image.
-                :param pnWidth: (unsigned*) height of image.
+                :param pInfo: (ToupcamFrameInfoV2*) width, height, flag, seq and timestamp of the image.
                 '''
-                lib.Toupcam_PullImage(self.cam, ctypes.c_void_p(self._data.ctypes.data), bits,
-                                      ctypes.byref(w),
-                                      ctypes.byref(h))
-                print(f"TOUPCAM_IMAGE_EVENT- width:{w.value}, height:{h.value}; data-length:{len(self._data)}; data-shape:{self._data.shape}; bitdepth:{bits.value}; dtype:{dtype}")
+                instruments = self._instruments
+                if instruments is not None:
+                    start = time.perf_counter()
+
+                capture = self._capture
+                if capture is not None and capture.pending:
+                    i = capture.count
+                    ok = success(pull(self.cam, capture.pointer(i), bits, info_ref))
+                    self._on_captured(capture, i, info, ok)
+                    return
+
+                with geometry_lock:
+                    # the ring is replaced when the ROI or binning changes
+                    ring = self._ring
+                    idx = ring.acquire_write()
+                    if idx is None:
+                        # every slot is pinned by a reader, skip this frame
+                        counters.dropped += 1
+                        self._skipped += 1
+                        return
+
+                    result = pull(self.cam, ring.pointer(idx), bits, info_ref)
+                    if instruments is not None:
+                        pulled = time.perf_counter()
+                    if not success(result):
+                        ring.abort(idx)
+                        return
+                    if (info.height, info.width) != ring.shape:
+                        # queued before a geometry change
+                        ring.abort(idx)
+                        counters.dropped += 1
+                        return
+
+                seq = self._publish(ring, idx, info)
+                if instruments is not None:
+                    instruments.frame(seq, info.timestamp, start, pulled, time.perf_counter(), ring.pinned)
 
             elif nEvent == TOUPCAM_EVENT_STILLIMAGE:
-                w, h = self.get_size()
-                h, w = h.value, w.value
+                burst = self._burst
+                if burst is not None and burst.pending:
+                    i = burst.count
+                    burst.done(i, still_info, success(pull_still(self.cam, burst.pointer(i), bits, still_info_ref)))
+                    return
+
+                # pImageData == NULL only fills in the still's width and height
+                if not success(pull_still(self.cam, None, bits, still_info_ref)):
+                    return
+
+                idx = pool.take((still_info.height, still_info.width), self._ring.dtype)
+                result = pull_still(self.cam, pool.pointer(idx), bits, still_info_ref)
+                self._on_still(idx, still_info, success(result))
+
+            elif nEvent == TOUPCAM_EVENT_EXPOSURE:
+                self.settings.invalidate(*EXPOSURE_PROPERTIES)
+                self._update_exposure()
 
-                still = zeros((h, w), dtype=uint32)
-                lib.Toupcam_PullStillImage(self.cam, ctypes.c_void_p(still.ctypes.data), bits, None, None)
-                self._do_save(still)
+            elif nEvent == TOUPCAM_EVENT_TEMPTINT:
+                self.settings.invalidate(*TEMPTINT_PROPERTIES)
 
         callback = ctypes.CFUNCTYPE(None, ctypes.c_uint, ctypes.c_void_p)
         self._frame_fn = callback(get_frame)
 
-        result = lib.Toupcam_StartPullModeWithCallback(self.cam, self._frame_fn)
+        return lib.Toupcam_StartPullModeWithCallback(self.cam, self._frame_fn)
+
+    def _start_push_mode(self, bits):
+        if self.bits == 32 and not self.raw:
+            # push mode delivers whatever TOUPCAM_OPTION_RGB selects (RGB24 by default), match the ring layout
+            self.settings.put_option(TOUPCAM_OPTION_RGB, 2)
+
+        info = ToupcamFrameInfoV2()
+        info_addr = ctypes.addressof(info)
+        info_size = ctypes.sizeof(info)
+        bpp = self._ring.dtype.itemsize
+        pool = self._still_pool
+        counters = self.counters
+
+        def get_data(pData, pInfo, bSnap, ctx):
+            '''
+            :param pData: (const void*) SDK owned image data, only valid during this call.
+            :param pInfo: (const ToupcamFrameInfoV2*) width, height, flag, seq and timestamp of the image.
+            :param bSnap: (int) TRUE if the image was requested with Toupcam_Snap
+            '''
+            if not pData or not pInfo:
+                return
+
+            instruments = self._instruments
+            if instruments is not None:
+                start = time.perf_counter()
+
+            # copy the info into our own structure instead of building a new one for every frame
+            ctypes.memmove(info_addr, pInfo, info_size)
+            n = info.width * info.height * bpp
+            ring = self._ring
+            if bSnap:
+                burst = self._burst
+                if burst is not None and burst.pending:
+                    i = burst.count
+                    ctypes.memmove(burst.pointer(i), pData, min(n, burst.nbytes))
+                    burst.done(i, info, True)
+                    return
+
+                idx = pool.take((info.height, info.width), ring.dtype)
+                ctypes.memmove(pool.pointer(idx), pData, min(n, pool.buffer(idx).nbytes))
+                self._on_still(idx, info, True)
+                return
+
+            capture = self._capture
+            if capture is not None and capture.pending:
+                i = capture.count
+                ctypes.memmove(capture.pointer(i), pData, min(n, capture.nbytes))
+                self._on_captured(capture, i, info, True)
+                return
+
+            if (info.height, info.width) != ring.shape:
+                # delivered before a geometry change
+                counters.dropped += 1
+                return
+
+            idx = ring.acquire_write()
+            if idx is None:
+                counters.dropped += 1
+                self._skipped += 1
+                return
+
+            # the only copy of the frame: SDK buffer -> ring slot
+            ctypes.memmove(ring.pointer(idx), pData, n)
+            if instruments is None:
+                self._publish(ring, idx, info)
+                return
+
+            pulled = time.perf_counter()
+            seq = self._publish(ring, idx, info)
+            instruments.frame(seq, info.timestamp, start, pulled, time.perf_counter(), ring.pinned)
+
+        callback = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+        self._frame_fn = callback(get_data)
+
+        return lib.Toupcam_StartPushModeV2(self.cam, self._frame_fn, None)
+
+    def _publish(self, ring, idx, info):
+        self.counters.received += 1
+        seq = self._sequence(info)
+        ring.publish(idx, seq, info.timestamp, info.flag)
+
+        listeners = self._frame_listeners
+        if listeners:
+            frame = ring.acquire(idx)
+            try:
+                for func in listeners:
+                    func(frame)
+            finally:
+                frame.release()
+        return seq
+
+    def _on_captured(self, capture, i, info, ok):
+        if ok:
+            # keep the sequence accounting of the live stream intact
+            self.counters.received += 1
+            self._sequence(info)
+        capture.done(i, info, ok)
+
+    def _on_still(self, idx, info, ok):
+        pool = self._still_pool
+        request = self._snap_requests.popleft() if self._snap_requests else None
+        if not ok:
+            pool.release(idx)
+            if request:
+                request[0].set_exception(IOError('Toupcam_PullStillImageV2 failed'))
+            return
 
-        return success(result)
+        frame = pool.frame(idx, info.seq, info.timestamp, info.flag)
+        last, self.last_still = self.last_still, frame.retain()
+        if last is not None:
+            last.release()
+
+        if request:
+            future, path, extension, kw = request
+            if future.cancelled():
+                frame.release()
+            elif path:
+                self.writer.submit(frame, path, extension, future, **kw)
+            else:
+                future.set_result(frame)
+        elif self._save_path:
+            self.writer.submit(frame, self._save_path)
+        else:
+            frame.release()
 
-    # private
-    def _do_save(self, im):
-        image = self.get_pil_image(im)
-        image.save(self._save_path)
+    def _update_exposure(self):
+        # push mode has no exposure events, so the setters refresh it too
+        settings = self.settings
+        self.exposure = (settings.get('ExpoTime'), settings.get('ExpoAGain'))
+
+    def _sequence(self, info):
+        """
+            sequence number of the frame described by info. gaps in the hardware sequence are
+            counted as dropped frames; without hardware sequence numbers frames are numbered locally.
+            frames we skipped ourselves were already counted, so they are not counted twice.
+        """
+        last = self._last_seq
+        skipped = self._skipped
+        if info.flag & TOUPCAM_FRAMEINFO_FLAG_SEQ:
+            seq = info.seq
+            if last is not None:
+                gap = seq - last - 1 - skipped
+                if gap > 0:
+                    self.counters.dropped += gap
+        else:
+            seq = skipped + 1 if last is None else last + skipped + 1
+
+        self._skipped = 0
+        self._last_seq = seq
+        return seq
 
     # ToupCam interface
+    def _sdk_path(self, path):
+        # TCHAR is a wide string on Windows
+        path = os.fspath(path)
+        return path if sys.platform == 'win32' else path.encode()
+
     def _lib_func(self, func, *args, **kw):
         ff = getattr(lib, 'Toupcam_{}'.format(func))
         result = ff(self.cam, *args, **kw)
         return success(result)
 
-    def _lib_get_func(self, func):
-        v = ctypes.c_int()
-        if self._lib_func('get_{}'.format(func), ctypes.byref(v)):
-            return v.value
-
     # setters
+    def apply_settings(self, profile):
+        """
+            write a whole settings profile in one call
+
+            cam.apply_settings({'eSize': 1, 'AutoExpoEnable': 0, 'ExpoTime': 20000, 'ExpoAGain': 200,
+                                'TempTint': (6500, 1000), 'options': {TOUPCAM_OPTION_RAW: 1}})
+
+            values the camera already has are skipped. settings that only take effect on a new
+            stream (resolution, size, raw mode, bit depth) are written together with at most one
+            stream restart, the rest is written live afterwards in properties.PROPERTIES order.
+            ROI and binning changes resize the frame buffers of the running stream, see set_roi.
+
+        :param profile: {property name: value, 'options': {option: value}}, see properties.py
+        :return: the property names and option ids that were written
+        """
+        settings = self.settings
+        restart, live = settings.plan(profile)
+        if restart:
+            for key, value, is_option in restart:
+                if not is_option:
+                    if key == 'eSize':
+                        self.resolution, self.size = value, None
+                    else:
+                        self.resolution, self.size = None, value
+                elif key == TOUPCAM_OPTION_RAW:
+                    self.raw = bool(value)
+                elif key == TOUPCAM_OPTION_BITDEPTH:
+                    self.high_bitdepth = bool(value)
+
+            if self._ring is not None:
+                # open() writes the geometry and raw options for the new stream
+                lib.Toupcam_Stop(self.cam)
+                self.open()
+            else:
+                settings.write(restart)
+
+        geometry = [w for w in live if reshapes(w[0], w[2])]
+        if geometry:
+            for key, value, is_option in geometry:
+                if is_option:
+                    self.binning = value
+                else:
+                    self.roi = value if any(value) else None
+            self._reshape(geometry)
+            live = [w for w in live if w not in geometry]
+
+        settings.write(live)
+        if any(key in EXPOSURE_PROPERTIES for key, _, _ in live):
+            self._update_exposure()
+        return [key for key, _, _ in restart + geometry + live]
+
     def set_gamma(self, v):
-        self._lib_func('put_Gamma', ctypes.c_int(v))
+        self.settings.put('Gamma', v)
 
     def set_contrast(self, v):
-        self._lib_func('put_Contrast', ctypes.c_int(v))
+        self.settings.put('Contrast', v)
 
     def set_brightness(self, v):
-        self._lib_func('put_Brightness', ctypes.c_int(v))
+        self.settings.put('Brightness', v)
 
     def set_saturation(self, v):
-        self._lib_func('put_Saturation', ctypes.c_int(v))
+        self.settings.put('Saturation', v)
 
     def set_hue(self, v):
-        self._lib_func('put_Hue', ctypes.c_int(v))
+        self.settings.put('Hue', v)
 
     def set_exposure_time(self, v):
-        self._lib_func('put_ExpoTime', ctypes.c_ulong(v))
+        self.settings.put('ExpoTime', v)
+        self._update_exposure()
+
+    def set_exposure_gain(self, v):
+        """
+        :param v: analog gain in percent, 100 = 1x
+        """
+        self.settings.put('ExpoAGain', v)
+        self._update_exposure()
 
     # getters
     def get_gamma(self):
-        return self._lib_get_func('Gamma')
+        return self.settings.get('Gamma')
 
     def get_contrast(self):
-        return self._lib_get_func('Contrast')
+        return self.settings.get('Contrast')
 
     def get_brightness(self):
-        return self._lib_get_func('Brightness')
+        return self.settings.get('Brightness')
 
     def get_saturation(self):
-        return self._lib_get_func('Saturation')
+        return self.settings.get('Saturation')
 
     def get_hue(self):
-        return self._lib_get_func('Hue')
+        return self.settings.get('Hue')
 
     def get_exposure_time(self):
-        return self._lib_get_func('ExpoTime')
+        return self.settings.get('ExpoTime')
+
+    def get_exposure_gain(self):
+        return self.settings.get('ExpoAGain')
 
     def do_awb(self, callback=None):
         """
@@ -223,6 +1115,7 @@ class ToupCamCamera(object):
         """
 
         def temptint_cb(temp, tint):
+            self.settings.invalidate(*TEMPTINT_PROPERTIES)
             if callback:
                 callback((temp, tint))
 
@@ -232,26 +1125,41 @@ class ToupCamCamera(object):
         return self._lib_func('AwbOnePush', self._temptint_cb)
 
     def set_temperature_tint(self, temp, tint):
-        lib.Toupcam_put_TempTint(self.cam, temp, tint)
+        self.settings.put('TempTint', temp, tint)
 
     def get_temperature_tint(self):
-        temp = ctypes.c_int()
-        tint = ctypes.c_int()
-        if self._lib_func('get_TempTint', ctypes.byref(temp), ctypes.byref(tint)):
-            return temp.value, tint.value
+        return self.settings.get('TempTint')
 
     def get_auto_exposure(self):
-        expo_enabled = ctypes.c_bool()
-        result = lib.Toupcam_get_AutoExpoEnable(self.cam, ctypes.byref(expo_enabled))
-        if success(result):
-            return expo_enabled.value
+        return bool(self.settings.get('AutoExpoEnable'))
+
+    def set_trigger_mode(self, mode):
+        """
+        :param mode: 0 video mode, 1 software trigger mode, 2 external trigger mode
+        """
+        self.settings.put_option(TOUPCAM_OPTION_TRIGGER, mode)
+        return True
+
+    def trigger(self, n=1):
+        """
+            Toupcam_Trigger(HToupCam h, unsigned short nNumber); in trigger mode take n frames,
+            0xffff triggers continuously and 0 cancels
+        """
+        return self._lib_func('Trigger', ctypes.c_ushort(n))
 
     def set_auto_exposure(self, expo_enabled):
-        lib.Toupcam_put_AutoExpoEnable(self.cam, expo_enabled)
+        self.settings.put('AutoExpoEnable', int(bool(expo_enabled)))
+        self.settings.invalidate(*EXPOSURE_PROPERTIES)
+        self._update_exposure()
 
     def get_camera(self, cid=None):
+        """
+            Toupcam_Open(const TCHAR* id); id is a wide string on Windows
+        """
         func = lib.Toupcam_Open
         func.restype = ctypes.POINTER(HToupCam)
+        if isinstance(cid, str) and sys.platform != 'win32':
+            cid = cid.encode()
         cam = func(cid)
         return cam
 
@@ -275,27 +1183,185 @@ class ToupCamCamera(object):
             return hw.value
 
     def get_size(self):
-        w, h = ctypes.c_long(), ctypes.c_long()
+        w, h = self.settings.get('Size')
+        return ctypes.c_int(w), ctypes.c_int(h)
 
-        result = lib.Toupcam_get_Size(self.cam, ctypes.byref(w), ctypes.byref(h))
-        if success(result):
-            return w, h
+    def get_still_resolution(self, index):
+        """
+            Toupcam_get_StillResolution(HToupCam h, unsigned nResolutionIndex, int* pWidth, int* pHeight);
+        :return: (w, h) or None
+        """
+        w, h = ctypes.c_int(), ctypes.c_int()
+        if self._lib_func('get_StillResolution', ctypes.c_uint(index), ctypes.byref(w), ctypes.byref(h)):
+            return w.value, h.value
 
     def get_esize(self):
-        res = ctypes.c_long()
-        result = lib.Toupcam_get_eSize(self.cam, ctypes.byref(res))
-        if success(result):
-            return res
+        return ctypes.c_uint(self.settings.get('eSize'))
+
+    def switch_resolution(self, index, wait=True, timeout=DEFAULT_TIMEOUT):
+        """
+            change the resolution of the running stream without restarting it.
+
+            the callback stays registered: the stream is paused, the new eSize written, the frames
+            of the old size still queued in the SDK are flushed (any that slip through are dropped
+            by the size check of the callbacks) and a ring of the new size is swapped in. rings of
+            the listed resolutions are kept when they go out of use, so switching back and forth
+            allocates nothing after the first round; preallocate_resolutions() does that round ahead.
+            ROI is reset, binning is kept.
+
+        :param index: resolution index, see CameraProperties.resolutions
+        :param wait: wait for the first frame of the new size
+        :return: seconds from the call to the first new frame (also kept in switch_latency), None
+            without wait or if no frame came within timeout
+        """
+        props = self.get_properties()
+        if props is not None and not 0 <= index < len(props.resolutions):
+            raise ValueError(f'resolution index needs to be 0 ~ {len(props.resolutions) - 1}, got {index}')
+
+        t0 = time.perf_counter()
+        self.resolution, self.size, self.roi = index, None, None
+        if self._ring is None:
+            self.set_esize(index)
+            return
+
+        if self._recorder is not None and self._recorder.recording:
+            raise RuntimeError('stop the recording before switching the resolution')
+
+        first = threading.Event()
+        stamp = []
+
+        def on_frame(frame):
+            if not first.is_set() and frame.shape[:2] == shape:
+                stamp.append(time.perf_counter())
+                first.set()
+
+        ring = self._ring
+        with self._geometry_lock:
+            self._lib_func('Pause', 1)
+            try:
+                self.set_esize(index)
+                self._lib_func('Flush')
+                shape = self._frame_shape()
+                if shape != ring.shape:
+                    self._ring = self._new_ring(shape, ring.dtype)
+                    self._retire_ring(ring)
+                else:
+                    ring.reset()
+                self._new_stream()
+                if wait:
+                    self.add_frame_listener(on_frame)
+            finally:
+                self._lib_func('Pause', 0)
+
+        if not wait:
+            return
+        try:
+            first.wait(timeout)
+        finally:
+            self.remove_frame_listener(on_frame)
+        if not stamp:
+            return
+
+        latency = stamp[0] - t0
+        self.switch_latency = (index, latency)
+        instruments = self._instruments
+        if instruments is not None:
+            instruments.switch(latency)
+        return latency
+
+    def preallocate_resolutions(self, *indices):
+        """
+            allocate the rings switch_resolution() will use for indices (all listed resolutions
+            by default) now instead of on the first switch
+        """
+        ring = self._ring
+        if ring is None or self._publisher is not None:
+            return
+        shapes = self._resolution_shapes()
+        for i in indices or range(len(shapes)):
+            shape = shapes[i]
+            if shape != ring.shape and (shape, ring.dtype) not in self._rings:
+                self._rings[(shape, ring.dtype)] = FrameRing(shape, ring.dtype, self.buffer_count, self.counters)
 
     def set_esize(self, nres):
-        lib.Toupcam_put_eSize(self.cam, ctypes.c_ulong(nres))
+        self.settings.put('eSize', nres)
 
     def set_size(self, w, h):
-        self._lib_func('put_Size', ctypes.c_long(w), ctypes.c_long(h))
+        self.settings.put('Size', w, h)
+
+    def get_properties(self):
+        """
+        :return: CameraProperties of this camera from the device registry, None if it is gone
+        """
+        if self.cid is None:
+            # Toupcam_Open(NULL) opened the first camera
+            devices = registry.devices()
+            return devices[0] if devices else None
+        return registry.get(self.cid)
+
+    @property
+    def hardware_roi(self):
+        """
+            True if the sensor reads out only the ROI (TOUPCAM_FLAG_ROI_HARDWARE), so a small ROI
+            raises the frame rate and lowers the USB bandwidth
+        """
+        props = self.get_properties()
+        return bool(props and props._flags & ToupCamFlags.ROI_HARDWARE.value)
+
+    def set_roi(self, x=0, y=0, w=0, h=0):
+        """
+            Toupcam_put_Roi(HToupCam h, unsigned xOffset, unsigned yOffset, unsigned xWidth, unsigned yHeight);
+            read out only a region of the sensor. on a running stream the frame buffers are
+            resized in place, frames pinned by readers stay valid. set_roi() goes back to the
+            full frame.
+
+        :param x: left edge, the SDK needs even values
+        :param y: top edge
+        :return: the (x, y, w, h) written, None for the full frame
+        """
+        roi = tuple(v & ~1 for v in (x, y, w, h))
+        if any(roi):
+            if not roi[2] or not roi[3]:
+                raise ValueError(f'ROI needs a width and height, got {roi}')
+            if not self.hardware_roi:
+                raise IOError('camera has no hardware ROI (TOUPCAM_FLAG_ROI_HARDWARE)')
+        else:
+            roi = None
+
+        self.roi = roi
+        self._reshape([('Roi', roi or (0, 0, 0, 0), False)])
+        return roi
+
+    def get_roi(self):
+        """
+        :return: (x, y, w, h) as reported by Toupcam_get_Roi
+        """
+        return self.settings.get('Roi')
+
+    def set_binning(self, n, average=False):
+        """
+            TOUPCAM_OPTION_BINNING: combine n x n pixels into one, shrinking the frames by n in
+            both directions. the frame buffers of a running stream are resized like for set_roi.
+
+        :param n: 1 (no binning) ~ 4, the values toupcam.h defines (0x01 ~ 0x04, 0x82 ~ 0x84)
+        :param average: average the pixels instead of the SDK's saturating sum
+        """
+        if not 1 <= n <= 4:
+            raise ValueError(f'binning needs to be 1 ~ 4, got {n}')
+
+        value = n | 0x80 if average and n > 1 else n
+        self.binning = value
+        self._reshape([(TOUPCAM_OPTION_BINNING, value, True)])
+
+    def get_binning(self):
+        """
+        :return: (n, average)
+        """
+        value = self.settings.get_option(TOUPCAM_OPTION_BINNING)
+        return value & 0x3f or 1, bool(value & 0x80)
 
 
 if __name__ == '__main__':
-    import time
     cam = ToupCamCamera()
     cam.open()
     time.sleep(1)
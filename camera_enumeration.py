@@ -16,6 +16,8 @@
 
 # ============= standard library imports ========================
 import ctypes
+import threading
+import time
 
 # ============= local library imports  ==========================
 from core import lib
@@ -113,33 +115,28 @@ class HToupcamInstV2(ctypes.Structure):
 
 
 class CameraProperties(object):
-    _cam = None
-    cid = -1
-    displayname = ''
-    id = ''
-    name = ''
-    _flags = 0
-    flagnames = ''
-    maxspeed = 0
-    preview = 0
-    still = 0
-    maxfanspeed = 0
-    ioctrol = 0
-    xpixsz = 0
-    ypixsz = 0
-    _resolutions = []
-    resolutions = []
-
-    def __init__(self, object):
+    """
+        one connected camera: its enumeration entry and a copy of its model's attributes
+    """
+    __slots__ = ('cid', 'displayname', 'id', 'name', '_flags', 'flagnames', 'maxspeed', 'preview', 'still',
+                 'maxfanspeed', 'ioctrol', 'xpixsz', 'ypixsz', 'resolutions')
+
+    def __init__(self, object, cid=-1, displayname='', id=''):
+        """
+        :param object: HToupcamModelV2 or a pointer to one
+        :param cid: index in the enumeration
+        :param id: unique id of the camera, for Toupcam_Open
+        """
         _cam = object
-        # print(f"type(object):{type(object)}.")
-        # print(f"HToupcamModelV2:{HToupcamModelV2}.")
         if type(object) != HToupcamModelV2:
             try:
-                _cam = ctypes.cast(object, HToupcamModelV2)
-            except:
+                _cam = object.contents
+            except AttributeError:
                 raise TypeError(
                     f"Class CameraProperties: expect type HToupcamModelV2 as initial argument, got type:{type(object)}!")
+        self.cid = cid
+        self.displayname = displayname
+        self.id = id
         self.name = _cam.name
         self._flags = _cam.flag
         self.flagnames = toupcamflags.getAllFlags(_cam.flag)
@@ -147,14 +144,13 @@ class CameraProperties(object):
         self.preview = _cam.preview
         self.still = _cam.still
         self.maxfanspeed = _cam.maxfanspeed
-        self.ioctorl = _cam.ioctrol
+        self.ioctrol = _cam.ioctrol
         self.xpixsz = _cam.xpixsz
         self.ypixsz = _cam.ypixsz
-        self._resolutions = _cam.toupcamResolution
-        for k in range(0,int(_cam.still)):
-            self.resolutions.append((self._resolutions[k].width, self._resolutions[k].height))
-        pass
-
+        # copied, the model table belongs to the SDK. res[] lists the preview resolutions; still
+        # resolutions are a subset (still = 0: no still support), see get_StillResolution
+        res = _cam.toupcamResolution
+        self.resolutions = [(res[k].width, res[k].height) for k in range(min(int(_cam.preview), TOUPCAM_MAX))]
 
     def __repr__(self):
         return f'CameraProperties(' \
@@ -175,61 +171,159 @@ class CameraProperties(object):
                f')'
 
 
-class EnumCameras(object):
-    num_cams = -1
-    arrCameraProperties = []
+# void (*PTOUPCAM_HOTPLUG)(void* pCallbackCtx)
+HOTPLUG_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
 
 
-    def __init__(self):
-        """ Toupcam_EnumV2
-            enumerate the cameras connected to the computer, return the number of enumerated.
+class DeviceRegistry(object):
+    """
+        process-wide view of the connected cameras, keyed by id.
+
+        the cameras are enumerated on first use. after that a Toupcam_HotPlug notification marks
+        the view stale and the next enumeration only adds the cameras that arrived and drops the
+        ones that left; queries in between never touch USB. where the SDK has no hot plug
+        support (Windows builds) a query enumerates again once the view is older than max_age.
+
+        listeners added with add_listener(listener) are called as listener(arrived, removed)
+        with lists of CameraProperties, from the thread that noticed the change.
+    """
+
+    def __init__(self, max_age=1.):
+        """
+        :param max_age: seconds a view is trusted without hot plug notifications
+        """
+        self.max_age = max_age
+        self.enumerations = 0
+        self._devices = {}
+        self._backend = None
+        self._stale = True
+        self._hotplug = False
+        self._callback = None
+        self._timestamp = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def devices(self):
+        """
+        :return: list of CameraProperties in enumeration order
+        """
+        return list(self._view().values())
 
-            ToupcamInstV2 arr[TOUPCAM_MAX];
-            unsigned cnt = Toupcam_EnumV2(arr);
-            for (unsigned i = 0; i < cnt; ++i)
+    def ids(self):
+        return list(self._view())
 
-            if pti == NULL, then, only the number is returned.
-            Toupcam_Enum is obsolete.
+    def get(self, id):
+        """
+        :return: CameraProperties of the camera with id, None if it is not connected
         """
-        func_cam_enum = lib.Toupcam_EnumV2
-        func_cam_enum.argtypes = [ctypes.POINTER(HToupcamInstV2)]
-        func_cam_enum.restype = ctypes.c_int
+        return self._view().get(id)
 
-        # arbitrary initial buffer
-        arr_toupcaminst = (HToupcamInstV2 * TOUPCAM_MAX)()
+    def __contains__(self, id):
+        return id in self._view()
 
-        num_cams = func_cam_enum(arr_toupcaminst)
+    def __len__(self):
+        return len(self._view())
 
-        if num_cams < 0:
-            raise ValueError(f"Toupcam_Enum returned {num_cams} num_cams, expect greater than zero!")
+    def __iter__(self):
+        return iter(self.devices())
 
+    def refresh(self):
+        """
+            enumerate now, regardless of hot plug notifications
+        :return: (arrived, removed) lists of CameraProperties
+        """
+        return self._update()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    # private
+    def _view(self):
+        if self._stale or lib.backend is not self._backend or \
+                (not self._hotplug and time.monotonic() - self._timestamp > self.max_age):
+            self._update()
+        return self._devices
+
+    def _update(self):
+        with self._lock:
+            previous = reuse = self._devices
+            if lib.backend is not self._backend:
+                # entries of the previous backend's cameras are not reused, even for the same id
+                reuse = {}
+                self._backend = lib.backend
+                self._subscribe()
+
+            # cleared first, a notification arriving during the enumeration marks it stale again
+            self._stale = False
+            enum = lib.prototype('EnumV2', (ctypes.POINTER(HToupcamInstV2),), restype=ctypes.c_uint, errcheck=None)
+            arr = (HToupcamInstV2 * TOUPCAM_MAX)()
+            n = enum(arr)
+
+            devices = {}
+            arrived = []
+            for i in range(min(n, TOUPCAM_MAX)):
+                inst = arr[i]
+                prop = reuse.get(inst.id)
+                if prop is None:
+                    prop = CameraProperties(inst.model, i, inst.displayname, inst.id)
+                    arrived.append(prop)
+                # this is an index unique to this company's cameras and is unrelated to the cid returned in native opencv
+                prop.cid = i
+                devices[prop.id] = prop
+            removed = [prop for cid, prop in previous.items() if devices.get(cid) is not prop]
+
+            # readers keep whichever dict they already have
+            self._devices = devices
+            self._timestamp = time.monotonic()
+            self.enumerations += 1
+
+        if arrived or removed:
+            for listener in list(self._listeners):
+                listener(arrived, removed)
+        return arrived, removed
+
+    def _subscribe(self):
         try:
-            # try again with a num_cams - sized array of HToupcamInstV2
-            arr_toupcaminst = (HToupcamInstV2 * num_cams)()
-            num_cams = func_cam_enum(arr_toupcaminst)
-        except:
-            raise ValueError(f"Toupcam_Enum failed with {num_cams} num_cams!")
-        if num_cams < 0:
-            # we've now failed twice...
-            raise ValueError(
-                f"Toupcam_Enum returned {num_cams} num_cams, expect greater than zero!")
+            hotplug = lib.prototype('HotPlug', (HOTPLUG_CALLBACK, ctypes.c_void_p), restype=None, errcheck=None)
+        except AttributeError:
+            self._hotplug = False
+            return
 
+        # referenced for as long as the SDK may call it
+        self._callback = HOTPLUG_CALLBACK(self._on_hotplug)
+        hotplug(self._callback, None)
+        self._hotplug = True
 
-        for i in range(0, num_cams):
-            tuopcaminst = arr_toupcaminst[i]
-            # dereference to internal HToupcamModelV2 struct
-            cam_prop = CameraProperties(ctypes.cast(tuopcaminst.model, ctypes.POINTER(HToupcamModelV2)).contents)
-            # this is an index unique to this company's cameras and is unrelated to the cid returned in native opencv
-            cam_prop.cid = i
-            cam_prop.displayname = tuopcaminst.displayname
-            cam_prop.id = tuopcaminst.id
+    def _on_hotplug(self, ctx):
+        # SDK thread. listeners want to hear about the change without polling, everyone else
+        # enumerates on their next query
+        self._stale = True
+        if self._listeners:
+            threading.Thread(target=self._update, name='DeviceRegistry', daemon=True).start()
 
-            self.arrCameraProperties.append(cam_prop)
 
+registry = DeviceRegistry()
+
+
+class EnumCameras(object):
+    """
+        snapshot of the connected cameras, served by the registry
+    """
+
+    def __init__(self, refresh=False):
+        """
+        :param refresh: enumerate again even if no camera arrived or left since the last time
+        """
+        if refresh:
+            registry.refresh()
+        self.arrCameraProperties = registry.devices()
+        self.num_cams = len(self.arrCameraProperties)
 
-if __name__ == '__main__':
-    import time
 
+if __name__ == '__main__':
     cam_enum = EnumCameras()
     for camprops in cam_enum.arrCameraProperties:
         print(f"Cam#{camprops.cid}: {str(camprops)}")
@@ -0,0 +1,203 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import threading
+
+from functools import lru_cache
+# ============= local library imports  ==========================
+
+RGB = 'RGB'
+BGR = 'BGR'
+RGBA = 'RGBA'
+GRAY = 'GRAY'
+
+FORMATS = (RGB, BGR, RGBA, GRAY)
+CHANNELS = {RGB: 3, BGR: 3, RGBA: 4, GRAY: 1}
+
+
+@lru_cache(maxsize=None)
+def color_codes():
+    """
+        cv2 color codes, built on the first conversion so importing this module does not load cv2
+    :return: ({(input channels, output format): code}, {output format: code from RGB})
+    """
+    import cv2
+
+    # the SDK's RGB32/RGB24 layouts are BGRA/BGR in memory.
+    codes = {(4, RGB): cv2.COLOR_BGRA2RGB,
+             (4, BGR): cv2.COLOR_BGRA2BGR,
+             (4, RGBA): cv2.COLOR_BGRA2RGBA,
+             (4, GRAY): cv2.COLOR_BGRA2GRAY,
+             (3, RGB): cv2.COLOR_BGR2RGB,
+             (3, RGBA): cv2.COLOR_BGR2RGBA,
+             (3, GRAY): cv2.COLOR_BGR2GRAY,
+             (1, RGB): cv2.COLOR_GRAY2RGB,
+             (1, BGR): cv2.COLOR_GRAY2BGR,
+             (1, RGBA): cv2.COLOR_GRAY2RGBA}
+
+    # from the RGB output of the demosaic
+    rgb_codes = {BGR: cv2.COLOR_RGB2BGR,
+                 RGBA: cv2.COLOR_RGB2RGBA,
+                 GRAY: cv2.COLOR_RGB2GRAY}
+    return codes, rgb_codes
+
+
+def as_channels(data):
+    """
+        view frame data as (h, w, c) without copying.
+        (h, w) uint32 RGB32 frames become (h, w, 4) uint8, (h, w) gray frames become (h, w, 1)
+    """
+    if data.dtype == 'uint32':
+        return data.view('uint8').reshape(data.shape + (-1,))
+    if data.ndim == 2:
+        return data.reshape(data.shape + (1,))
+    return data
+
+
+def output_shape(data, fmt):
+    h, w = data.shape[:2]
+    c = CHANNELS[fmt]
+    return (h, w) if c == 1 else (h, w, c)
+
+
+def output_dtype(data):
+    # RGB32 unpacks into bytes, everything else (including 16 bit raw) keeps its depth
+    return 'uint8' if data.dtype == 'uint32' else data.dtype
+
+
+def convert(data, fmt=RGB, out=None, bayer=None):
+    """
+        convert a frame into fmt in one vectorized pass
+
+    :param data: frame data, RGB32 (h, w) uint32, BGR (h, w, 3), gray (h, w) or a raw Bayer mosaic
+    :param fmt: RGB, BGR, RGBA or GRAY
+    :param out: optional preallocated output array of output_shape(data, fmt)
+    :param bayer: Bayer pattern of a raw mosaic (see demosaic.py); None for processed frames
+    :return: converted array (out if given)
+    """
+    if fmt not in CHANNELS:
+        raise ValueError(f'fmt needs to be one of {FORMATS}, got {fmt!r}')
+
+    if out is None:
+        from numpy import empty
+
+        out = empty(output_shape(data, fmt), dtype=output_dtype(data))
+
+    if bayer is not None:
+        from demosaic import demosaic_bilinear
+
+        if fmt == RGB:
+            return demosaic_bilinear(data, bayer, out)
+        import cv2
+
+        cv2.cvtColor(demosaic_bilinear(data, bayer), color_codes()[1][fmt], dst=out)
+        return out
+
+    raw = as_channels(data)
+    c = raw.shape[2]
+
+    code = color_codes()[0].get((c, fmt))
+    if code is None:
+        # same layout in and out
+        out[...] = raw.reshape(out.shape)
+    else:
+        import cv2
+
+        cv2.cvtColor(raw, code, dst=out)
+    return out
+
+
+class FrameConverter(object):
+    """
+        memoized conversions into reusable output buffers.
+
+        results are cached per (format, Frame.key), so several consumers asking for
+        the same frame in the same format pay for the conversion once. each format rotates through
+        nbuffers output buffers; a result stays valid until nbuffers newer frames have been
+        converted into that format.
+
+        set bayer to the sensor's Bayer pattern for raw frames; they are demosaiced lazily,
+        only when a color format is asked for.
+    """
+
+    def __init__(self, nbuffers=2, bayer=None):
+        self.nbuffers = nbuffers
+        self.bayer = bayer
+        self.conversions = 0
+        self.hits = 0
+
+        self._buffers = {}
+        self._cache = {}
+        self._next = {}
+        self._locks = {fmt: threading.Lock() for fmt in FORMATS}
+
+    def convert(self, data, fmt=RGB, key=None, out=None):
+        """
+        :param data: frame data
+        :param fmt: RGB, BGR, RGBA or GRAY
+        :param key: Frame.key of a live frame used as cache key; None disables caching
+        :param out: convert into this array instead of a pooled buffer, bypasses the cache
+        :return: converted array, read-only when it comes from the cache
+        """
+        if out is not None or key is None:
+            self.conversions += 1
+            return convert(data, fmt, out, self.bayer)
+
+        if fmt not in self._locks:
+            raise ValueError(f'fmt needs to be one of {FORMATS}, got {fmt!r}')
+
+        with self._locks[fmt]:
+            hit = self._cache.get(fmt)
+            if hit is not None and hit[0] == key:
+                self.hits += 1
+                return hit[1]
+
+            # conversions into the same format are serialized so a second consumer of the same
+            # frame waits for the first one's result instead of converting again
+            buf = self._buffer(data, fmt)
+            convert(data, fmt, buf, self.bayer)
+            self.conversions += 1
+
+            result = buf.view()
+            result.flags.writeable = False
+            self._cache[fmt] = (key, result)
+            return result
+
+    def clear(self):
+        for fmt, lock in self._locks.items():
+            with lock:
+                self._buffers.pop(fmt, None)
+                self._cache.pop(fmt, None)
+                self._next.pop(fmt, None)
+
+    # private
+    def _buffer(self, data, fmt):
+        shape = output_shape(data, fmt)
+        dtype = output_dtype(data)
+        bufs = self._buffers.get(fmt)
+        if not bufs or bufs[0].shape != shape or bufs[0].dtype != dtype:
+            from numpy import empty
+
+            bufs = [empty(shape, dtype=dtype) for _ in range(self.nbuffers)]
+            self._buffers[fmt] = bufs
+            self._next[fmt] = 0
+
+        i = self._next[fmt]
+        self._next[fmt] = (i + 1) % self.nbuffers
+        return bufs[i]
+
+# ============= EOF =============================================
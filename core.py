@@ -19,6 +19,7 @@
 import ctypes
 import os
 import sys
+import threading
 # ============= local library imports  ==========================
 
 TOUPCAM_EVENT_EXPOSURE = 1  # exposure time changed
@@ -26,27 +27,44 @@ TOUPCAM_EVENT_TEMPTINT = 2  # white balance changed
 TOUPCAM_EVENT_CHROME = 3  # reversed, do not use it
 TOUPCAM_EVENT_IMAGE = 4  # live image arrived, use Toupcam_PullImage to get this image
 TOUPCAM_EVENT_STILLIMAGE = 5  # snap (still) frame arrived, use Toupcam_PullStillImage to get this frame
-TOUPCAM_EVENT_ERROR = 80  # something error happens
-TOUPCAM_EVENT_DISCONNECTED = 81  # camera disconnected
+TOUPCAM_EVENT_ERROR = 0x80  # something error happens
+TOUPCAM_EVENT_DISCONNECTED = 0x81  # camera disconnected
 
-root = os.path.dirname(__file__)
-if sys.platform == 'darwin':
-    lib = ctypes.cdll.LoadLibrary(os.path.join(root, 'osx', 'libtoupcam.dylib'))
-else:
-    directory = 'x64' if sys.maxsize > 2 ** 32 else 'x86'
-    # ext = 'lib' if sys.platform.startswith('linux') else 'dll'
-    if sys.platform.startswith('linux'):
-        name = 'libtoupcam.so'
-        lib = ctypes.cdll.LoadLibrary(os.path.join(root, directory, name))
-    else:
-        name = 'toupcam.dll'
-        lib = ctypes.windll.LoadLibrary(os.path.join(root, directory, name))
+TOUPCAM_FRAMEINFO_FLAG_SEQ = 0x01  # sequence number
+TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP = 0x02  # timestamp
+
+TOUPCAM_OPTION_RAW = 0x04  # raw data mode, set BEFORE Toupcam_StartXXX(). 0 = rgb, 1 = raw
+TOUPCAM_OPTION_BITDEPTH = 0x06  # 0 = 8 bits mode, 1 = 16 bits mode
+TOUPCAM_OPTION_HISTOGRAM = 0x05  # 0 = only one, 1 = continue mode
+TOUPCAM_OPTION_TRIGGER = 0x0b  # 0 = video mode, 1 = software or simulated trigger mode, 2 = external trigger mode
+TOUPCAM_OPTION_RGB = 0x0c  # 0 => RGB24; 1 => RGB48 when bitdepth > 8; 2 => RGB32; 3 => 8 Bits Gray; 4 => 16 Bits Gray
+TOUPCAM_OPTION_BINNING = 0x17  # digital binning: 1 = none, n = saturating add of n*n pixels, 0x80 | n = average of n*n pixels
 
 
 class HToupCam(ctypes.Structure):
     _fields_ = [('unused', ctypes.c_int)]
 
 
+class ToupcamFrameInfoV2(ctypes.Structure):
+    """ ToupcamFrameInfoV2 Structure
+        filled in by Toupcam_PullImageV2, Toupcam_PullStillImageV2 and the push mode V2 callback
+    typedef struct {
+        unsigned            width;
+        unsigned            height;
+        unsigned            flag;       /* TOUPCAM_FRAMEINFO_FLAG_xxxx */
+        unsigned            seq;        /* sequence number */
+        unsigned long long  timestamp;  /* microsecond */
+    }ToupcamFrameInfoV2;
+    """
+    _fields_ = [
+        ('width', ctypes.c_uint),
+        ('height', ctypes.c_uint),
+        ('flag', ctypes.c_uint),
+        ('seq', ctypes.c_uint),
+        ('timestamp', ctypes.c_ulonglong)
+    ]
+
+
 def success(r):
     """
         return true if r==0
@@ -55,6 +73,158 @@ def success(r):
     """
     return r == 0
 
+
+class ToupcamError(IOError):
+    """
+        a Toupcam_xxx call returned a failed HRESULT
+    """
+
+    def __init__(self, func, hresult):
+        self.func = func
+        self.hresult = hresult
+        super(ToupcamError, self).__init__(f'{func} failed, HRESULT 0x{hresult & 0xffffffff:08x}')
+
+
+def check_hresult(result, func, args):
+    """
+        ctypes errcheck, FAILED(hr) is a negative HRESULT
+    """
+    if result < 0:
+        raise ToupcamError(func.__name__, result)
+    return result
+
+
+# TOUPCAM_BACKEND=simulated replaces the native library with the in-process simulator, see simulated.py
+BACKEND_ENV = 'TOUPCAM_BACKEND'
+# TOUPCAM_LIBRARY=/path/to/libtoupcam.so loads the SDK from somewhere else than the bundled directories
+LIBRARY_ENV = 'TOUPCAM_LIBRARY'
+NATIVE = 'native'
+SIMULATED = 'simulated'
+
+
+def native_path():
+    """
+        path of the SDK library for this platform, $TOUPCAM_LIBRARY if it is set
+    """
+    path = os.environ.get(LIBRARY_ENV)
+    if path:
+        return path
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    if sys.platform == 'darwin':
+        return os.path.join(root, 'osx', 'libtoupcam.dylib')
+
+    directory = 'x64' if sys.maxsize > 2 ** 32 else 'x86'
+    name = 'libtoupcam.so' if sys.platform.startswith('linux') else 'toupcam.dll'
+    return os.path.join(root, directory, name)
+
+
+def load_native(path=None):
+    """
+    :param path: SDK library to load, defaults to native_path()
+    """
+    if path is None:
+        path = native_path()
+
+    if not os.path.isfile(path):
+        raise OSError(f'toupcam SDK library not found at {path}. copy the {os.path.basename(path)} of the SDK '
+                      f'for {sys.platform} there, set {LIBRARY_ENV} to its path, or set {BACKEND_ENV}={SIMULATED} '
+                      f'to run without a camera')
+
+    loader = ctypes.windll if sys.platform == 'win32' else ctypes.cdll
+    try:
+        return loader.LoadLibrary(path)
+    except OSError as e:
+        raise OSError(f'failed to load the toupcam SDK library {path}: {e}') from e
+
+
+def load_backend(backend=None, path=None, **kw):
+    """
+        create a library backend
+    :param backend: NATIVE, SIMULATED or None to use $TOUPCAM_BACKEND (default native)
+    :param path: SDK library for the native backend, see load_native
+    :param kw: options for the simulated backend, see simulated.SimulatedLibrary
+    """
+    if backend is None:
+        backend = os.environ.get(BACKEND_ENV, NATIVE)
+
+    if backend == SIMULATED:
+        from simulated import SimulatedLibrary
+        return SimulatedLibrary.from_env(**kw)
+    elif backend == NATIVE:
+        return load_native(path)
+    raise ValueError(f'unknown toupcam backend {backend!r}, expected {NATIVE!r} or {SIMULATED!r}')
+
+
+class Library(object):
+    """
+        forwards Toupcam_* lookups to the active backend so modules that did `from core import lib`
+        follow use_backend(). hot paths should bind the functions they call once, e.g.
+        pull = lib.Toupcam_PullImageV2, rather than looking them up per frame.
+
+        the backend is loaded on first use, so importing this module never touches the SDK.
+    """
+
+    def __init__(self, backend=None):
+        self._lock = threading.Lock()
+        self._prototypes = {}
+        self._backend = backend
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    @property
+    def backend(self):
+        backend = self._backend
+        if backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = load_backend()
+                backend = self._backend
+        return backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+        self._prototypes = {}
+
+    def prototype(self, name, argtypes, restype=ctypes.c_int, errcheck=check_hresult):
+        """
+            Toupcam_<name> with argtypes, restype and errcheck bound. the binding happens once per
+            backend, callers can keep the returned function.
+        """
+        func = self._prototypes.get(name)
+        if func is None:
+            func = getattr(self.backend, 'Toupcam_' + name)
+            func.argtypes = argtypes
+            func.restype = restype
+            if errcheck is not None:
+                func.errcheck = errcheck
+            self._prototypes[name] = func
+        return func
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+
+lib = Library()
+
+
+def use_backend(backend=None, path=None, **kw):
+    """
+        switch the library used by every ToupCamCamera and EnumCameras created afterwards
+    :param backend: NATIVE, SIMULATED, an already created backend object, or None for $TOUPCAM_BACKEND
+    :param path: SDK library for the native backend
+    :return: the backend
+    """
+    if backend is None or isinstance(backend, str):
+        backend = load_backend(backend, path, **kw)
+    lib.backend = backend
+    return backend
+
 # ============= EOF =============================================
 
 
@@ -0,0 +1,91 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+# ============= local library imports  ==========================
+
+BAYER_PATTERNS = ('RGGB', 'BGGR', 'GRBG', 'GBRG')
+MONO = 'YYYY'
+
+# channel index in the RGB output
+CHANNEL = {'R': 0, 'G': 1, 'B': 2}
+
+
+def fourcc_to_str(fourcc):
+    """
+        MAKEFOURCC(a, b, c, d) ((unsigned)(unsigned char)(a) | ((unsigned)(unsigned char)(b) << 8) | ...
+    """
+    return ''.join(chr((fourcc >> s) & 0xff) for s in (0, 8, 16, 24))
+
+
+def bayer_pattern(fourcc):
+    """
+        Bayer pattern of a Toupcam_get_RawFormat FourCC
+    :return: one of BAYER_PATTERNS, or None for monochromatic and non-Bayer formats
+    """
+    name = fourcc_to_str(fourcc) if isinstance(fourcc, int) else fourcc
+    if name in BAYER_PATTERNS:
+        return name
+
+
+def demosaic_bilinear(raw, pattern='RGGB', out=None):
+    """
+        bilinear demosaic of a Bayer mosaic, vectorized over each of the four sites of the 2x2 cell
+
+    :param raw: (h, w) uint8 or uint16 mosaic. 10/12/14 bit data is expected LSB aligned.
+    :param pattern: RGGB, BGGR, GRBG or GBRG, the colors of the top-left 2x2 cell in row order
+    :param out: optional (h, w, 3) output of raw's dtype
+    :return: (h, w, 3) RGB of raw's dtype, so high bit depth data keeps its precision
+    """
+    if pattern not in BAYER_PATTERNS:
+        raise ValueError(f'pattern needs to be one of {BAYER_PATTERNS}, got {pattern!r}')
+
+    from numpy import empty, pad, uint32
+
+    h, w = raw.shape
+    if out is None:
+        out = empty((h, w, 3), dtype=raw.dtype)
+
+    # mirror padding keeps the parity of the color filter array at the edges.
+    # uint32 leaves room for the neighbour sums of 16 bit data.
+    p = pad(raw, 1, mode='reflect').astype(uint32)
+
+    def at(dy, dx, ddy, ddx):
+        # the (ddy, ddx) neighbours of every site at (dy, dx) in the 2x2 cell
+        return p[1 + dy + ddy:1 + h + ddy:2, 1 + dx + ddx:1 + w + ddx:2]
+
+    for i, color in enumerate(pattern):
+        dy, dx = divmod(i, 2)
+        site = out[dy::2, dx::2]
+        c = at(dy, dx, 0, 0)
+        if color == 'G':
+            # the horizontal neighbours share the row's other color
+            other = pattern[dy * 2 + (1 - dx)]
+            horiz = at(dy, dx, 0, -1) + at(dy, dx, 0, 1)
+            vert = at(dy, dx, -1, 0) + at(dy, dx, 1, 0)
+            site[..., 1] = c
+            site[..., CHANNEL[other]] = (horiz + 1) >> 1
+            site[..., 2 - CHANNEL[other]] = (vert + 1) >> 1
+        else:
+            cross = at(dy, dx, -1, 0) + at(dy, dx, 1, 0) + at(dy, dx, 0, -1) + at(dy, dx, 0, 1)
+            diag = at(dy, dx, -1, -1) + at(dy, dx, -1, 1) + at(dy, dx, 1, -1) + at(dy, dx, 1, 1)
+            site[..., CHANNEL[color]] = c
+            site[..., 1] = (cross + 2) >> 2
+            site[..., 2 - CHANNEL[color]] = (diag + 2) >> 2
+
+    return out
+
+# ============= EOF =============================================
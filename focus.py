@@ -0,0 +1,290 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    focus scores of live frames and focus sweeps.
+
+    a score only looks at one channel (green of RGB frames and of Bayer mosaics, the data of gray
+    frames) inside an ROI. that region is sliced out of the frame as a strided view, so only the
+    ROI of one channel is ever copied, never the frame.
+
+        sweep = cam.focus_sweep(roi=(960, 720, 640, 480), position=stage.z)
+        stage.move(z0, z1)
+        best = sweep.wait()      # returns as soon as the score has clearly fallen past its peak
+        stage.move_to(best.position)
+
+    metrics:
+        laplacian   variance of the Laplacian
+        tenengrad   mean squared Sobel gradient magnitude
+        clarity     the SDK's Toupcam_calc_ClarityFactor
+"""
+# ============= standard library imports ========================
+import ctypes
+import threading
+from collections import OrderedDict
+# ============= local library imports  ==========================
+from core import lib
+
+LAPLACIAN = 'laplacian'
+TENENGRAD = 'tenengrad'
+CLARITY = 'clarity'
+METRICS = (LAPLACIAN, TENENGRAD, CLARITY)
+
+# scores kept for consumers asking about a frame a little after it was published
+CACHE_SIZE = 4
+
+
+def focus_plane(data, roi=None, bayer=None):
+    """
+        one channel of the ROI of a frame, as a strided view
+    :param roi: (x, y, w, h) in frame pixels, None for the whole frame
+    :param bayer: Bayer pattern of a raw mosaic
+    :return: 2d view
+    """
+    if roi is not None:
+        x, y, w, h = roi
+        if bayer:
+            # whole 2x2 cells
+            x, y = x & ~1, y & ~1
+        data = data[y:y + h, x:x + w]
+
+    if data.dtype == 'uint32':
+        # G of the BGRA bytes
+        return data.view('uint8').reshape(data.shape + (4,))[..., 1]
+    if data.ndim == 3:
+        return data[..., 1]
+    if bayer:
+        # one of the two green sites of the 2x2 cell
+        i = bayer.index('G')
+        return data[i // 2::2, i % 2::2]
+    return data
+
+
+def laplacian_variance(plane):
+    import cv2
+
+    lap = cv2.Laplacian(plane, cv2.CV_32F)
+    return float(cv2.meanStdDev(lap)[1][0, 0] ** 2)
+
+
+def tenengrad(plane):
+    import cv2
+
+    gx = cv2.Sobel(plane, cv2.CV_32F, 1, 0)
+    gy = cv2.Sobel(plane, cv2.CV_32F, 0, 1)
+    return float(cv2.mean(cv2.magnitude(gx, gy) ** 2)[0])
+
+
+def clarity_factor(plane, bitdepth=None):
+    """
+        double Toupcam_calc_ClarityFactor(const void* pImageData, int bits, unsigned nImgWidth, unsigned nImgHeight);
+
+        bits can only be 8 (gray), 24 or 32, so deeper planes are shifted down to 8 bits first
+    :param bitdepth: significant bits of a uint16 plane, defaults to 16
+    """
+    func = lib.prototype('calc_ClarityFactor', (ctypes.c_void_p, ctypes.c_int, ctypes.c_uint, ctypes.c_uint),
+                         restype=ctypes.c_double, errcheck=None)
+    if plane.dtype != 'uint8':
+        from numpy import minimum
+
+        plane = minimum(plane >> max(0, (bitdepth or 16) - 8), 255).astype('uint8')
+    h, w = plane.shape
+    return float(func(plane.ctypes.data, 8, w, h))
+
+
+SCORERS = {LAPLACIAN: laplacian_variance, TENENGRAD: tenengrad, CLARITY: clarity_factor}
+
+
+def clarity_available():
+    try:
+        lib.prototype('calc_ClarityFactor', (ctypes.c_void_p, ctypes.c_int, ctypes.c_uint, ctypes.c_uint),
+                      restype=ctypes.c_double, errcheck=None)
+    except AttributeError:
+        return False
+    return True
+
+
+class FocusScore(object):
+    __slots__ = ('seq', 'timestamp', 'score', 'position')
+
+    def __init__(self, seq, timestamp, score, position=None):
+        """
+        :param timestamp: hardware timestamp of the frame in microseconds
+        :param position: what the sweep's position callable returned when the frame arrived
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.score = score
+        self.position = position
+
+    def __repr__(self):
+        return f'FocusScore(seq={self.seq}, timestamp={self.timestamp}, score={self.score:.4g}, ' \
+               f'position={self.position})'
+
+
+class FocusScorer(object):
+    """
+        focus score of live frames, computed at most once per frame and metric
+    """
+
+    def __init__(self, cam, metric=LAPLACIAN, roi=None):
+        """
+        :param cam: ToupCamCamera
+        :param metric: LAPLACIAN, TENENGRAD or CLARITY
+        :param roi: (x, y, w, h) scored region in frame pixels, None for the whole frame
+        """
+        if metric not in SCORERS:
+            raise ValueError(f'metric needs to be one of {METRICS}, got {metric!r}')
+        if metric == CLARITY and not clarity_available():
+            raise ValueError('the SDK has no Toupcam_calc_ClarityFactor')
+
+        self.cam = cam
+        self.metric = metric
+        self.roi = roi
+        self.computed = 0
+
+        self._func = SCORERS[metric]
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, frame=None):
+        """
+        :param frame: Frame, defaults to the latest frame
+        :return: FocusScore, or None if there is no frame yet
+        """
+        if frame is None:
+            frame = self.cam.acquire_frame()
+            if frame is None:
+                return
+            with frame:
+                return self._score(frame)
+        return self._score(frame)
+
+    # private
+    def _score(self, frame):
+        key = frame.key
+        with self._lock:
+            if key is not None:
+                # Frame.key changes with every new stream, so nothing needs clearing on a reshape
+                key = key, None if self.roi is None else tuple(self.roi)
+                score = self._cache.get(key)
+                if score is not None:
+                    return score
+
+            plane = focus_plane(frame.data, self.roi, self.cam.converter.bayer)
+            if not plane.flags.c_contiguous:
+                # the ROI of one channel, cv2 and the SDK need contiguous rows
+                from numpy import ascontiguousarray
+
+                plane = ascontiguousarray(plane)
+            args = (self.cam.bitdepth,) if self.metric == CLARITY else ()
+            score = FocusScore(frame.seq, frame.timestamp, self._func(plane, *args))
+            self.computed += 1
+            if key is not None:
+                self._cache[key] = score
+                if len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            return score
+
+
+class FocusSweep(object):
+    """
+        scores every frame while the focus moves and reports the sharpest one.
+
+        the sweep stops by itself once the score has stayed below falloff * best for patience
+        frames in a row after the peak, so the stage does not have to travel the whole range.
+    """
+
+    def __init__(self, scorer, patience=5, falloff=0.8, position=None, on_peak=None, max_frames=None):
+        """
+        :param scorer: FocusScorer
+        :param patience: frames below falloff * best before the peak counts as passed
+        :param falloff: fraction of the best score
+        :param position: callable returning the focus position, sampled when each frame arrives
+        :param on_peak: called with the best FocusScore when the peak has passed, e.g. to stop the stage
+        :param max_frames: stop after this many frames even without a peak
+        """
+        self.scorer = scorer
+        self.patience = patience
+        self.falloff = falloff
+        self.position = position
+        self.on_peak = on_peak
+        self.max_frames = max_frames
+
+        self.scores = []
+        self.best = None
+        self.peak_passed = False
+        self._below = 0
+        self._done = threading.Event()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.scorer.cam.add_frame_listener(self._on_frame)
+        return self
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self.scorer.cam.remove_frame_listener(self._on_frame)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+            wait for the peak to pass (or stop())
+        :return: best FocusScore so far
+        """
+        self._done.wait(timeout)
+        return self.best
+
+    @property
+    def timestamps(self):
+        return [s.timestamp for s in self.scores]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # private
+    def _on_frame(self, frame):
+        # acquisition thread
+        position = self.position() if self.position is not None else None
+        score = self.scorer.score(frame)
+        score = FocusScore(score.seq, score.timestamp, score.score, position)
+        self.scores.append(score)
+
+        best = self.best
+        if best is None or score.score > best.score:
+            self.best = score
+            self._below = 0
+        elif score.score < self.falloff * best.score:
+            self._below += 1
+            if self._below >= self.patience:
+                self.peak_passed = True
+                self.stop()
+                if self.on_peak is not None:
+                    self.on_peak(self.best)
+                return
+        else:
+            # patience counts frames below the falloff in a row
+            self._below = 0
+
+        if self.max_frames is not None and len(self.scores) >= self.max_frames:
+            self.stop()
+
+# ============= EOF =============================================
@@ -0,0 +1,351 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import ctypes
+import threading
+from itertools import count
+# ============= local library imports  ==========================
+
+DEFAULT_SLOTS = 4
+
+# ring generations, a new one whenever a ring is created or reset for a new stream
+_generations = count()
+
+
+class Frame(object):
+    """
+        a read-only, zero-copy view of one ring slot.
+
+        the slot is pinned until release() is called (or the with-block exits);
+        the acquisition callback never writes into a pinned slot.
+    """
+    __slots__ = ('data', 'seq', 'timestamp', 'flag', '_ring', '_slot')
+
+    def __init__(self, ring, slot, data, seq, timestamp=0, flag=0):
+        self._ring = ring
+        self._slot = slot
+        self.data = data
+        self.seq = seq
+        # hardware timestamp in microseconds, only meaningful if flag has TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP
+        self.timestamp = timestamp
+        self.flag = flag
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def key(self):
+        """
+            cache key of a live frame: ring generation, sequence number, slot address and shape.
+            sequence numbers restart with every stream and stills carry the live one, so the
+            number alone does not identify the pixels. None for stills and released frames.
+        """
+        ring = self._ring
+        if isinstance(ring, FrameRing):
+            return ring.generation, self.seq, ring.pointer(self._slot).value, self.data.shape
+
+    def release(self):
+        if self._ring is not None:
+            self._ring.release(self._slot)
+            self._ring = None
+
+    def retain(self):
+        """
+            pin the same slot again, e.g. to keep a frame handed to a listener after it returns
+        :return: Frame
+        """
+        if self._slot < 0:
+            # not backed by a ring slot, the frame owns its data
+            return self
+        if self._ring is None:
+            raise ValueError(f'{self!r} has already been released')
+        return self._ring.acquire(self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+    def __repr__(self):
+        return f'Frame(seq={self.seq}, timestamp={self.timestamp}, flag={self.flag}, ' \
+               f'shape={self.data.shape}, dtype={self.data.dtype})'
+
+
+class FrameCounters(object):
+    """
+        running acquisition counters.
+
+        received: frames pulled from the SDK
+        dropped: frames lost before they reached us (gaps in the hardware sequence number)
+                 or skipped because every ring slot was pinned
+        consumed: published frames that a reader acquired at least once
+        overwritten: published frames replaced by a newer one before any reader saw them
+    """
+    __slots__ = ('received', 'dropped', 'consumed', 'overwritten')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.dropped = 0
+        self.consumed = 0
+        self.overwritten = 0
+
+    def snapshot(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return 'FrameCounters({})'.format(', '.join(f'{k}={v}' for k, v in self.snapshot().items()))
+
+
+class FrameRing(object):
+    """
+        preallocated N-slot ring of frame buffers.
+
+        the writer (SDK callback) asks for a free slot, pulls into it outside of any lock and
+        publishes it as the latest complete frame. readers pin the latest slot and get a
+        read-only view of it. the lock only guards the slot bookkeeping, never the pixel data.
+    """
+
+    def __init__(self, shape, dtype, nslots=DEFAULT_SLOTS, counters=None):
+        if nslots < 2:
+            raise ValueError(f'FrameRing needs at least 2 slots, got {nslots}')
+
+        self.shape = tuple(shape)
+        self.nslots = nslots
+        self.generation = next(_generations)
+
+        self._bind(self._allocate(dtype))
+
+        self._seqs = [-1] * nslots
+        self._timestamps = [0] * nslots
+        self._flags = [0] * nslots
+        self._seen = [False] * nslots
+        self._pins = [0] * nslots
+        self._latest = -1
+        self._writing = -1
+        self._next = 0
+        self._lock = threading.Lock()
+
+        if counters is None:
+            counters = FrameCounters()
+        self.counters = counters
+
+    @property
+    def nbytes(self):
+        return self._buffers[0].nbytes
+
+    def _allocate(self, dtype):
+        """
+            the slot buffers, nslots arrays of shape and dtype
+        """
+        # numpy is imported once frames are allocated, not when the camera module is
+        from numpy import zeros
+
+        return [zeros(self.shape, dtype=dtype) for _ in range(self.nslots)]
+
+    def _bind(self, buffers):
+        self._buffers = buffers
+        self.dtype = buffers[0].dtype
+        self._views = []
+        for b in buffers:
+            v = b.view()
+            v.flags.writeable = False
+            self._views.append(v)
+        self._pointers = [ctypes.c_void_p(b.ctypes.data) for b in buffers]
+
+    # writer interface
+    def acquire_write(self):
+        """
+            return the index of a slot that is neither pinned by a reader nor the latest frame,
+            or None if every slot is in use
+        :return: int or None
+        """
+        with self._lock:
+            n = self.nslots
+            for i in range(n):
+                idx = (self._next + i) % n
+                if idx != self._latest and not self._pins[idx]:
+                    self._writing = idx
+                    self._next = (idx + 1) % n
+                    return idx
+
+    def pointer(self, idx):
+        return self._pointers[idx]
+
+    def buffer(self, idx):
+        return self._buffers[idx]
+
+    def publish(self, idx, seq, timestamp=0, flag=0):
+        with self._lock:
+            prev = self._latest
+            if prev >= 0 and not self._seen[prev]:
+                self.counters.overwritten += 1
+
+            self._seqs[idx] = seq
+            self._timestamps[idx] = timestamp
+            self._flags[idx] = flag
+            self._seen[idx] = False
+            self._latest = idx
+            self._writing = -1
+
+    def abort(self, idx):
+        with self._lock:
+            if self._writing == idx:
+                self._writing = -1
+
+    def reset(self):
+        """
+            forget the latest frame before the ring is reused for a new stream. slots still
+            pinned by readers stay out of the writer's reach until released.
+        """
+        with self._lock:
+            self._latest = -1
+            self._writing = -1
+            self.generation = next(_generations)
+
+    # reader interface
+    def acquire_latest(self):
+        """
+            pin the latest complete frame
+        :return: Frame or None if nothing has been published yet
+        """
+        with self._lock:
+            idx = self._latest
+            if idx >= 0:
+                return self._pin(idx)
+
+    def acquire(self, idx):
+        """
+            pin a specific slot, e.g. the one the writer just published
+        :return: Frame
+        """
+        with self._lock:
+            return self._pin(idx)
+
+    def release(self, idx):
+        with self._lock:
+            self._pins[idx] -= 1
+
+    def latest_view(self):
+        """
+            unpinned view of the latest frame. stays consistent only until the writer has
+            cycled through the remaining slots; use acquire_latest() to hold a frame longer.
+        """
+        idx = self._latest
+        if idx >= 0:
+            return self._views[idx]
+
+    def _pin(self, idx):
+        # caller holds the lock
+        self._pins[idx] += 1
+        if not self._seen[idx]:
+            self._seen[idx] = True
+            self.counters.consumed += 1
+        return Frame(self, idx, self._views[idx], self._seqs[idx], self._timestamps[idx], self._flags[idx])
+
+    @property
+    def pinned(self):
+        """
+            slots held by readers
+        """
+        return sum(1 for p in self._pins if p)
+
+    @property
+    def latest_seq(self):
+        idx = self._latest
+        if idx >= 0:
+            return self._seqs[idx]
+        return -1
+
+
+class BufferPool(object):
+    """
+        reusable buffers of arbitrary shape, e.g. for still images.
+
+        take() hands out a buffer pinned once, Frames built with frame() share that pin and
+        the buffer goes back to the free list when the last pin is released. buffers are only
+        allocated when no free buffer of the requested shape exists.
+    """
+
+    def __init__(self):
+        self._buffers = []
+        self._pointers = []
+        self._meta = []
+        self._pins = []
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def take(self, shape, dtype):
+        """
+            get a free buffer of shape and dtype, pinned once
+        :return: int index
+        """
+        from numpy import dtype as np_dtype, zeros
+
+        key = (tuple(shape), np_dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                idx = free.pop()
+                self._pins[idx] = 1
+                return idx
+
+            idx = len(self._buffers)
+            b = zeros(key[0], dtype=key[1])
+            self._buffers.append(b)
+            self._pointers.append(ctypes.c_void_p(b.ctypes.data))
+            self._meta.append((-1, 0, 0))
+            self._pins.append(1)
+            return idx
+
+    def buffer(self, idx):
+        return self._buffers[idx]
+
+    def pointer(self, idx):
+        return self._pointers[idx]
+
+    def frame(self, idx, seq, timestamp=0, flag=0):
+        """
+            wrap a taken buffer in a Frame that owns the pin from take()
+        """
+        self._meta[idx] = (seq, timestamp, flag)
+        return Frame(self, idx, self._buffers[idx], seq, timestamp, flag)
+
+    def acquire(self, idx):
+        with self._lock:
+            self._pins[idx] += 1
+        seq, ts, flag = self._meta[idx]
+        return Frame(self, idx, self._buffers[idx], seq, ts, flag)
+
+    def release(self, idx):
+        with self._lock:
+            self._pins[idx] -= 1
+            if not self._pins[idx]:
+                b = self._buffers[idx]
+                self._free.setdefault((b.shape, b.dtype), []).append(idx)
+
+    def __len__(self):
+        return len(self._buffers)
+
+# ============= EOF =============================================
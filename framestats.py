@@ -0,0 +1,277 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    per-frame exposure statistics on a decimated grid.
+
+    every step-th pixel of every step-th row is counted, per channel, with one bincount over the
+    strided view; mean, min, max and the clipped fraction all follow from that full-depth
+    histogram, so each channel is read exactly once. raw Bayer frames are sampled per 2x2 cell
+    site so the step never changes which color is sampled.
+
+        stats = cam.statistics.get()        # the latest frame, computed once, shared
+        stats.mean, stats.clipped, stats.histogram
+
+        cam.statistics.add_listener(check_exposure)
+        cam.statistics.start()              # every frame, on the acquisition thread
+"""
+# ============= standard library imports ========================
+import ctypes
+import threading
+from collections import OrderedDict
+# ============= local library imports  ==========================
+from core import lib, TOUPCAM_OPTION_HISTOGRAM
+from properties import HANDLE
+
+DEFAULT_STEP = 8
+DEFAULT_BINS = 256
+# results kept for consumers asking about a frame a little after it was published
+CACHE_SIZE = 4
+
+# void (*PITOUPCAM_HISTOGRAM_CALLBACK)(const float aHistY[256], const float aHistR[256],
+#                                      const float aHistG[256], const float aHistB[256], void* ctx)
+HISTOGRAM_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_float),
+                                      ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_float),
+                                      ctypes.c_void_p)
+
+
+class FrameStats(object):
+    """
+        statistics of one frame. per channel values are tuples in the order of channels
+    """
+    __slots__ = ('seq', 'timestamp', 'flag', 'channels', 'step', 'pixels', 'histogram', 'mean', 'min', 'max',
+                 'clipped')
+
+    def __init__(self, seq, timestamp, flag, channels, step, pixels, histogram, mean, min, max, clipped):
+        """
+        :param pixels: samples per channel
+        :param histogram: (channels, bins) int64 array
+        :param clipped: fraction of the samples at the maximum level
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.flag = flag
+        self.channels = channels
+        self.step = step
+        self.pixels = pixels
+        self.histogram = histogram
+        self.mean = mean
+        self.min = min
+        self.max = max
+        self.clipped = clipped
+
+    @property
+    def saturated(self):
+        """
+            clipped fraction of the worst channel
+        """
+        return max(self.clipped)
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__ if k != 'histogram'}
+
+    def __repr__(self):
+        mean = ', '.join(f'{c}={m:.1f}' for c, m in zip(self.channels, self.mean))
+        return f'FrameStats(seq={self.seq}, mean=({mean}), saturated={self.saturated:.4f})'
+
+
+def channel_planes(data, step, bayer=None):
+    """
+        strided, zero-copy views of the channels of a frame
+    :param data: RGB32 (h, w) uint32, BGR (h, w, 3), gray (h, w) or a raw mosaic
+    :param bayer: Bayer pattern of a raw mosaic, e.g. RGGB
+    :return: [(channel name, view)], channels sampled at several sites (G of a mosaic) repeat
+    """
+    if data.dtype == 'uint32':
+        # RGB32 is BGRA in memory
+        sub = data.view('uint8').reshape(data.shape + (4,))[::step, ::step]
+        return [('R', sub[..., 2]), ('G', sub[..., 1]), ('B', sub[..., 0])]
+    if data.ndim == 3:
+        sub = data[::step, ::step]
+        return [('R', sub[..., 2]), ('G', sub[..., 1]), ('B', sub[..., 0])]
+    if bayer:
+        # an even step keeps every view on one site of the 2x2 cell
+        step += step % 2
+        return [(bayer[2 * dy + dx], data[dy::step, dx::step]) for dy in (0, 1) for dx in (0, 1)]
+    return [('Y', data[::step, ::step])]
+
+
+def compute_stats(data, step=DEFAULT_STEP, bins=DEFAULT_BINS, bitdepth=8, bayer=None, seq=-1, timestamp=0,
+                  flag=0):
+    """
+        statistics of a frame, see the module docstring
+    :param bins: histogram bins, a power of two no larger than 2 ** bitdepth
+    :param bitdepth: significant bits of the samples; 8 for RGB frames
+    :return: FrameStats
+    """
+    from numpy import arange, bincount, stack
+
+    levels = 1 << bitdepth
+    if bins > levels or bins & (bins - 1):
+        raise ValueError(f'bins needs to be a power of two <= {levels}, got {bins}')
+
+    counts = OrderedDict()
+    for name, plane in channel_planes(data, step, bayer):
+        # ravel copies the (small) decimated plane; bincount reads it once
+        c = bincount(plane.ravel(), minlength=levels)[:levels]
+        if name in counts:
+            counts[name] = counts[name] + c
+        else:
+            counts[name] = c
+
+    values = arange(levels)
+    channels = tuple(counts)
+    hists, pixels, mean, lo, hi, clipped = [], [], [], [], [], []
+    for c in counts.values():
+        n = int(c.sum())
+        pixels.append(n)
+        nonzero = c.nonzero()[0]
+        mean.append(float(c @ values) / n if n else 0.)
+        lo.append(int(nonzero[0]) if len(nonzero) else 0)
+        hi.append(int(nonzero[-1]) if len(nonzero) else 0)
+        clipped.append(float(c[-1]) / n if n else 0.)
+        hists.append(c.reshape(bins, -1).sum(axis=1))
+
+    return FrameStats(seq, timestamp, flag, channels, step, tuple(pixels), stack(hists), tuple(mean), tuple(lo), tuple(hi),
+                      tuple(clipped))
+
+
+class FrameStatistics(object):
+    """
+        statistics of a camera's live frames, computed at most once per frame.
+
+        get() computes on the caller's thread and caches the result per frame (Frame.key), so every
+        consumer of the same frame shares one computation. start() computes every frame (or every
+        n-th, see every) on the acquisition thread and hands the results to the listeners together
+        with their frame.
+    """
+
+    def __init__(self, cam, step=DEFAULT_STEP, bins=DEFAULT_BINS, every=1):
+        """
+        :param cam: ToupCamCamera
+        :param step: sample every step-th pixel of every step-th row
+        :param bins: histogram bins
+        :param every: with start(), compute every n-th frame
+        """
+        self.cam = cam
+        self.step = step
+        self.bins = bins
+        self.every = every
+        self.computed = 0
+        self.hits = 0
+
+        # the newest result, published with its frame's seq, timestamp and flag
+        self.latest = None
+        # the newest SDK histogram, see sdk_histogram()
+        self.sdk = None
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = ()
+        self._running = False
+        self._count = 0
+        self._histogram_fn = None
+
+    def get(self, frame=None):
+        """
+        :param frame: Frame, defaults to the latest frame
+        :return: FrameStats, or None if there is no frame yet
+        """
+        if frame is None:
+            frame = self.cam.acquire_frame()
+            if frame is None:
+                return
+            with frame:
+                return self._get(frame)
+        return self._get(frame)
+
+    def add_listener(self, func):
+        """
+            call func(frame, stats) for every frame computed by start(); on the acquisition thread
+        """
+        self._listeners = self._listeners + (func,)
+
+    def remove_listener(self, func):
+        self._listeners = tuple(f for f in self._listeners if f is not func)
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.cam.add_frame_listener(self._on_frame)
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self.cam.remove_frame_listener(self._on_frame)
+
+    def clear(self):
+        """
+            forget the cached results and latest, e.g. when the stream restarts
+        """
+        with self._lock:
+            self._cache.clear()
+            self.latest = None
+
+    def sdk_histogram(self, continuous=True):
+        """
+            have the SDK compute its own 256 bin Y/R/G/B histogram (Toupcam_GetHistogram), in
+            continuous mode for every frame (TOUPCAM_OPTION_HISTOGRAM). the newest one is kept in
+            sdk as {'Y': array, 'R': ..., 'G': ..., 'B': ...}.
+        """
+        self.cam.settings.put_option(TOUPCAM_OPTION_HISTOGRAM, int(continuous))
+        if self._histogram_fn is None:
+            self._histogram_fn = HISTOGRAM_CALLBACK(self._on_histogram)
+        func = lib.prototype('GetHistogram', (HANDLE, HISTOGRAM_CALLBACK, ctypes.c_void_p))
+        func(self.cam.cam, self._histogram_fn, None)
+
+    # private
+    def _get(self, frame):
+        key = frame.key
+        with self._lock:
+            stats = self._cache.get(key) if key is not None else None
+            if stats is not None:
+                self.hits += 1
+                return stats
+
+            cam = self.cam
+            bitdepth = cam.bitdepth if cam.raw else 8
+            stats = compute_stats(frame.data, self.step, self.bins, bitdepth, cam.converter.bayer, frame.seq,
+                                  frame.timestamp, frame.flag)
+            self.computed += 1
+            if key is not None:
+                # stills and released frames have no key, see Frame.key
+                self._cache[key] = stats
+                if len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+                if self.latest is None or frame.seq >= self.latest.seq:
+                    self.latest = stats
+            return stats
+
+    def _on_frame(self, frame):
+        self._count += 1
+        if self._count % self.every:
+            return
+
+        stats = self._get(frame)
+        for func in self._listeners:
+            func(frame, stats)
+
+    def _on_histogram(self, y, r, g, b, ctx):
+        # SDK thread, the arrays are only valid during the call
+        from numpy.ctypeslib import as_array
+
+        self.sdk = {k: as_array(p, (256,)).copy() for k, p in zip('YRGB', (y, r, g, b))}
+
+# ============= EOF =============================================
@@ -0,0 +1,361 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import array, percentile
+# ============= local library imports  ==========================
+from camera import ToupCamCamera
+from camera_enumeration import registry
+from streams import AwaitableFuture
+
+# skews kept for the statistics
+SKEW_HISTORY = 1000
+# seconds the trigger threads wait for each other
+TRIGGER_TIMEOUT = 1.
+
+
+class FrameSet(object):
+    """
+        one frame per camera from a single group trigger.
+
+        frames are pinned until release() (or the with-block exits). a camera whose frame did not
+        arrive before the timeout has None in frames.
+    """
+
+    def __init__(self, number, ids, triggered):
+        self.number = number
+        self.triggered = triggered
+        self.frames = dict.fromkeys(ids)
+        # host perf_counter time each frame was published
+        self.arrivals = {}
+        self._remaining = len(self.frames)
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self._remaining == 0
+
+    @property
+    def skew(self):
+        """
+            seconds between the first and the last frame of the set to arrive
+        """
+        if self.arrivals:
+            ts = self.arrivals.values()
+            return max(ts) - min(ts)
+
+    def offsets(self):
+        """
+        :return: {id: seconds after the first frame of the set}
+        """
+        if self.arrivals:
+            t0 = min(self.arrivals.values())
+            return {k: t - t0 for k, t in self.arrivals.items()}
+        return {}
+
+    def release(self):
+        for k, frame in self.frames.items():
+            if frame is not None:
+                frame.release()
+
+    def __getitem__(self, cid):
+        return self.frames[cid]
+
+    def __iter__(self):
+        return iter(self.frames.items())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __repr__(self):
+        skew = self.skew
+        skew = 'n/a' if skew is None else f'{skew * 1e6:.0f}us'
+        return f'FrameSet(number={self.number}, frames={len(self.frames) - self._remaining}/{len(self.frames)}, ' \
+               f'skew={skew})'
+
+    # private
+    def _add(self, cid, frame, t):
+        # acquisition thread of camera cid
+        with self._lock:
+            if self._done.is_set() or self.frames.get(cid, frame) is not None:
+                return
+            self.frames[cid] = frame.retain()
+            self.arrivals[cid] = t
+            self._remaining -= 1
+            if not self._remaining:
+                self._done.set()
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        with self._lock:
+            # late frames are ignored from here on
+            self._done.set()
+
+
+class CameraGroup(object):
+    """
+        several cameras opened, triggered and shut down together.
+
+        each camera has its own frame ring and still buffers; conversion and encoding work goes
+        to one worker pool shared by the group, bounded so a slow consumer can not queue up
+        unbounded work.
+
+        with CameraGroup() as group:
+            with group.trigger() as frames:
+                for cid, frame in frames:
+                    ...
+            print(group.stats())
+    """
+
+    def __init__(self, ids=None, workers=None, max_pending=None, **kw):
+        """
+        :param ids: camera ids (CameraProperties.id) to open, defaults to every connected camera
+        :param workers: worker threads of the shared pool, defaults to the number of cores
+        :param max_pending: bound on jobs queued or running in the pool, defaults to 2 * workers
+        :param kw: ToupCamCamera options applied to every camera, e.g. resolution, raw
+        """
+        if ids is None:
+            ids = registry.ids()
+        self.ids = list(ids)
+        self.camera_kw = kw
+        self.cameras = {}
+
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.rejected = 0
+        self._pool = None
+        self._triggers = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        self.sets = 0
+        self.incomplete = 0
+        self._skews = deque(maxlen=SKEW_HISTORY)
+        self._offsets = {cid: deque(maxlen=SKEW_HISTORY) for cid in self.ids}
+        self._pending = None
+        self._trigger_lock = threading.Lock()
+        self._listeners = {}
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __getitem__(self, cid):
+        return self.cameras[cid]
+
+    def __iter__(self):
+        return iter(self.cameras.values())
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self, trigger_mode=True):
+        """
+            open and start every camera concurrently
+        :param trigger_mode: put the cameras into software trigger mode for trigger()
+        """
+        if not self.ids:
+            raise IOError('no cameras to open')
+
+        def start(cid):
+            cam = ToupCamCamera(cid=cid, **self.camera_kw)
+            try:
+                if not cam.cam:
+                    raise IOError(f'failed to open camera {cid}')
+                if trigger_mode:
+                    cam.set_trigger_mode(1)
+                if not cam.open():
+                    raise IOError(f'failed to start camera {cid}')
+            except BaseException:
+                # not in self.cameras yet, close() can not reach it
+                cam.close()
+                raise
+            return cam
+
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='CameraGroup')
+        with ThreadPoolExecutor(len(self.ids)) as opener:
+            futures = {cid: opener.submit(start, cid) for cid in self.ids}
+
+        errors = []
+        for cid, future in futures.items():
+            try:
+                self.cameras[cid] = future.result()
+            except BaseException as e:
+                errors.append(f'{cid}: {e}')
+
+        if errors:
+            self.close()
+            raise IOError('failed to open camera group, {}'.format(', '.join(errors)))
+
+        for cid, cam in self.cameras.items():
+            listener = self._make_listener(cid)
+            self._listeners[cid] = listener
+            cam.add_frame_listener(listener)
+        # one thread per camera, so trigger() can fire them all at once
+        self._triggers = ThreadPoolExecutor(len(self.cameras), thread_name_prefix='CameraGroupTrigger')
+
+    def close(self):
+        cameras, self.cameras = self.cameras, {}
+        for cid, cam in cameras.items():
+            listener = self._listeners.pop(cid, None)
+            if listener is not None:
+                cam.remove_frame_listener(listener)
+
+        if cameras:
+            with ThreadPoolExecutor(len(cameras)) as closer:
+                list(closer.map(ToupCamCamera.close, cameras.values()))
+
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._triggers is not None:
+            self._triggers.shutdown()
+            self._triggers = None
+
+    def trigger(self, timeout=1.0):
+        """
+            software trigger every camera once and wait for the matching frames. the triggers are
+            fired from one thread per camera released together by a barrier, so the skew is not
+            inflated by calling Toupcam_Trigger for one camera after the other.
+        :param timeout: seconds to wait for the slowest camera
+        :return: FrameSet, release it when done
+        :raises IOError: if a camera refused the trigger; frames already collected are released
+        """
+        with self._trigger_lock:
+            fs = FrameSet(self.sets, self.cameras.keys(), time.perf_counter())
+            self._pending = fs
+            try:
+                failed = [cid for cid, ok in self._fire().items() if not ok]
+                if failed:
+                    raise IOError('Toupcam_Trigger failed for camera {}'.format(', '.join(map(str, failed))))
+            except BaseException:
+                # no set can complete, frames of the cameras that did trigger are dropped
+                self._pending = None
+                fs._wait(0)
+                fs.release()
+                raise
+
+            fs._wait(timeout)
+            self._pending = None
+
+        self.sets += 1
+        if fs.complete:
+            self._skews.append(fs.skew)
+            for cid, offset in fs.offsets().items():
+                self._offsets[cid].append(offset)
+        else:
+            self.incomplete += 1
+        return fs
+
+    def submit(self, func, *args, block=True, **kw):
+        """
+            run func on the shared worker pool
+        :param block: wait for a free slot when max_pending jobs are already queued; otherwise
+            fail the returned future immediately
+        :return: AwaitableFuture
+        """
+        if not self._slots.acquire(blocking=block):
+            self.rejected += 1
+            future = AwaitableFuture()
+            future.set_exception(IOError('camera group worker pool is full'))
+            return future
+
+        future = AwaitableFuture()
+
+        def run():
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = func(*args, **kw)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                self._slots.release()
+
+        self._pool.submit(run)
+        return future
+
+    def map_set(self, func, frameset, *args, **kw):
+        """
+            run func(cam, frame, *args, **kw) for every frame of a set on the shared pool
+        :return: {id: AwaitableFuture}
+        """
+        return {cid: self.submit(func, self.cameras[cid], frame, *args, **kw)
+                for cid, frame in frameset if frame is not None}
+
+    def stats(self):
+        """
+            skew statistics of the complete sets
+        :return: dict, times in microseconds. offsets are each camera's delay after the first
+            frame of a set.
+        """
+
+        def summary(values):
+            if not values:
+                return {'mean': None, 'p50': None, 'p99': None, 'max': None}
+            a = array(values) * 1e6
+            return {'mean': float(a.mean()),
+                    'p50': float(percentile(a, 50)),
+                    'p99': float(percentile(a, 99)),
+                    'max': float(a.max())}
+
+        return {'sets': self.sets,
+                'incomplete': self.incomplete,
+                'rejected': self.rejected,
+                'skew_us': summary(self._skews),
+                'offset_us': {cid: summary(v) for cid, v in self._offsets.items()}}
+
+    # private
+    def _fire(self):
+        """
+            cam.trigger(1) on every camera at the same time
+        :return: {id: result}
+        """
+        cameras = self.cameras
+        if len(cameras) == 1:
+            return {cid: cam.trigger(1) for cid, cam in cameras.items()}
+
+        barrier = threading.Barrier(len(cameras))
+
+        def fire(cam):
+            barrier.wait(TRIGGER_TIMEOUT)
+            return cam.trigger(1)
+
+        return dict(zip(cameras, self._triggers.map(fire, cameras.values())))
+
+    def _make_listener(self, cid):
+        def on_frame(frame):
+            fs = self._pending
+            if fs is not None:
+                fs._add(cid, frame, time.perf_counter())
+
+        return on_frame
+
+# ============= EOF =============================================
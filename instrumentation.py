@@ -0,0 +1,346 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    acquisition metrics: histograms of the hot path, per-frame trace hooks and exporters.
+
+    instrumentation is off until cam.instrument() is called; until then the frame callbacks only
+    test one attribute for None. when on, every live frame adds a few samples to fixed-bucket
+    histograms, nothing is allocated per frame unless a trace hook is registered.
+
+        cam.instrument(PrometheusExporter(port=9100), LoggingExporter(interval=60))
+        cam.stats()                 # counters, ring occupancy and the histograms
+        cam.instruments.add_trace(lambda t: ...)
+
+    histograms (seconds, queue_depth in slots):
+        callback        SDK callback from entry to return, listeners included
+        pull            Toupcam_PullImageV2 (push mode: the copy out of the SDK buffer)
+        convert         get_image() conversions, cache hits included
+        interval        time between two live frames
+        switch          switch_resolution() from the call to the first frame of the new size
+        queue_depth     ring slots pinned by readers when a frame is published
+
+    the histograms are updated without locks, a snapshot taken during an update can be off by
+    one sample.
+"""
+# ============= standard library imports ========================
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# ============= local library imports  ==========================
+
+# 10 us .. ~1.3 s, doubling
+TIME_BOUNDS = tuple(1e-5 * 2 ** i for i in range(18))
+DEPTH_BOUNDS = tuple(range(9))
+
+DEFAULT_INTERVAL = 60.
+DEFAULT_METRICS_PORT = 9100
+
+
+class Histogram(object):
+    """
+        fixed-bucket histogram; counts[i] holds the samples <= bounds[i], the last count the rest
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds=TIME_BOUNDS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_right(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+            upper bound of the bucket holding the q quantile, max for the overflow bucket
+        """
+        if not self.count:
+            return
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': list(zip(self.bounds + (float('inf'),), self.counts))}
+
+
+class FrameTrace(object):
+    """
+        what the acquisition thread measured for one live frame, handed to trace hooks
+    """
+    __slots__ = ('seq', 'timestamp', 'start', 'pull', 'callback', 'queue_depth')
+
+    def __init__(self, seq, timestamp, start, pull, callback, queue_depth):
+        """
+        :param start: time.perf_counter() when the callback was entered
+        :param pull: seconds spent pulling (or copying) the frame
+        :param callback: seconds from entering the callback to publishing and notifying listeners
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.start = start
+        self.pull = pull
+        self.callback = callback
+        self.queue_depth = queue_depth
+
+    def __repr__(self):
+        return f'FrameTrace(seq={self.seq}, pull={self.pull * 1e6:.0f}us, callback={self.callback * 1e6:.0f}us, ' \
+               f'queue_depth={self.queue_depth})'
+
+
+class Instruments(object):
+    """
+        the histograms and trace hooks of one camera, see the module docstring
+    """
+
+    def __init__(self, source=None):
+        """
+        :param source: callable returning the snapshot exporters publish, ToupCamCamera.stats
+        """
+        self.source = source
+        self.histograms = {'callback': Histogram(),
+                           'pull': Histogram(),
+                           'convert': Histogram(),
+                           'interval': Histogram(),
+                           'switch': Histogram(),
+                           'queue_depth': Histogram(DEPTH_BOUNDS)}
+        self.frames = 0
+        self.exporters = []
+        self._traces = ()
+        self._last = None
+
+    # acquisition thread
+    def frame(self, seq, timestamp, start, pulled, done, depth):
+        h = self.histograms
+        h['pull'].observe(pulled - start)
+        h['callback'].observe(done - start)
+        h['queue_depth'].observe(depth)
+        if self._last is not None:
+            h['interval'].observe(start - self._last)
+        self._last = start
+        self.frames += 1
+
+        traces = self._traces
+        if traces:
+            trace = FrameTrace(seq, timestamp, start, pulled - start, done - start, depth)
+            for func in traces:
+                func(trace)
+
+    def convert(self, seconds):
+        self.histograms['convert'].observe(seconds)
+
+    def switch(self, seconds):
+        self.histograms['switch'].observe(seconds)
+
+    # hooks
+    def add_trace(self, func):
+        """
+            call func(FrameTrace) for every live frame, on the acquisition thread
+        """
+        self._traces = self._traces + (func,)
+
+    def remove_trace(self, func):
+        self._traces = tuple(f for f in self._traces if f is not func)
+
+    def add_exporter(self, exporter):
+        exporter.start(self.source)
+        self.exporters.append(exporter)
+        return exporter
+
+    def stop(self):
+        for exporter in self.exporters:
+            exporter.stop()
+        self.exporters = []
+
+    def reset(self):
+        for h in self.histograms.values():
+            h.reset()
+        self.frames = 0
+        self._last = None
+
+    def snapshot(self):
+        return {'frames': self.frames, 'histograms': {k: h.snapshot() for k, h in self.histograms.items()}}
+
+
+# exporters
+class PeriodicExporter(ABC):
+    """
+        base class of exporters that push: calls export(snapshot) every interval seconds on its
+        own thread. subclasses implement export, see CallbackExporter and LoggingExporter.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._source = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, source):
+        self._source = source
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @abstractmethod
+    def export(self, snapshot):
+        """
+        :param snapshot: what the source returned, ToupCamCamera.stats()
+        """
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export(self._source())
+
+
+class CallbackExporter(PeriodicExporter):
+    def __init__(self, func, interval=DEFAULT_INTERVAL):
+        super(CallbackExporter, self).__init__(interval)
+        self.func = func
+
+    def export(self, snapshot):
+        self.func(snapshot)
+
+
+class LoggingExporter(PeriodicExporter):
+    """
+        one summary line per interval
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, logger=None, level=None):
+        import logging
+
+        super(LoggingExporter, self).__init__(interval)
+        self.logger = logger or logging.getLogger('toupcam')
+        self.level = logging.INFO if level is None else level
+
+    def export(self, snapshot):
+        counters = snapshot['counters']
+        parts = [f'{k}={v}' for k, v in counters.items()]
+        for name, h in snapshot.get('histograms', {}).items():
+            if h['count'] and name != 'queue_depth':
+                parts.append(f'{name}_p50={h["p50"] * 1e3:.2f}ms {name}_p99={h["p99"] * 1e3:.2f}ms')
+        self.logger.log(self.level, 'camera %s', ' '.join(parts))
+
+
+def prometheus_text(snapshot, prefix='toupcam'):
+    """
+        snapshot in the Prometheus text exposition format
+    """
+    lines = []
+    for k, v in snapshot['counters'].items():
+        name = f'{prefix}_frames_{k}_total'
+        lines += [f'# TYPE {name} counter', f'{name} {v}']
+    for k, v in snapshot.get('ring', {}).items():
+        name = f'{prefix}_ring_{k}'
+        lines += [f'# TYPE {name} gauge', f'{name} {v}']
+
+    for k, h in snapshot.get('histograms', {}).items():
+        name = f'{prefix}_{k}' if k == 'queue_depth' else f'{prefix}_{k}_seconds'
+        lines.append(f'# TYPE {name} histogram')
+        seen = 0
+        for bound, n in h['buckets']:
+            seen += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {seen}')
+        lines += [f'{name}_sum {h["sum"]}', f'{name}_count {h["count"]}']
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text(self.server.source(), self.server.prefix).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PrometheusExporter(object):
+    """
+        /metrics endpoint for a Prometheus scraper; the snapshot is taken per request
+    """
+
+    def __init__(self, port=DEFAULT_METRICS_PORT, host='127.0.0.1', prefix='toupcam'):
+        """
+        :param port: 0 picks a free port, see address
+        """
+        self.port = port
+        self.host = host
+        self.prefix = prefix
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def address(self):
+        if self._httpd is not None:
+            return self._httpd.server_address[:2]
+
+    def start(self, source):
+        httpd = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        httpd.daemon_threads = True
+        httpd.source = source
+        httpd.prefix = self.prefix
+        self._httpd = httpd
+        self._thread = threading.Thread(target=httpd.serve_forever, name='PrometheusExporter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        httpd, self._httpd = self._httpd, None
+        if httpd is None:
+            return
+        httpd.shutdown()
+        httpd.server_close()
+        self._thread.join()
+        self._thread = None
+
+# ============= EOF =============================================
@@ -0,0 +1,444 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    per-frame analysis on a thread or process pool.
+
+    every accepted frame is copied once, on the acquisition thread, into one of a fixed set of
+    work buffers and handed to a worker, which runs all stages on it in order: stage 1 gets the
+    frame data, every next stage the previous one's result. the buffer goes back to the set when
+    the last stage is done, so at most max_in_flight + queue_size frames ever exist, and the
+    camera's own ring slots are never held by slow work. in a process pool the buffers live in
+    shared memory and only the stage results are pickled.
+
+        pipe = cam.pipeline(segment, measure, executor=PROCESS, workers=4, on_result=store)
+        ...
+        pipe.stop()
+        pipe.stats()    # per stage timing, dropped frames, latency
+
+    results are delivered in frame order, errors included, as PipelineResults: to on_result
+    (on a pool thread, one at a time) or, without it, to get().
+
+    policies when max_in_flight frames are already being worked on:
+        drop    the new frame is dropped
+        queue   the new frame waits in one of queue_size extra buffers, dropped once those are full
+
+    stage functions must not keep references to their input, the buffer is reused; in a process
+    pool they have to be picklable (module level functions).
+"""
+# ============= standard library imports ========================
+import os
+import queue
+import threading
+import time
+from collections import deque
+# ============= local library imports  ==========================
+
+THREAD = 'thread'
+PROCESS = 'process'
+DROP = 'drop'
+QUEUE = 'queue'
+
+# results kept for get() before the oldest are discarded
+RESULT_BACKLOG = 64
+
+# worker process state, see _init_worker
+_stages = ()
+_segments = {}
+
+
+class PipelineResult(object):
+    __slots__ = ('index', 'seq', 'timestamp', 'value', 'error', 'timings', 'latency')
+
+    def __init__(self, index, seq, timestamp, value=None, error=None, timings=(), latency=0.):
+        """
+        :param index: position among the accepted frames, results arrive in this order
+        :param error: the exception a stage raised, value is None then
+        :param timings: seconds spent in each stage that ran
+        :param latency: seconds from the frame's arrival to its result
+        """
+        self.index = index
+        self.seq = seq
+        self.timestamp = timestamp
+        self.value = value
+        self.error = error
+        self.timings = timings
+        self.latency = latency
+
+    def __repr__(self):
+        state = f'error={self.error!r}' if self.error is not None else f'value={type(self.value).__name__}'
+        return f'PipelineResult(seq={self.seq}, {state}, latency={self.latency * 1e3:.1f}ms)'
+
+
+class StageTiming(object):
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, t):
+        self.count += 1
+        self.total += t
+        if t > self.max:
+            self.max = t
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean_ms': self.total / self.count * 1e3 if self.count else None,
+                'max_ms': self.max * 1e3}
+
+
+def _init_worker(stages):
+    global _stages
+    _stages = stages
+
+
+def _run(stages, data):
+    # the stages of one frame; (value, timings of the stages that ran, exception or None)
+    timings = []
+    value = data
+    for func in stages:
+        t = time.perf_counter()
+        try:
+            value = func(value)
+        except Exception as e:
+            timings.append(time.perf_counter() - t)
+            return None, timings, e
+        timings.append(time.perf_counter() - t)
+    return value, timings, None
+
+
+def _run_shared(name, offset, shape, dtype):
+    # process pool worker: a view of the shared work buffer, the segment stays mapped
+    from numpy import ndarray
+
+    shm = _segments.get(name)
+    if shm is None:
+        from sharedring import _attach
+
+        shm = _segments[name] = _attach(name)
+    data = ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+    data.flags.writeable = False
+    return _run(_stages, data)
+
+
+class WorkBuffers(object):
+    """
+        n equally sized buffers, in process memory or in one shared memory segment
+    """
+
+    def __init__(self, n, capacity, shared=False):
+        self.n = n
+        self.capacity = capacity
+        self.shm = None
+        if shared:
+            from sharedring import _create
+
+            self.shm = _create(None, n * capacity)
+            self._storage = self.shm.buf
+        else:
+            self._storage = bytearray(n * capacity)
+        self._free = list(range(n - 1, -1, -1))
+
+    @property
+    def idle(self):
+        return len(self._free) == self.n
+
+    def take(self):
+        if self._free:
+            return self._free.pop()
+
+    def give(self, i):
+        self._free.append(i)
+
+    def view(self, i, shape, dtype):
+        from numpy import ndarray
+
+        return ndarray(shape, dtype, buffer=self._storage, offset=i * self.capacity)
+
+    def close(self):
+        self._storage = None
+        if self.shm is not None:
+            from sharedring import _unlink
+
+            _unlink(self.shm)
+            self.shm = None
+
+
+class Pipeline(object):
+    """
+        stages run on a pool for every accepted live frame, see the module docstring
+    """
+
+    def __init__(self, cam, stages=(), executor=THREAD, workers=None, max_in_flight=None, policy=DROP,
+                 queue_size=4, on_result=None):
+        """
+        :param cam: ToupCamCamera
+        :param stages: stage functions, more can be added with add_stage() before start()
+        :param executor: THREAD or PROCESS
+        :param workers: pool size, defaults to the number of CPUs
+        :param max_in_flight: frames worked on at once, defaults to workers
+        :param policy: DROP or QUEUE
+        :param queue_size: with QUEUE, frames waiting for a worker
+        :param on_result: called with every PipelineResult in frame order
+        """
+        if executor not in (THREAD, PROCESS):
+            raise ValueError(f'executor needs to be {THREAD!r} or {PROCESS!r}, got {executor!r}')
+        if policy not in (DROP, QUEUE):
+            raise ValueError(f'policy needs to be {DROP!r} or {QUEUE!r}, got {policy!r}')
+
+        self.cam = cam
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers
+        self.policy = policy
+        self.queue_size = queue_size if policy == QUEUE else 0
+        self.on_result = on_result
+
+        self.accepted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        # results get() never picked up before newer ones pushed them out
+        self.discarded = 0
+
+        self._stages = []
+        self._names = []
+        self._timings = {}
+        self._wait = StageTiming()
+        self._latency = StageTiming()
+        self._pool = None
+        self._buffers = None
+        self._geometry = None
+        self._in_flight = 0
+        # buffers taken by the acquisition thread and still being filled
+        self._filling = 0
+        self._pending = deque()
+        self._finished = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._results = queue.Queue(RESULT_BACKLOG)
+        self._running = False
+
+        for func in stages:
+            self.add_stage(func)
+
+    def add_stage(self, func, name=None):
+        if self._running:
+            raise RuntimeError('stages can only be added before start()')
+        name = name or getattr(func, '__name__', f'stage{len(self._stages)}')
+        if name in self._timings:
+            name = f'{name}{len(self._stages)}'
+        self._stages.append(func)
+        self._names.append(name)
+        self._timings[name] = StageTiming()
+
+    def start(self):
+        if self._running:
+            return self
+        if not self._stages:
+            raise ValueError('the pipeline has no stages')
+
+        if self.executor == PROCESS:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(tuple(self._stages),))
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='Pipeline')
+        self._running = True
+        self.cam.add_frame_listener(self._on_frame)
+        return self
+
+    def stop(self, wait=True):
+        """
+            stop accepting frames; with wait the frames already accepted are finished and delivered
+        """
+        if not self._running:
+            return
+        self._running = False
+        self.cam.remove_frame_listener(self._on_frame)
+        with self._lock:
+            if not wait:
+                self.dropped += len(self._pending)
+                for entry in self._pending:
+                    self._buffers.give(entry[0])
+                self._pending.clear()
+            while self._in_flight or self._pending or self._filling:
+                self._idle.wait()
+        self._pool.shutdown()
+        self._pool = None
+        if self._buffers is not None:
+            self._buffers.close()
+            self._buffers = None
+
+    def get(self, timeout=None):
+        """
+        :return: the next PipelineResult in frame order, None on timeout. unused with on_result
+        """
+        try:
+            return self._results.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def stats(self):
+        return {'accepted': self.accepted,
+                'dropped': self.dropped,
+                'completed': self.completed,
+                'failed': self.failed,
+                'discarded': self.discarded,
+                'in_flight': self._in_flight,
+                'queued': len(self._pending),
+                'stages': {k: t.snapshot() for k, t in self._timings.items()},
+                'queue_wait': self._wait.snapshot(),
+                'latency': self._latency.snapshot()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # private
+    def _on_frame(self, frame):
+        # acquisition thread
+        data = frame.data
+        arrival = time.perf_counter()
+        with self._lock:
+            if not self._running:
+                return
+            if self._in_flight >= self.max_in_flight and len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                return
+
+            i = self._slot_for(data)
+            if i is None:
+                self.dropped += 1
+                return
+            self._filling += 1
+            buffers = self._buffers
+
+        # the one copy, outside the lock; nobody else owns buffer i
+        buffers.view(i, data.shape, data.dtype)[...] = data
+
+        future = None
+        with self._lock:
+            self._filling -= 1
+            entry = (i, data.shape, data.dtype, self.accepted, frame.seq, frame.timestamp, arrival)
+            self.accepted += 1
+            if self._in_flight < self.max_in_flight:
+                future = self._submit(entry)
+            else:
+                self._pending.append(entry)
+        if future is not None:
+            self._watch(future, entry)
+
+    def _slot_for(self, data):
+        # caller holds the lock; a free work buffer for data, None if there is none
+        buffers = self._buffers
+        if buffers is not None and data.nbytes > buffers.capacity:
+            # the frames grew (ROI, binning, resolution); new buffers once the old ones are back
+            if not buffers.idle:
+                return
+            buffers.close()
+            buffers = self._buffers = None
+
+        if buffers is None:
+            buffers = self._buffers = WorkBuffers(self.max_in_flight + self.queue_size, data.nbytes,
+                                                  self.executor == PROCESS)
+        return buffers.take()
+
+    def _submit(self, entry):
+        # caller holds the lock and passes the returned future to _watch once it has released it
+        i, shape, dtype, index, seq, timestamp, arrival = entry
+        self._in_flight += 1
+        self._wait.add(time.perf_counter() - arrival)
+        buffers = self._buffers
+        if self.executor == PROCESS:
+            future = self._pool.submit(_run_shared, buffers.shm.name, i * buffers.capacity, shape, dtype.str)
+        else:
+            data = buffers.view(i, shape, dtype)
+            data.flags.writeable = False
+            future = self._pool.submit(_run, tuple(self._stages), data)
+        return future
+
+    def _watch(self, future, entry):
+        # never with the lock held: a future that is already done runs _on_done right here
+        future.add_done_callback(lambda f: self._on_done(f, entry))
+
+    def _on_done(self, future, entry):
+        # pool thread
+        i, shape, dtype, index, seq, timestamp, arrival = entry
+        try:
+            value, timings, error = future.result()
+        except BaseException as e:
+            # the pool itself failed, e.g. a worker process died or the stages did not pickle
+            value, timings, error = None, (), e
+        result = PipelineResult(index, seq, timestamp, value, error, tuple(timings), time.perf_counter() - arrival)
+
+        queued = None
+        with self._lock:
+            self._buffers.give(i)
+            self._in_flight -= 1
+            if self._pending:
+                queued = self._pending.popleft()
+                queued = self._submit(queued), queued
+            for name, t in zip(self._names, timings):
+                self._timings[name].add(t)
+            self._latency.add(result.latency)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._finished[index] = result
+
+        if queued is not None:
+            self._watch(*queued)
+        self._deliver()
+
+        with self._lock:
+            if not self._in_flight and not self._pending:
+                self._idle.notify_all()
+
+    def _deliver(self):
+        # results leave in index order, one deliverer at a time
+        with self._deliver_lock:
+            while True:
+                with self._lock:
+                    result = self._finished.pop(self._next, None)
+                    if result is None:
+                        return
+                    self._next += 1
+
+                if self.on_result is not None:
+                    self.on_result(result)
+                    continue
+                try:
+                    self._results.put_nowait(result)
+                except queue.Full:
+                    self._results.get_nowait()
+                    self.discarded += 1
+                    self._results.put_nowait(result)
+
+# ============= EOF =============================================
@@ -0,0 +1,379 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    live MJPEG preview over HTTP.
+
+    one encoder thread turns the newest frame into JPEG bytes at most once per tier and at most
+    max_fps times a second, however fast the camera runs and however many clients watch. every
+    client of a tier is sent the same bytes; a client that can not keep up simply gets the
+    newest frame when it is ready for the next one, the frames in between are skipped for it.
+
+        server = cam.preview(port=8080)
+        # http://localhost:8080/stream/full, /stream/low, /snapshot/full.jpg
+        ...
+        server.stop()
+"""
+# ============= standard library imports ========================
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# ============= local library imports  ==========================
+from conversion import BGR
+
+BOUNDARY = 'frame'
+DEFAULT_PORT = 8080
+DEFAULT_MAX_FPS = 15.
+# how long a client waits for a new frame before the connection is given up
+CLIENT_TIMEOUT = 10.
+
+logger = logging.getLogger('toupcam')
+
+
+class Tier(object):
+    """
+        one JPEG quality/size variant of the preview
+    """
+    __slots__ = ('name', 'quality', 'scale')
+
+    def __init__(self, name, quality=75, scale=1.):
+        """
+        :param quality: JPEG quality 0 ~ 100
+        :param scale: output size relative to the frame, e.g. 0.25 for thumbnails
+        """
+        self.name = name
+        self.quality = quality
+        self.scale = scale
+
+    def __repr__(self):
+        return f'Tier({self.name}, quality={self.quality}, scale={self.scale})'
+
+
+DEFAULT_TIERS = (Tier('full', 80), Tier('low', 60, 0.25))
+
+
+class PreviewEncoder(object):
+    """
+        encodes the newest frame into JPEG bytes for every tier someone is watching.
+
+        the frame listener only notes that a frame arrived; the conversion and the encodes happen
+        on the encoder thread, which pins the newest frame when it is ready for one.
+    """
+
+    def __init__(self, cam, tiers=DEFAULT_TIERS, max_fps=DEFAULT_MAX_FPS):
+        """
+        :param cam: ToupCamCamera
+        :param tiers: Tier instances
+        :param max_fps: encode rate cap, 0 encodes every frame the thread can keep up with
+        """
+        self.cam = cam
+        self.tiers = {t.name: t for t in tiers}
+        self.max_fps = max_fps
+
+        # frames the rate cap or a busy encoder skipped
+        self.skipped = 0
+        # encodes that raised, the thread logs them and carries on with the next frame
+        self.errors = 0
+        self.encoded = dict.fromkeys(self.tiers, 0)
+        self.encode_time = dict.fromkeys(self.tiers, 0.)
+
+        self._subscribers = dict.fromkeys(self.tiers, 0)
+        # {tier: (Frame.key, jpeg bytes)}; sequence numbers restart with every stream
+        self._latest = {}
+        self._arrived = 0
+        self._changed = threading.Condition()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='PreviewEncoder', daemon=True)
+        self._thread.start()
+        self.cam.add_frame_listener(self._on_frame)
+
+    def stop(self):
+        self.cam.remove_frame_listener(self._on_frame)
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._changed:
+            self._changed.notify_all()
+
+    def subscribe(self, tier):
+        """
+            start encoding tier, until the matching unsubscribe()
+        """
+        if tier not in self.tiers:
+            raise KeyError(f'unknown preview tier {tier!r}, expected one of {sorted(self.tiers)}')
+        with self._changed:
+            self._subscribers[tier] += 1
+        # encode the current frame right away for the new client
+        self._wake.set()
+
+    def unsubscribe(self, tier):
+        with self._changed:
+            self._subscribers[tier] -= 1
+            if not self._subscribers[tier]:
+                # stale bytes must not be served to the next subscriber
+                self._latest.pop(tier, None)
+
+    def wait(self, tier, after=None, timeout=CLIENT_TIMEOUT):
+        """
+            the newest JPEG of tier, waiting for one newer than after
+        :param after: frame key the caller already has
+        :return: (Frame.key, jpeg bytes), or None on timeout or stop
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self._running:
+                latest = self._latest.get(tier)
+                if latest is not None and latest[0] != after:
+                    return latest
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._changed.wait(remaining):
+                    return
+
+    @property
+    def clients(self):
+        return dict(self._subscribers)
+
+    def stats(self):
+        return {'skipped': self.skipped,
+                'errors': self.errors,
+                'clients': self.clients,
+                'encoded': dict(self.encoded),
+                'encode_us': {k: self.encode_time[k] / n * 1e6 if n else None for k, n in self.encoded.items()}}
+
+    # private
+    def _on_frame(self, frame):
+        # acquisition thread, nothing but a note
+        self._arrived += 1
+        self._wake.set()
+
+    def _run(self):
+        interval = 1. / self.max_fps if self.max_fps else 0
+        next_encode = 0
+        encoded_arrivals = 0
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running:
+                break
+
+            delay = next_encode - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            with self._changed:
+                tiers = [self.tiers[k] for k, n in self._subscribers.items() if n]
+            if not tiers:
+                continue
+
+            frame = self.cam.acquire_frame()
+            if frame is None:
+                continue
+
+            with frame:
+                arrived = self._arrived
+                self.skipped += max(0, arrived - encoded_arrivals - 1)
+                encoded_arrivals = arrived
+
+                key = frame.key
+                jpegs = {}
+                for tier in tiers:
+                    latest = self._latest.get(tier.name)
+                    if latest is not None and latest[0] == key:
+                        continue
+                    t = time.perf_counter()
+                    try:
+                        jpeg = self._encode(frame, tier)
+                    except Exception:
+                        # one bad frame must not end the preview for every client
+                        self.errors += 1
+                        logger.exception('preview tier %s failed to encode frame %s', tier.name, frame.seq)
+                        continue
+                    jpegs[tier.name] = (key, jpeg)
+                    self.encode_time[tier.name] += time.perf_counter() - t
+                    self.encoded[tier.name] += 1
+
+            if jpegs:
+                with self._changed:
+                    # a tier whose last client left meanwhile must not keep stale bytes
+                    self._latest.update((k, v) for k, v in jpegs.items() if self._subscribers[k])
+                    self._changed.notify_all()
+            next_encode = time.monotonic() + interval
+
+    def _encode(self, frame, tier):
+        import cv2
+
+        bgr = self.cam.get_image(BGR, frame)
+        if bgr.dtype != 'uint8':
+            bgr = (bgr >> (self.cam.bitdepth - 8)).astype('uint8')
+        if tier.scale != 1:
+            h, w = bgr.shape[:2]
+            size = (max(1, int(w * tier.scale)), max(1, int(h * tier.scale)))
+            bgr = cv2.resize(bgr, size, interpolation=cv2.INTER_AREA)
+
+        ok, buf = cv2.imencode('.jpg', bgr, (cv2.IMWRITE_JPEG_QUALITY, tier.quality))
+        if not ok:
+            raise IOError(f'failed to encode preview tier {tier.name}')
+        return buf.tobytes()
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """
+        /                   index of the tiers
+        /stream/<tier>      multipart/x-mixed-replace MJPEG stream
+        /snapshot/<tier>    the newest frame as a single JPEG
+    """
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        encoder = self.server.encoder
+        if parts == ['']:
+            self._index(encoder)
+            return
+
+        if len(parts) != 2 or parts[0] not in ('stream', 'snapshot'):
+            self.send_error(404)
+            return
+
+        kind, tier = parts
+        if tier.endswith('.jpg'):
+            tier = tier[:-4]
+        if tier not in encoder.tiers:
+            self.send_error(404, f'unknown preview tier {tier}')
+            return
+
+        encoder.subscribe(tier)
+        try:
+            if kind == 'stream':
+                self._stream(encoder, tier)
+            else:
+                self._snapshot(encoder, tier)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            encoder.unsubscribe(tier)
+
+    def log_message(self, format, *args):
+        # one line per request is noise for a preview server
+        pass
+
+    # private
+    def _index(self, encoder):
+        links = ''.join(f'<li><a href="/stream/{k}">{k}</a> {t.quality}% x{t.scale}</li>'
+                        for k, t in encoder.tiers.items())
+        body = f'<html><body><ul>{links}</ul></body></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _snapshot(self, encoder, tier):
+        latest = encoder.wait(tier)
+        if latest is None:
+            self.send_error(503, 'no frame')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(latest[1])))
+        self.end_headers()
+        self.wfile.write(latest[1])
+
+    def _stream(self, encoder, tier):
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        key = None
+        while True:
+            latest = encoder.wait(tier, key)
+            if latest is None:
+                break
+            key, jpeg = latest
+            # blocks while the client is slow; the frames encoded meanwhile are skipped for it
+            self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+                             f'Content-Length: {len(jpeg)}\r\n\r\n'.encode())
+            self.wfile.write(jpeg)
+            self.wfile.write(b'\r\n')
+
+
+class PreviewServer(object):
+    """
+        PreviewEncoder plus a local HTTP server, see the module docstring
+    """
+
+    def __init__(self, cam, host='127.0.0.1', port=DEFAULT_PORT, tiers=DEFAULT_TIERS, max_fps=DEFAULT_MAX_FPS):
+        """
+        :param host: interface to listen on, only the local machine by default
+        :param port: 0 picks a free port, see address
+        """
+        self.encoder = PreviewEncoder(cam, tiers, max_fps)
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def address(self):
+        if self._httpd is not None:
+            return self._httpd.server_address[:2]
+
+    @property
+    def running(self):
+        return self._httpd is not None
+
+    def start(self):
+        httpd = ThreadingHTTPServer((self.host, self.port), PreviewHandler)
+        httpd.daemon_threads = True
+        httpd.encoder = self.encoder
+        self.encoder.start()
+        self._httpd = httpd
+        self._thread = threading.Thread(target=httpd.serve_forever, name='PreviewServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        httpd, self._httpd = self._httpd, None
+        if httpd is None:
+            return
+        httpd.shutdown()
+        # wakes the streaming clients so their connections end
+        self.encoder.stop()
+        httpd.server_close()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return self.encoder.stats()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+# ============= EOF =============================================
@@ -0,0 +1,241 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    the Toupcam_put_<name>/Toupcam_get_<name> pairs of toupcam.h that take plain scalars, and the
+    cached Settings on top of them.
+
+    PROPERTIES deliberately stops at scalar values. the calls taking arrays or structs
+    (WhiteBalanceGain int[3], BlackBalance unsigned short[3], LevelRange unsigned short[4] x 2,
+    AEAuxRect/AWBAuxRect/ABBAuxRect RECT) and the ones without a getter (ColorMatrix, InitWBGain,
+    Linear, Curve, LEDState, Demosaic) are made through the SDK directly.
+"""
+# ============= standard library imports ========================
+from ctypes import POINTER, byref, c_int, c_short, c_uint, c_ushort
+# ============= local library imports  ==========================
+from core import lib, HToupCam, TOUPCAM_OPTION_BINNING, TOUPCAM_OPTION_BITDEPTH, TOUPCAM_OPTION_RAW
+
+HANDLE = POINTER(HToupCam)
+
+
+class Property(object):
+    """
+        one Toupcam_put_<name>/Toupcam_get_<name> pair of toupcam.h
+    """
+    __slots__ = ('name', 'ctypes', 'restart', 'reshape', 'volatile', 'cached', 'invalidates')
+
+    def __init__(self, name, ctypes, restart=False, reshape=False, volatile=False, cached=True, invalidates=()):
+        """
+        :param ctypes: C types of the values, in argument order
+        :param restart: the stream has to be restarted for a new value to take effect
+        :param reshape: a new value changes the frame size of the running stream
+        :param volatile: the camera changes the value by itself (auto exposure, white balance)
+        :param cached: False if get does not return what put wrote, e.g. Temperature
+        :param invalidates: properties whose cached values a put makes stale
+        """
+        self.name = name
+        self.ctypes = ctypes
+        self.restart = restart
+        self.reshape = reshape
+        self.volatile = volatile
+        self.cached = cached
+        self.invalidates = invalidates
+
+    def __repr__(self):
+        return f'Property({self.name})'
+
+
+# in the order apply_settings() writes them: geometry first, auto exposure before the manual
+# exposure values it would otherwise override.
+PROPERTIES = {p.name: p for p in (
+    Property('eSize', (c_uint,), restart=True, invalidates=('Size', 'Roi')),  # resolution index
+    Property('Size', (c_int, c_int), restart=True, invalidates=('eSize', 'Roi')),  # width, height
+    Property('Roi', (c_uint, c_uint, c_uint, c_uint), reshape=True),  # x, y, width, height. even, all 0 = full frame
+    Property('Mode', (c_int,)),  # 0 = bin, 1 = skip
+    Property('Speed', (c_ushort,)),  # 0 ~ maxspeed
+    Property('HZ', (c_int,)),  # 0 = 60Hz AC, 1 = 50Hz AC, 2 = DC
+    Property('RealTime', (c_int,)),
+    Property('AutoExpoEnable', (c_int,)),
+    Property('AutoExpoTarget', (c_ushort,)),  # 16 ~ 235
+    Property('MaxAutoExpoTimeAGain', (c_uint, c_ushort)),  # microseconds, percent
+    Property('MinAutoExpoTimeAGain', (c_uint, c_ushort)),  # microseconds, percent
+    Property('ExpoTime', (c_uint,), volatile=True),  # microseconds
+    Property('ExpoAGain', (c_ushort,), volatile=True),  # percent, 100 = 1x
+    Property('TempTint', (c_int, c_int), volatile=True),  # 2000 ~ 15000, 200 ~ 2500
+    Property('Hue', (c_int,)),  # -180 ~ 180
+    Property('Saturation', (c_int,)),  # 0 ~ 255
+    Property('Brightness', (c_int,)),  # -64 ~ 64
+    Property('Contrast', (c_int,)),  # -100 ~ 100
+    Property('Gamma', (c_int,)),  # 20 ~ 180
+    Property('Chrome', (c_int,)),  # monochromatic mode
+    Property('Negative', (c_int,)),
+    Property('HFlip', (c_int,)),
+    Property('VFlip', (c_int,)),
+    Property('VignetEnable', (c_int,)),
+    Property('VignetAmountInt', (c_int,)),  # -100 ~ 100
+    Property('VignetMidPointInt', (c_int,)),  # 0 ~ 100
+    # put sets the TEC target, get reads the sensor, both in 0.1 degrees Celsius
+    Property('Temperature', (c_short,), cached=False),
+)}
+
+# options that only take effect when the stream starts
+RESTART_OPTIONS = (TOUPCAM_OPTION_RAW, TOUPCAM_OPTION_BITDEPTH)
+# options that change the frame size of the running stream
+RESHAPE_OPTIONS = (TOUPCAM_OPTION_BINNING,)
+
+# events that change volatile properties behind our back
+EXPOSURE_PROPERTIES = ('ExpoTime', 'ExpoAGain')
+TEMPTINT_PROPERTIES = ('TempTint',)
+
+
+def reshapes(key, is_option):
+    """
+        True if writing key changes the frame size of the running stream, see Settings.plan
+    """
+    return key in RESHAPE_OPTIONS if is_option else PROPERTIES[key].reshape
+
+
+def put_prototype(name):
+    return lib.prototype('put_' + name, (HANDLE,) + PROPERTIES[name].ctypes)
+
+
+def get_prototype(name):
+    return lib.prototype('get_' + name, (HANDLE,) + tuple(POINTER(t) for t in PROPERTIES[name].ctypes))
+
+
+class Settings(object):
+    """
+        cached access to a camera's properties.
+
+        puts go straight through prebound prototypes and update the cache; gets are served from
+        the cache and only cross into the SDK for values never read or put before. volatile values
+        are only cached while something keeps them current, i.e. the pull mode callback
+        invalidating them on TOUPCAM_EVENT_EXPOSURE/TEMPTINT (see events).
+
+        failed calls raise core.ToupcamError.
+    """
+
+    def __init__(self, cam):
+        """
+        :param cam: ToupCamCamera, its HToupCam handle is cam.cam
+        """
+        self._cam = cam
+        self._values = {}
+        self._options = {}
+        # prototypes bound for this camera's backend
+        self._puts = {}
+        self._gets = {}
+        # True while TOUPCAM_EVENT_xxx notifications keep volatile values current
+        self.events = False
+
+    def put(self, name, *values):
+        func = self._puts.get(name)
+        if func is None:
+            func = self._puts[name] = put_prototype(name)
+        func(self._cam.cam, *values)
+        values = values[0] if len(values) == 1 else values
+        p = PROPERTIES[name]
+        if p.cached and (self.events or not p.volatile):
+            self._values[name] = values
+        for other in p.invalidates:
+            self._values.pop(other, None)
+        return values
+
+    def get(self, name, refresh=False):
+        """
+        :param refresh: read the value from the camera even if it is cached
+        :return: the value, or a tuple for properties with several values (Size, TempTint, ...)
+        """
+        if not refresh:
+            try:
+                return self._values[name]
+            except KeyError:
+                pass
+
+        p = PROPERTIES[name]
+        func = self._gets.get(name)
+        if func is None:
+            func = self._gets[name] = get_prototype(name)
+        refs = [t() for t in p.ctypes]
+        func(self._cam.cam, *[byref(r) for r in refs])
+        values = refs[0].value if len(refs) == 1 else tuple(r.value for r in refs)
+        if p.cached and (self.events or not p.volatile):
+            self._values[name] = values
+        return values
+
+    def put_option(self, option, value):
+        func = self._puts.get('Option')
+        if func is None:
+            func = self._puts['Option'] = lib.prototype('put_Option', (HANDLE, c_uint, c_int))
+        func(self._cam.cam, option, value)
+        self._options[option] = value
+
+    def get_option(self, option, refresh=False):
+        if not refresh and option in self._options:
+            return self._options[option]
+
+        func = self._gets.get('Option')
+        if func is None:
+            func = self._gets['Option'] = lib.prototype('get_Option', (HANDLE, c_uint, POINTER(c_int)))
+        v = c_int()
+        func(self._cam.cam, option, byref(v))
+        self._options[option] = v.value
+        return v.value
+
+    def invalidate(self, *names):
+        """
+            forget cached values, all of them if no names are given
+        """
+        if not names:
+            self._values.clear()
+            self._options.clear()
+        for name in names:
+            self._values.pop(name, None)
+
+    def plan(self, profile):
+        """
+            split a profile into the writes that need a stream restart and those that do not,
+            each in PROPERTIES order, leaving out values the cache says are already set
+        :param profile: {property name: value, 'options': {option: value}}
+        :return: (restart, live) lists of (name or option, value, is_option)
+        """
+        unknown = set(profile) - set(PROPERTIES) - {'options'}
+        if unknown:
+            raise KeyError(f'unknown camera properties {sorted(unknown)}')
+
+        restart, live = [], []
+        for name, p in PROPERTIES.items():
+            if name in profile:
+                value = profile[name]
+                if isinstance(value, list):
+                    value = tuple(value)
+                if self._values.get(name) != value:
+                    (restart if p.restart else live).append((name, value, False))
+
+        for option, value in profile.get('options', {}).items():
+            if self._options.get(option) != value:
+                (restart if option in RESTART_OPTIONS else live).append((option, value, True))
+        return restart, live
+
+    def write(self, writes):
+        for key, value, is_option in writes:
+            if is_option:
+                self.put_option(key, value)
+            elif isinstance(value, tuple):
+                self.put(key, *value)
+            else:
+                self.put(key, value)
+
+# ============= EOF =============================================
@@ -0,0 +1,384 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    stream live frames to disk.
+
+    container layout (see write_header/read_header):
+        HEADER_SIZE bytes   MAGIC followed by a zero padded JSON header (shape, dtype, frame_nbytes, ...)
+        frames              fixed stride, frame i starts at HEADER_SIZE + i * frame_nbytes
+
+    the per-frame index is written next to the container (path + INDEX_EXT) as packed INDEX_DTYPE
+    records: byte offset, hardware timestamp, sequence number, frame flag and the exposure time
+    and analog gain in effect when the frame arrived. gaps in seq are
+    frames that never reached the file, either dropped by the camera or by the recorder.
+"""
+# ============= standard library imports ========================
+import json
+import os
+import queue
+import threading
+
+from numpy import arange, copyto, dtype as np_dtype, empty, fromfile, prod, uint8
+# ============= local library imports  ==========================
+from conversion import BGR, convert, output_dtype, output_shape
+
+MAGIC = b'TCRAW001'
+HEADER_SIZE = 4096
+INDEX_EXT = '.idx'
+INDEX_DTYPE = np_dtype([('offset', '<u8'), ('timestamp', '<u8'), ('seq', '<u4'), ('flag', '<u4'),
+                        ('exposure_us', '<u4'), ('gain', '<u4')])
+
+DEFAULT_CHUNK_FRAMES = 8
+DEFAULT_MAX_CHUNKS = 8
+
+
+def write_header(fp, header):
+    blob = json.dumps(header).encode()
+    if len(MAGIC) + len(blob) > HEADER_SIZE:
+        raise ValueError('recording header is too large')
+    fp.seek(0)
+    fp.write(MAGIC + blob.ljust(HEADER_SIZE - len(MAGIC), b'\0'))
+
+
+def read_header(path):
+    """
+    :return: dict, see Recorder._header
+    """
+    with open(path, 'rb') as rfile:
+        blob = rfile.read(HEADER_SIZE)
+    if not blob.startswith(MAGIC):
+        raise ValueError(f'{path} is not a frame recording')
+    return json.loads(blob[len(MAGIC):].rstrip(b'\0'))
+
+
+def read_index(path, header=None):
+    """
+    :param path: container path
+    :param header: the container's header, read if None
+    :return: structured array of the recording's index dtype
+    """
+    if header is None:
+        header = read_header(path)
+    dtype = np_dtype([tuple(f) for f in header['index_dtype']])
+    path += INDEX_EXT
+    # ignore a partial last record of an interrupted recording
+    return fromfile(path, dtype=dtype, count=os.path.getsize(path) // dtype.itemsize)
+
+
+class Chunk(object):
+    """
+        chunk_frames consecutive frames in one contiguous buffer, written with a single write()
+    """
+
+    def __init__(self, shape, dtype, nframes):
+        self.data = empty((nframes,) + tuple(shape), dtype=dtype)
+        self.index = empty(nframes, dtype=INDEX_DTYPE)
+        self.n = 0
+
+    @property
+    def full(self):
+        return self.n == len(self.index)
+
+
+class Recorder(object):
+    """
+        record live frames into a chunked raw container, optionally encoding them to a video
+        file on the way.
+
+        the frame listener only copies each frame into a preallocated chunk; a full chunk is
+        handed to the writer thread, which appends it with one large sequential write. when the
+        writer falls behind and every chunk is in use, incoming frames are dropped and counted
+        in dropped, never blocking the acquisition callback.
+
+        rec = cam.record('run1.tcr')
+        ...
+        rec.rotate('run2.tcr')
+        ...
+        print(rec.stop())
+    """
+
+    def __init__(self, cam, chunk_frames=DEFAULT_CHUNK_FRAMES, max_chunks=DEFAULT_MAX_CHUNKS,
+                 fourcc='MJPG', fps=None):
+        """
+        :param cam: ToupCamCamera, must be open
+        :param chunk_frames: frames per write
+        :param max_chunks: chunks that may be queued or being filled, bounds memory to
+            chunk_frames * max_chunks frames
+        :param fourcc: cv2.VideoWriter codec used with a video_path
+        :param fps: video frame rate, defaults to the camera's frame rate or 30
+        """
+        self.cam = cam
+        self.chunk_frames = chunk_frames
+        self.max_chunks = max_chunks
+        self.fourcc = fourcc
+        self.fps = fps
+
+        self.path = None
+        self.video_path = None
+
+        self.frames = 0
+        self.dropped = 0
+        self.chunks = 0
+        self.bytes_written = 0
+        self.error = None
+
+        self._lock = threading.Lock()
+        self._free = None
+        self._queue = None
+        self._chunk = None
+        self._thread = None
+        self._recording = False
+        self._last_seq = None
+
+        self._fp = None
+        self._ifp = None
+        self._video = None
+        self._bgr = None
+        self._shape = None
+        self._dtype = None
+        self._frame_nbytes = 0
+        self._file_frames = 0
+        self._file_dropped = 0
+
+    @property
+    def recording(self):
+        return self._recording
+
+    def start(self, path, video_path=None):
+        """
+            start recording the camera's live frames into path
+        :param video_path: also encode the frames into this video file
+        """
+        if self._recording:
+            raise RuntimeError(f'already recording to {self.path}')
+
+        ring = self.cam._ring
+        if ring is None:
+            raise RuntimeError('camera is not open')
+
+        shape, dtype = ring.shape, np_dtype(ring.dtype)
+        if self._free is None or self._shape != shape or self._dtype != dtype:
+            self._free = queue.Queue()
+            for _ in range(self.max_chunks):
+                self._free.put(Chunk(shape, dtype, self.chunk_frames))
+            self._shape, self._dtype = shape, dtype
+            self._bgr = None
+
+        self.frames = self.dropped = self.chunks = self.bytes_written = 0
+        self.error = None
+        self._last_seq = None
+        self._queue = queue.Queue()
+        try:
+            self._open(path, video_path)
+        except BaseException:
+            self._queue = None
+            raise
+
+        self._recording = True
+        self._thread = threading.Thread(target=self._run, name='Recorder', daemon=True)
+        self._thread.start()
+        self.cam.add_frame_listener(self._on_frame)
+
+    def rotate(self, path, video_path=None):
+        """
+            continue recording into new files. frames already received go to the current files.
+        """
+        if not self._recording:
+            raise RuntimeError('not recording')
+        with self._lock:
+            self._handoff()
+            self._queue.put(('rotate', (path, video_path)))
+
+    def stop(self):
+        """
+            stop recording, write out the frames already received and close the files
+        :return: dict with path, frames, dropped, chunks and bytes_written
+        """
+        if self._recording:
+            self.cam.remove_frame_listener(self._on_frame)
+            with self._lock:
+                self._recording = False
+                self._handoff()
+                self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        if self.error is not None:
+            raise IOError(f'recording to {self.path} failed') from self.error
+        return self.summary()
+
+    def summary(self):
+        return {'path': self.path,
+                'video_path': self.video_path,
+                'frames': self.frames,
+                'dropped': self.dropped,
+                'chunks': self.chunks,
+                'bytes_written': self.bytes_written}
+
+    # private
+    def _on_frame(self, frame):
+        # acquisition thread
+        with self._lock:
+            if not self._recording:
+                return
+
+            last, self._last_seq = self._last_seq, frame.seq
+            if last is not None and frame.seq > last + 1:
+                # frames the camera (or the ring) dropped before they reached us
+                self.dropped += frame.seq - last - 1
+
+            chunk = self._chunk
+            if chunk is None:
+                try:
+                    chunk = self._free.get_nowait()
+                except queue.Empty:
+                    self.dropped += 1
+                    return
+                chunk.n = 0
+                self._chunk = chunk
+
+            i = chunk.n
+            copyto(chunk.data[i], frame.data)
+            rec = chunk.index[i]
+            rec['timestamp'] = frame.timestamp
+            rec['seq'] = frame.seq
+            rec['flag'] = frame.flag
+            rec['exposure_us'], rec['gain'] = self.cam.exposure
+            chunk.n = i + 1
+
+            if chunk.full:
+                self._handoff()
+
+    def _handoff(self):
+        # called with the lock held
+        chunk, self._chunk = self._chunk, None
+        if chunk is not None:
+            if chunk.n:
+                self._queue.put(('chunk', chunk))
+            else:
+                self._free.put(chunk)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            kind, arg = job
+            try:
+                if kind == 'rotate':
+                    self._close()
+                    self._open(*arg)
+                elif self.error is None:
+                    self._write(arg)
+            except BaseException as e:
+                # keep draining so chunks return to the pool, stop() reports the error
+                self.error = e
+            finally:
+                if kind == 'chunk':
+                    self._free.put(arg)
+
+        try:
+            self._close()
+        except BaseException as e:
+            self.error = self.error or e
+
+    def _write(self, chunk):
+        n = chunk.n
+        fp = self._fp
+        nbytes = self._frame_nbytes
+
+        index = chunk.index[:n]
+        index['offset'] = fp.tell() + arange(n, dtype='<u8') * nbytes
+
+        fp.write(memoryview(chunk.data[:n]).cast('B'))
+        self._ifp.write(index.tobytes())
+
+        if self._video is not None:
+            for data in chunk.data[:n]:
+                self._encode(data)
+
+        self._file_frames += n
+        self.frames += n
+        self.chunks += 1
+        self.bytes_written += n * nbytes
+
+    def _encode(self, data):
+        cam = self.cam
+        if self._bgr is None:
+            self._bgr = empty(output_shape(data, BGR), dtype=output_dtype(data))
+
+        bgr = convert(data, BGR, self._bgr, cam.converter.bayer)
+        if bgr.dtype != uint8:
+            bgr = (bgr >> (cam.bitdepth - 8)).astype(uint8)
+        self._video.write(bgr)
+
+    def _open(self, path, video_path):
+        self.path = path
+        self.video_path = video_path
+        self._file_frames = 0
+        self._file_dropped = self.dropped
+
+        self._frame_nbytes = int(prod(self._shape)) * self._dtype.itemsize
+        try:
+            self._fp = open(path, 'w+b')
+            write_header(self._fp, self._header())
+            self._ifp = open(path + INDEX_EXT, 'wb')
+
+            if video_path:
+                h, w = self._shape[:2]
+                fps = self.fps or self.cam.frame_rate or 30
+                import cv2
+
+                video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*self.fourcc), fps, (w, h))
+                if not video.isOpened():
+                    raise IOError(f'failed to open {video_path} with fourcc {self.fourcc}')
+                self._video = video
+        except BaseException:
+            # no half-open recording: the files opened so far are closed again
+            for f in (self._fp, self._ifp):
+                if f is not None:
+                    f.close()
+            self._fp = self._ifp = None
+            raise
+
+    def _close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+        if self._fp is not None:
+            # the header is rewritten with the final counts
+            write_header(self._fp, self._header())
+            self._fp.close()
+            self._ifp.close()
+            self._fp = self._ifp = None
+
+    def _header(self):
+        cam = self.cam
+        return {'version': 1,
+                'header_size': HEADER_SIZE,
+                'shape': list(self._shape),
+                'dtype': self._dtype.str,
+                'frame_nbytes': self._frame_nbytes,
+                'raw': cam.raw,
+                'raw_format': cam.converter.bayer,
+                'bitdepth': cam.bitdepth,
+                'index_dtype': INDEX_DTYPE.descr,
+                'frames': self._file_frames,
+                'dropped': self.dropped - self._file_dropped}
+
+# ============= EOF =============================================
@@ -0,0 +1,170 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import threading
+import time
+
+from numpy import copyto
+# ============= local library imports  ==========================
+from archive import FrameArchive
+from camera import ToupCamCamera
+from core import ToupcamFrameInfoV2
+from frames import FrameRing, DEFAULT_SLOTS
+from properties import Settings
+
+
+class ArchivedSettings(Settings):
+    """
+        settings of a replayed camera: puts are only remembered, the exposure comes from the
+        archive's index
+    """
+
+    def put(self, name, *values):
+        values = values[0] if len(values) == 1 else values
+        self._values[name] = values
+        return values
+
+    def get(self, name, refresh=False):
+        if name == 'ExpoTime':
+            return self._cam.exposure[0]
+        if name == 'ExpoAGain':
+            return self._cam.exposure[1]
+        if name == 'Size':
+            h, w = self._cam.archive.shape[:2]
+            return w, h
+        return self._values.get(name)
+
+    def put_option(self, option, value):
+        self._options[option] = value
+
+    def get_option(self, option, refresh=False):
+        return self._options.get(option, 0)
+
+
+class ReplayCamera(ToupCamCamera):
+    """
+        plays a FrameArchive back through the ToupCamCamera frame path, so get_image_data,
+        get_cv_image, acquire_frame, frame listeners, frames() and record() work unchanged.
+
+        cam = ReplayCamera('run1.tcr', speed=4)
+        cam.add_frame_listener(analyze)
+        cam.open()
+
+        camera settings are not replayed; setters are only remembered and the exposure getters
+        report the archived values of the current frame.
+    """
+
+    def __init__(self, archive, speed=1., loop=False, begin=0, end=None, buffer_count=DEFAULT_SLOTS):
+        """
+        :param archive: FrameArchive or path of a recording
+        :param speed: playback speed relative to the recorded timestamps, 0 plays as fast as
+            the listeners keep up
+        :param loop: start over at the end of the archive
+        :param begin: first frame number
+        :param end: frame number to stop before, defaults to the end of the archive
+        """
+        if not isinstance(archive, FrameArchive):
+            archive = FrameArchive(archive)
+        self.archive = archive
+        self.speed = speed
+        self.loop = loop
+        self.begin = begin
+        self.end = len(archive) if end is None else end
+
+        super(ReplayCamera, self).__init__(raw=archive.raw, high_bitdepth=archive.bitdepth > 8,
+                                           buffer_count=buffer_count)
+        self.settings = ArchivedSettings(self)
+        self.bitdepth = archive.bitdepth
+        self.raw_format = archive.raw_format
+        self.converter.bayer = archive.raw_format
+
+        self.position = begin
+        self.finished = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def open(self, mode=None):
+        archive = self.archive
+        self._ring = FrameRing(archive.shape, archive.dtype, self.buffer_count, self.counters)
+        self._last_seq = None
+        self._skipped = 0
+
+        self.finished.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ReplayCamera', daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        super(ReplayCamera, self).close()
+
+    def get_camera(self, cid=None):
+        pass
+
+    # private
+    def _run(self):
+        ring = self._ring
+        frames = self.archive.frames
+        index = self.archive.index
+        info = ToupcamFrameInfoV2()
+        info.height, info.width = self.archive.shape[:2]
+
+        while self._running:
+            t0 = time.perf_counter()
+            ts0 = int(index['timestamp'][self.begin]) if self.begin < self.end else 0
+
+            for i in range(self.begin, self.end):
+                if not self._running:
+                    return
+
+                rec = index[i]
+                if self.speed:
+                    due = t0 + (int(rec['timestamp']) - ts0) * 1e-6 / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                self.position = i
+                idx = ring.acquire_write()
+                if idx is None:
+                    self.counters.dropped += 1
+                    self._skipped += 1
+                    continue
+
+                copyto(ring.buffer(idx), frames[i])
+                info.flag, info.seq, info.timestamp = int(rec['flag']), int(rec['seq']), int(rec['timestamp'])
+                self.exposure = (int(rec['exposure_us']), int(rec['gain']))
+                self._publish(ring, idx, info)
+
+            if not self.loop:
+                break
+            # the archived sequence numbers start over
+            self._last_seq = None
+
+        self.finished.set()
+
+    def _lib_func(self, func, *args, **kw):
+        return False
+
+    def _update_exposure(self):
+        pass
+
+# ============= EOF =============================================
@@ -0,0 +1,468 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    live frames shared with other processes through multiprocessing.shared_memory.
+
+    the camera's frame ring itself lives in shared memory: the SDK pulls every frame straight into
+    a shared slot, nothing is copied or pickled per frame. a control segment, attached by name,
+    describes every slot (sequence number, timestamp, flag, shape, dtype) next to a write counter
+    that is odd while the slot is being written.
+
+        # acquisition process
+        publisher = cam.share('cam0')
+
+        # any number of analysis processes
+        with SharedFrameSubscriber('cam0') as sub:
+            for frame in sub:
+                process(frame.data)         # read-only view of the shared slot
+                if not frame.valid:         # the camera lapped us while we were reading
+                    ...
+
+    subscribers can not pin slots in another process, so a slow reader can be lapped: the writer
+    reuses the slot under its feet. frame.valid (or frame.copy(), which raises LappedError) tells
+    whether the frame is still intact; lapped counts the frames that were not.
+
+    segments:
+        <name>          control block, header plus one record per slot
+        <name>-<gen>    slot data, nslots * capacity bytes; a new generation is only created when a
+                        frame no longer fits (e.g. after a larger ROI), subscribers follow it
+"""
+# ============= standard library imports ========================
+import os
+import time
+# ============= local library imports  ==========================
+from frames import FrameRing, DEFAULT_SLOTS
+
+MAGIC = 0x48534354  # 'TCSH'
+VERSION = 1
+
+HEADER = [('magic', '<u4'), ('version', '<u4'), ('nslots', '<u4'), ('generation', '<u4'),
+          ('capacity', '<u8'), ('closed', '<u4'), ('reserved', '<u4'), ('latest', '<i8'), ('published', '<u8')]
+# counter is odd while the slot is written; pub numbers the published frames 1, 2, 3...
+SLOT = [('counter', '<u8'), ('pub', '<u8'), ('seq', '<i8'), ('timestamp', '<u8'), ('flag', '<u4'),
+        ('height', '<u4'), ('width', '<u4'), ('channels', '<u4'), ('dtype', 'S8')]
+
+# how often a waiting subscriber looks for a new frame
+DEFAULT_POLL = 0.0005
+
+# segments created by publishers of this process, the resource tracker already knows them
+_created = set()
+
+
+class LappedError(RuntimeError):
+    pass
+
+
+def _control(buf, nslots):
+    """
+        (header record, slot records) on the control segment
+    """
+    from numpy import dtype, ndarray
+
+    header = dtype(HEADER)
+    return ndarray((), header, buffer=buf), ndarray((nslots,), dtype(SLOT), buffer=buf, offset=header.itemsize)
+
+
+def _control_size(nslots):
+    from numpy import dtype
+
+    return dtype(HEADER).itemsize + nslots * dtype(SLOT).itemsize
+
+
+def _data_name(name, generation):
+    return f'{name}-{generation}'
+
+
+def _attach(name):
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the segment with this process's resource
+        # tracker, which would unlink it for everybody when this process exits
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix' and shm.name not in _created:
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _create(name, size):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name, create=True, size=size)
+    _created.add(shm.name)
+    return shm
+
+
+def _unlink(shm):
+    shm.unlink()
+    _created.discard(shm.name)
+    _release(shm)
+
+
+def _release(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # views of the segment are still alive; the mapping goes away with the last of them
+        pass
+
+
+class SharedFrameRing(FrameRing):
+    """
+        FrameRing whose slots are views of a shared data segment, mirroring every publish into the
+        control block. in-process readers pin slots as usual.
+    """
+
+    def __init__(self, publisher, shm, capacity, shape, dtype, nslots=DEFAULT_SLOTS, counters=None):
+        self._shm = shm
+        self._capacity = capacity
+        self._publisher = publisher
+        super(SharedFrameRing, self).__init__(shape, dtype, nslots, counters)
+
+    def fits(self, shape, dtype, nslots):
+        from numpy import dtype as np_dtype, prod
+
+        return nslots == self.nslots and int(prod(shape)) * np_dtype(dtype).itemsize <= self._capacity
+
+    def reshape(self, shape, dtype):
+        """
+            new frame geometry in the same slots. frames pinned in this process keep their old
+            views and their slots stay out of the writer's reach until released.
+        """
+        with self._lock:
+            self.shape = tuple(shape)
+            self._bind(self._allocate(dtype))
+            self._latest = -1
+
+    def acquire_write(self):
+        idx = super(SharedFrameRing, self).acquire_write()
+        if idx is not None:
+            self._publisher.begin_write(idx)
+        return idx
+
+    def publish(self, idx, seq, timestamp=0, flag=0):
+        self._publisher.end_write(idx, self.shape, self.dtype, seq, timestamp, flag)
+        super(SharedFrameRing, self).publish(idx, seq, timestamp, flag)
+
+    def abort(self, idx):
+        super(SharedFrameRing, self).abort(idx)
+        # the slot's previous frame is torn, the odd->even step tells its readers
+        self._publisher.end_write(idx)
+
+    def _allocate(self, dtype):
+        from numpy import ndarray
+
+        return [ndarray(self.shape, dtype, buffer=self._shm.buf, offset=i * self._capacity)
+                for i in range(self.nslots)]
+
+
+class SharedFramePublisher(object):
+    """
+        owner of the shared segments, see the module docstring. created by ToupCamCamera.share(),
+        which hands ring() the geometry of every stream it starts.
+    """
+
+    def __init__(self, name=None, nslots=DEFAULT_SLOTS, capacity=0):
+        """
+        :param name: name of the control segment, None picks a free one, see name
+        :param nslots: slots of the ring
+        :param capacity: bytes per slot; reserve the full sensor frame so a larger ROI later does
+            not need a new data segment. defaults to the first frame's size
+        """
+        self.nslots = nslots
+        self.capacity = capacity
+        self.generation = 0
+        self.closed = False
+
+        self._control_shm = _create(name, _control_size(nslots))
+        self.name = self._control_shm.name
+        self._header, self._slots = _control(self._control_shm.buf, nslots)
+        self._slots.fill(0)
+        h = self._header
+        h['magic'], h['version'], h['nslots'] = MAGIC, VERSION, nslots
+        h['generation'], h['capacity'], h['closed'] = 0, 0, 0
+        h['latest'], h['published'] = -1, 0
+
+        self._counter = self._slots['counter']
+        self._data_shm = None
+        self._ring = None
+
+    def ring(self, shape, dtype, nslots=DEFAULT_SLOTS, counters=None):
+        """
+            the SharedFrameRing for a stream of shape and dtype frames
+        """
+        from numpy import dtype as np_dtype, prod
+
+        if self.closed:
+            raise RuntimeError(f'shared frames {self.name} are closed')
+        if nslots != self.nslots:
+            raise ValueError(f'{self.name} has {self.nslots} slots, the camera needs {nslots}')
+
+        ring = self._ring
+        if ring is not None and ring.fits(shape, dtype, nslots):
+            ring.reshape(shape, dtype)
+            return ring
+
+        nbytes = int(prod(shape)) * np_dtype(dtype).itemsize
+        capacity = max(nbytes, self.capacity)
+        generation = self.generation + 1
+        shm = _create(_data_name(self.name, generation), nslots * capacity)
+
+        # frames of the old generation are gone for the subscribers
+        self._counter += 2
+        self._slots['pub'] = 0
+        header = self._header
+        header['latest'] = -1
+        header['capacity'] = capacity
+        header['generation'] = generation
+
+        self._retire_data()
+        self._data_shm = shm
+        self.generation = generation
+        self.capacity = capacity
+        self._ring = SharedFrameRing(self, shm, capacity, shape, dtype, nslots, counters)
+        return self._ring
+
+    def begin_write(self, idx):
+        if not self.closed:
+            self._counter[idx] += 1
+
+    def end_write(self, idx, shape=None, dtype=None, seq=0, timestamp=0, flag=0):
+        """
+            finish writing slot idx; with a shape the slot holds a new published frame
+        """
+        if self.closed:
+            # a push mode frame that was in flight when the camera stopped sharing
+            return
+        slot = self._slots[idx]
+        if shape is not None:
+            header = self._header
+            pub = int(header['published']) + 1
+            slot['pub'] = pub
+            slot['seq'] = seq
+            slot['timestamp'] = timestamp
+            slot['flag'] = flag
+            slot['height'], slot['width'] = shape[:2]
+            slot['channels'] = shape[2] if len(shape) > 2 else 0
+            slot['dtype'] = dtype.str.encode()
+            self._counter[idx] += 1
+            header['latest'] = idx
+            header['published'] = pub
+        else:
+            self._counter[idx] += 1
+
+    @property
+    def published(self):
+        return int(self._header['published'])
+
+    def close(self):
+        """
+            tell the subscribers the stream ended and remove the segments' names; mappings
+            that are still in use stay valid until they are released
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._header['closed'] = 1
+        self._retire_data()
+        self._ring = None
+        self._header = self._slots = self._counter = None
+        _unlink(self._control_shm)
+
+    # private
+    def _retire_data(self):
+        shm, self._data_shm = self._data_shm, None
+        if shm is not None:
+            _unlink(shm)
+
+
+class SharedFrame(object):
+    """
+        one frame of a SharedFrameSubscriber; data is a read-only view of the shared slot
+    """
+    __slots__ = ('data', 'seq', 'timestamp', 'flag', 'pub', '_subscriber', '_idx', '_counter', '_generation')
+
+    def __init__(self, subscriber, idx, data, seq, timestamp, flag, pub, counter, generation):
+        self._subscriber = subscriber
+        self._idx = idx
+        self.data = data
+        self.seq = seq
+        self.timestamp = timestamp
+        self.flag = flag
+        self.pub = pub
+        self._counter = counter
+        self._generation = generation
+
+    @property
+    def valid(self):
+        """
+            False once the publisher has started to overwrite the slot
+        """
+        return self._subscriber._intact(self._idx, self._counter, self._generation)
+
+    def copy(self):
+        """
+        :return: a private copy of the data
+        :raise LappedError: if the slot was overwritten before or while copying
+        """
+        data = self.data.copy()
+        if not self.valid:
+            raise LappedError(f'frame {self.seq} was overwritten while it was read')
+        return data
+
+
+class SharedFrameSubscriber(object):
+    """
+        attaches to a SharedFramePublisher by name and yields its frames as SharedFrames
+    """
+
+    def __init__(self, name, latest=True, poll=DEFAULT_POLL):
+        """
+        :param name: the publisher's name
+        :param latest: True always yields the newest frame, False yields every frame still in the
+            ring in order, counting the ones already overwritten as missed
+        :param poll: seconds between looks for a new frame
+        """
+        self.name = name
+        self.latest = latest
+        self.poll = poll
+
+        self.received = 0
+        # frames published but never yielded, because the subscriber was slower
+        self.missed = 0
+        # yielded frames that were overwritten before the subscriber moved on
+        self.lapped = 0
+
+        self._control_shm = _attach(name)
+        nslots = int(_control(self._control_shm.buf, 0)[0]['nslots'])
+        self._header, self._slots = _control(self._control_shm.buf, nslots)
+        if self._header['magic'] != MAGIC or self._header['version'] != VERSION:
+            _release(self._control_shm)
+            raise ValueError(f'{name} is not a shared frame ring')
+
+        self._counter = self._slots['counter']
+        self._data_shm = None
+        self._generation = None
+        self._last = int(self._header['published'])
+        self._previous = None
+
+    @property
+    def closed(self):
+        return self._header is None or bool(self._header['closed'])
+
+    def next(self, timeout=None):
+        """
+            wait for a frame newer than the last one returned
+        :return: SharedFrame, None on timeout or when the publisher closed
+        """
+        previous, self._previous = self._previous, None
+        if previous is not None and not previous.valid:
+            self.lapped += 1
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.closed:
+            frame = self._read()
+            if frame is not None:
+                self._previous = frame
+                self.received += 1
+                return frame
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(self.poll)
+
+    def __iter__(self):
+        while True:
+            frame = self.next()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        self._previous = None
+        self._header = self._slots = self._counter = None
+        if self._data_shm is not None:
+            _release(self._data_shm)
+            self._data_shm = None
+        _release(self._control_shm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # private
+    def _intact(self, idx, counter, generation):
+        return self._counter is not None and self._counter[idx] == counter and \
+            self._header['generation'] == generation
+
+    def _read(self):
+        from numpy import where
+
+        header = self._header
+        published = int(header['published'])
+        if published <= self._last:
+            return
+
+        if self.latest:
+            idx = int(header['latest'])
+            if idx < 0:
+                return
+        else:
+            # the oldest frame newer than the last one, ideally the very next
+            pubs = self._slots['pub']
+            newer = pubs > self._last
+            if not newer.any():
+                return
+            idx = int(where(newer, pubs, published + 1).argmin())
+
+        counter = int(self._counter[idx])
+        if counter % 2:
+            # being written, the next look finds it published
+            return
+
+        slot = self._slots[idx].copy()
+        generation = int(header['generation'])
+        if int(self._counter[idx]) != counter or int(slot['pub']) <= self._last:
+            return
+
+        self.missed += int(slot['pub']) - self._last - 1
+        self._last = int(slot['pub'])
+        return SharedFrame(self, idx, self._view(idx, slot, generation), int(slot['seq']), int(slot['timestamp']),
+                           int(slot['flag']), self._last, counter, generation)
+
+    def _view(self, idx, slot, generation):
+        from numpy import dtype, ndarray
+
+        if generation != self._generation:
+            if self._data_shm is not None:
+                _release(self._data_shm)
+            self._data_shm = _attach(_data_name(self.name, generation))
+            self._generation = generation
+
+        shape = (int(slot['height']), int(slot['width']))
+        if slot['channels']:
+            shape += (int(slot['channels']),)
+        data = ndarray(shape, dtype(slot['dtype'].decode()), buffer=self._data_shm.buf,
+                       offset=idx * int(self._header['capacity']))
+        data.flags.writeable = False
+        return data
+
+# ============= EOF =============================================
@@ -0,0 +1,827 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    in-process stand-in for libtoupcam.
+
+    SimulatedLibrary exposes the Toupcam_* functions used by this package with the same
+    arguments as the ctypes bindings (byref() out parameters, c_void_p buffers, CFUNCTYPE
+    callbacks) and generates synthetic frames on a background thread, like the SDK's delivery
+    thread. it can inject dropped frames, disconnects and slow consumers.
+
+    select it with TOUPCAM_BACKEND=simulated or core.use_backend('simulated', fps=60, ...).
+
+    environment:
+        TOUPCAM_SIM_CAMERAS      number of simulated cameras (1)
+        TOUPCAM_SIM_RESOLUTIONS  e.g. 2592x1944,1280x960,640x480
+        TOUPCAM_SIM_FPS          frame rate (30)
+        TOUPCAM_SIM_DROP_RATE    probability of dropping a frame before delivery (0)
+        TOUPCAM_SIM_DISCONNECT   disconnect after this many frames (never)
+        TOUPCAM_SIM_DELAY        seconds added to every delivery, a slow consumer (0)
+"""
+# ============= standard library imports ========================
+import ctypes
+import os
+import random
+import threading
+import time
+
+from numpy import arange, bincount, empty, float32, uint8, uint16, uint32
+# ============= local library imports  ==========================
+from core import TOUPCAM_EVENT_IMAGE, TOUPCAM_EVENT_STILLIMAGE, TOUPCAM_EVENT_DISCONNECTED, \
+    TOUPCAM_FRAMEINFO_FLAG_SEQ, TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP, TOUPCAM_OPTION_BINNING, TOUPCAM_OPTION_RAW, \
+    TOUPCAM_OPTION_BITDEPTH, TOUPCAM_OPTION_HISTOGRAM, TOUPCAM_OPTION_RGB, TOUPCAM_OPTION_TRIGGER, ToupcamFrameInfoV2
+
+S_OK = 0
+E_FAIL = -2147467259  # 0x80004005
+E_NOTIMPL = -2147467263  # 0x80004001
+E_INVALIDARG = -2147024809  # 0x80070057
+E_UNEXPECTED = -2147418113  # 0x8000ffff
+
+DEFAULT_RESOLUTIONS = ((2592, 1944), (1280, 960), (640, 480))
+RAW_BITS = 12
+FOURCC_RGGB = 0x42474752  # MAKEFOURCC('R', 'G', 'G', 'B')
+
+# defaults returned by Toupcam_get_xxx before anything was put, see the table in toupcam.h
+DEFAULTS = {'Gamma': (100,),
+            'Contrast': (0,),
+            'Brightness': (0,),
+            'Saturation': (128,),
+            'Hue': (0,),
+            'ExpoTime': (10000,),
+            'ExpoAGain': (100,),
+            'TempTint': (6503, 1000),
+            'AutoExpoEnable': (1,),
+            'AutoExpoTarget': (120,),
+            'MaxAutoExpoTimeAGain': (350000, 500),
+            'MinAutoExpoTimeAGain': (0, 100),
+            'HFlip': (0,),
+            'VFlip': (0,),
+            'Negative': (0,),
+            'Chrome': (0,),
+            'Speed': (0,),
+            'HZ': (2,),
+            'Mode': (0,),
+            'RealTime': (0,),
+            'VignetEnable': (0,),
+            'VignetAmountInt': (0,),
+            'VignetMidPointInt': (50,),
+            'Temperature': (200,)}
+
+
+def _value(arg):
+    # plain python value of a ctypes argument
+    return getattr(arg, 'value', arg)
+
+
+def _address(arg):
+    # address of a c_void_p, int or array buffer argument, 0 for NULL
+    if arg is None:
+        return 0
+    if isinstance(arg, int):
+        return arg
+    if isinstance(arg, ctypes.c_void_p):
+        return arg.value or 0
+    return ctypes.addressof(arg)
+
+
+def _path(arg):
+    # file name of a TCHAR* argument
+    arg = _value(arg)
+    return arg.decode() if isinstance(arg, bytes) else arg
+
+
+def _out(ref):
+    # the object behind a byref()/pointer() out parameter
+    obj = getattr(ref, '_obj', None)
+    if obj is not None:
+        return obj
+    contents = getattr(ref, 'contents', None)
+    return ref if contents is None else contents
+
+
+def _put(ref, value):
+    if ref is not None:
+        _out(ref).value = value
+
+
+class SimulatedFunction(object):
+    """
+        callable standing in for a ctypes function pointer; argtypes and restype are accepted and
+        ignored, errcheck is applied like ctypes does
+    """
+    argtypes = None
+    restype = None
+    errcheck = None
+
+    def __init__(self, func, name):
+        self._func = func
+        self.__name__ = name
+
+    def __call__(self, *args):
+        result = self._func(*args)
+        if self.errcheck is not None:
+            return self.errcheck(result, self, args)
+        return result
+
+    def __repr__(self):
+        return f'<SimulatedFunction {self.__name__}>'
+
+
+class SimulatedDevice(object):
+    """
+        one simulated camera: the enumeration entry plus the state of an open handle
+    """
+
+    def __init__(self, index, resolutions, fps, drop_rate=0., disconnect_after=None, delay=0., seed=None):
+        self.index = index
+        self.id = f'sim-{index}'
+        self.displayname = f'Simulated Camera {index}'
+        self.resolutions = tuple(resolutions)
+        self.fps = fps
+        self.drop_rate = drop_rate
+        self.disconnect_after = disconnect_after
+        self.delay = delay
+
+        self.props = {}
+        self.options = {}
+        self.esize = 0
+        self.connected = True
+        self.opened = False
+        self.paused = False
+        # (callback, ctx) of Toupcam_GetHistogram
+        self.histogram = None
+        # {'ffc': True, 'dfc': True} once taken or imported
+        self.corrections = {}
+        # SimulatedLibrary's hot plug notification, called when the device goes away
+        self.on_disconnect = None
+
+        self.seq = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.triggers = 0
+
+        self._random = random.Random(seed)
+        self._patterns = {}
+        self._callback = None
+        self._push = None
+        self._ctx = None
+        self._events = []
+        self._thread = None
+        self._running = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+        self._info = ToupcamFrameInfoV2()
+        self._still_info = ToupcamFrameInfoV2()
+        self._still_sizes = []
+
+    # geometry
+    @property
+    def size(self):
+        return self.resolutions[self.esize]
+
+    @property
+    def frame_size(self):
+        """
+            (w, h) of the delivered frames after ROI and binning
+        """
+        w, h = self.size
+        roi = self.props.get('Roi')
+        if roi:
+            w, h = roi[2:]
+        n = self.options.get(TOUPCAM_OPTION_BINNING, 1) & 0x3f or 1
+        return w // n, h // n
+
+    @property
+    def interval(self):
+        # like a hardware ROI, the sensor only reads out the rows of the ROI
+        roi = self.props.get('Roi')
+        rows = roi[3] / self.size[1] if roi else 1
+        return max(rows, 0.1) / self.fps
+
+    @property
+    def raw(self):
+        return bool(self.options.get(TOUPCAM_OPTION_RAW))
+
+    @property
+    def raw_bits(self):
+        return RAW_BITS if self.options.get(TOUPCAM_OPTION_BITDEPTH) else 8
+
+    def frame_format(self, bits):
+        """
+        :return: (dtype, channels) of the frames delivered for bits
+        """
+        if self.raw:
+            return (uint16 if self.raw_bits > 8 else uint8), 1
+        if bits == 32:
+            return uint32, 1
+        if bits == 24:
+            return uint8, 3
+        return uint8, 1
+
+    def pattern(self, w, h, bits):
+        """
+            a synthetic test pattern twice the frame height. frame k is the h rows starting at
+            offset(k, h), so every frame is one contiguous copy and the image scrolls.
+        """
+        dtype, channels = self.frame_format(bits)
+        key = (w, h, dtype, channels)
+        p = self._patterns.get(key)
+        if p is None:
+            rows = (arange(2 * h) * 255 // max(2 * h - 1, 1)).astype(uint32)
+            cols = (arange(w) * 255 // max(w - 1, 1)).astype(uint32)
+            r = (rows[:, None] + 0 * cols[None, :]) & 0xff
+            g = (cols[None, :] + 0 * rows[:, None]) & 0xff
+            b = (rows[:, None] ^ cols[None, :]) & 0xff
+            if dtype == uint32:
+                p = b | (g << 8) | (r << 16) | (0xff << 24)
+            elif self.raw:
+                # RGGB mosaic of the same scene
+                p = empty((2 * h, w), dtype=uint32)
+                p[0::2, 0::2] = r[0::2, 0::2]
+                p[0::2, 1::2] = g[0::2, 1::2]
+                p[1::2, 0::2] = g[1::2, 0::2]
+                p[1::2, 1::2] = b[1::2, 1::2]
+                p = (p << (self.raw_bits - 8)).astype(dtype)
+            elif channels == 3:
+                p = empty((2 * h, w, 3), dtype=uint8)
+                p[..., 0], p[..., 1], p[..., 2] = b, g, r
+            else:
+                p = ((r * 77 + g * 150 + b * 29) >> 8).astype(uint8)
+            self._patterns[key] = p
+        return p
+
+    def copy_frame(self, address, w, h, bits, k):
+        p = self.pattern(w, h, bits)
+        # scroll by whole 2x2 cells so raw frames keep their Bayer phase
+        offset = 2 * (k % max(h // 2, 1))
+        pitch = p[0].nbytes
+        ctypes.memmove(address, p.ctypes.data + offset * pitch, pitch * h)
+
+    def fill_info(self, info, w, h, seq):
+        info.width = w
+        info.height = h
+        info.flag = TOUPCAM_FRAMEINFO_FLAG_SEQ | TOUPCAM_FRAMEINFO_FLAG_TIMESTAMP
+        info.seq = seq
+        info.timestamp = int((time.perf_counter() - self._t0) * 1e6)
+
+    # stream
+    def start(self, callback=None, push=None, ctx=None):
+        self.stop()
+        self._callback, self._push, self._ctx = callback, push, ctx
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'SimulatedCamera-{self.index}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        t, self._thread = self._thread, None
+        if t is not None and t is not threading.current_thread():
+            t.join()
+        self._callback = self._push = None
+
+    def snap(self, resolution, n=1):
+        if not 0 <= resolution < len(self.resolutions):
+            return E_INVALIDARG
+        with self._lock:
+            self._still_sizes.extend([self.resolutions[resolution]] * n)
+            self._events.extend([TOUPCAM_EVENT_STILLIMAGE] * n)
+        self._wake.set()
+        return S_OK
+
+    def trigger(self, n):
+        with self._lock:
+            if n == 0xffff:
+                # continuous
+                self.triggers = -1
+            else:
+                self.triggers = n
+        self._wake.set()
+        return S_OK
+
+    def disconnect(self):
+        with self._lock:
+            if not self.connected:
+                return
+            self.connected = False
+            self._events.append(TOUPCAM_EVENT_DISCONNECTED)
+        self._wake.set()
+        if self.on_disconnect is not None:
+            self.on_disconnect()
+
+    def _run(self):
+        interval = self.interval
+        deadline = time.perf_counter()
+        triggered = False
+        while self._running:
+            self._process_events()
+            if not self._running:
+                break
+
+            if self.paused:
+                self._wake.wait(interval)
+                self._wake.clear()
+                deadline = time.perf_counter()
+                continue
+            interval = self.interval
+
+            now = time.perf_counter()
+            was_triggered, triggered = triggered, self.options.get(TOUPCAM_OPTION_TRIGGER) and self.triggers >= 0
+            if was_triggered and not triggered:
+                # back to video mode, the frame clock starts over
+                deadline = now
+            if triggered:
+                with self._lock:
+                    fire = self.triggers > 0
+                    if fire:
+                        self.triggers -= 1
+                if not fire:
+                    self._wake.wait(interval)
+                    self._wake.clear()
+                    continue
+                # a software trigger starts the exposure right away
+                deadline = now
+            elif now < deadline:
+                self._wake.wait(deadline - now)
+                self._wake.clear()
+                continue
+
+            self.seq += 1
+            if self.drop_rate and self._random.random() < self.drop_rate:
+                self.dropped += 1
+            else:
+                self._deliver_image()
+
+            if self.disconnect_after is not None and self.delivered >= self.disconnect_after:
+                self.disconnect()
+
+            deadline += interval
+            late = time.perf_counter() - deadline
+            if not triggered and late > interval:
+                # the consumer took longer than a frame interval, the frames that would have
+                # arrived in the meantime are lost like in the SDK's delivery queue
+                missed = int(late / interval)
+                self.seq += missed
+                self.dropped += missed
+                deadline += missed * interval
+
+    def _process_events(self):
+        while self._events:
+            with self._lock:
+                if not self._events:
+                    break
+                event = self._events.pop(0)
+            if event == TOUPCAM_EVENT_STILLIMAGE:
+                self._deliver_still()
+            elif event == TOUPCAM_EVENT_DISCONNECTED:
+                if self._callback is not None:
+                    self._callback(TOUPCAM_EVENT_DISCONNECTED, self._ctx)
+                self._running = False
+                return
+
+    def _deliver_image(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+        self.delivered += 1
+        if self._push is not None:
+            w, h = self.frame_size
+            bits = 32 if self.options.get(TOUPCAM_OPTION_RGB) == 2 else 24
+            self.fill_info(self._info, w, h, self.seq)
+            tmp = self._push_buffer(w, h, bits)
+            self._push(tmp.ctypes.data, ctypes.addressof(self._info), 0, self._ctx)
+        elif self._callback is not None:
+            self._callback(TOUPCAM_EVENT_IMAGE, self._ctx)
+
+        if self.histogram is not None:
+            self._deliver_histogram()
+
+    def _deliver_histogram(self):
+        callback, ctx = self.histogram
+        if not self.options.get(TOUPCAM_OPTION_HISTOGRAM):
+            # one shot
+            self.histogram = None
+
+        w, h = self.frame_size
+        p = self.pattern(w, h, 32)[:h:4, ::4]
+        b, g, r = p & 0xff, (p >> 8) & 0xff, (p >> 16) & 0xff
+        y = (r * 77 + g * 150 + b * 29) >> 8
+        hists = [(ctypes.c_float * 256)(*bincount(c.ravel(), minlength=256).astype(float32)) for c in (y, r, g, b)]
+        callback(*hists, ctx)
+
+    def _deliver_still(self):
+        if self._push is not None:
+            with self._lock:
+                w, h = self._still_sizes.pop(0)
+            bits = 32 if self.options.get(TOUPCAM_OPTION_RGB) == 2 else 24
+            self.fill_info(self._still_info, w, h, self.seq)
+            tmp = self._push_buffer(w, h, bits)
+            self._push(tmp.ctypes.data, ctypes.addressof(self._still_info), 1, self._ctx)
+        elif self._callback is not None:
+            self._callback(TOUPCAM_EVENT_STILLIMAGE, self._ctx)
+
+    def _push_buffer(self, w, h, bits):
+        # the SDK owned buffer handed to push mode callbacks
+        dtype, channels = self.frame_format(bits)
+        key = ('push', w, h, dtype, channels)
+        buf = self._patterns.get(key)
+        if buf is None:
+            buf = empty((h, w, channels) if channels > 1 else (h, w), dtype=dtype)
+            self._patterns[key] = buf
+        self.copy_frame(buf.ctypes.data, w, h, bits, self.seq)
+        return buf
+
+    def pull_still(self, address, bits, info):
+        with self._lock:
+            if not self._still_sizes:
+                return E_FAIL
+            w, h = self._still_sizes[0]
+            if address:
+                self._still_sizes.pop(0)
+        self.fill_info(info, w, h, self.seq)
+        if address:
+            self.copy_frame(address, w, h, bits, self.seq)
+        return S_OK
+
+
+class SimulatedLibrary(object):
+    """
+        drop-in replacement for the ctypes libtoupcam handle.
+
+        lib = SimulatedLibrary(ncameras=2, fps=60, resolutions=((1920, 1080), (640, 480)))
+        core.use_backend(lib)
+
+        handles returned by Toupcam_Open are SimulatedDevice instances; tests can use them (or
+        lib.devices) to inject faults: device.disconnect(), device.drop_rate, device.delay.
+        lib.plug() and device.disconnect() fire the Toupcam_HotPlug callback.
+    """
+
+    def __init__(self, ncameras=1, resolutions=DEFAULT_RESOLUTIONS, fps=30., drop_rate=0., disconnect_after=None,
+                 delay=0., seed=None):
+        self.resolutions = resolutions
+        self.fps = fps
+        self.devices = []
+        self._models = None
+        self._model_names = []
+        self._hotplug = None
+        for i in range(ncameras):
+            self._add_device(SimulatedDevice(i, resolutions, fps, drop_rate, disconnect_after, delay, seed))
+
+        for name in dir(self):
+            if name.startswith('Toupcam_'):
+                setattr(self, name, SimulatedFunction(getattr(self, name), name))
+
+    @classmethod
+    def from_env(cls, **kw):
+        env = os.environ
+        if 'TOUPCAM_SIM_CAMERAS' in env:
+            kw.setdefault('ncameras', int(env['TOUPCAM_SIM_CAMERAS']))
+        if 'TOUPCAM_SIM_RESOLUTIONS' in env:
+            kw.setdefault('resolutions', [tuple(int(v) for v in r.split('x'))
+                                          for r in env['TOUPCAM_SIM_RESOLUTIONS'].split(',')])
+        if 'TOUPCAM_SIM_FPS' in env:
+            kw.setdefault('fps', float(env['TOUPCAM_SIM_FPS']))
+        if 'TOUPCAM_SIM_DROP_RATE' in env:
+            kw.setdefault('drop_rate', float(env['TOUPCAM_SIM_DROP_RATE']))
+        if 'TOUPCAM_SIM_DISCONNECT' in env:
+            kw.setdefault('disconnect_after', int(env['TOUPCAM_SIM_DISCONNECT']))
+        if 'TOUPCAM_SIM_DELAY' in env:
+            kw.setdefault('delay', float(env['TOUPCAM_SIM_DELAY']))
+        return cls(**kw)
+
+    def __getattr__(self, name):
+        """
+            generic Toupcam_put_Xxx/Toupcam_get_Xxx pairs store and return their values per device
+        """
+        if name.startswith('Toupcam_put_'):
+            key = name[12:]
+
+            def func(h, *args):
+                h.props[key] = tuple(_value(a) for a in args)
+                return S_OK
+        elif name.startswith('Toupcam_get_'):
+            key = name[12:]
+
+            def func(h, *refs):
+                values = h.props.get(key, DEFAULTS.get(key))
+                if values is None:
+                    return E_NOTIMPL
+                for r, v in zip(refs, values):
+                    _put(r, v)
+                return S_OK
+        else:
+            raise AttributeError(name)
+
+        f = SimulatedFunction(func, name)
+        setattr(self, name, f)
+        return f
+
+    def connected(self):
+        return [d for d in self.devices if d.connected]
+
+    def plug(self, resolutions=None, fps=None, **kw):
+        """
+            connect another camera
+        :param kw: SimulatedDevice options, e.g. drop_rate
+        :return: the new SimulatedDevice
+        """
+        d = SimulatedDevice(len(self.devices), resolutions or self.resolutions, fps or self.fps, **kw)
+        self._add_device(d)
+        self._notify_hotplug()
+        return d
+
+    def _add_device(self, d):
+        d.on_disconnect = self._notify_hotplug
+        self.devices.append(d)
+
+    def _notify_hotplug(self):
+        hotplug = self._hotplug
+        if hotplug is not None:
+            callback, ctx = hotplug
+            callback(ctx)
+
+    # enumeration
+    def Toupcam_Version(self):
+        return b'simulated'
+
+    def Toupcam_EnumV2(self, arr):
+        from camera_enumeration import HToupcamModelV2, HToupcamResolution, TOUPCAM_MAX
+
+        devices = self.connected()
+        if arr is None:
+            return len(devices)
+
+        # the models must outlive the enumeration, like the SDK's static model table
+        models = []
+        for d in devices:
+            res = (HToupcamResolution * TOUPCAM_MAX)(*[HToupcamResolution(w, h) for w, h in d.resolutions])
+            name = ctypes.create_unicode_buffer(f'Simulated{d.index}')
+            self._model_names.append(name)
+            n = len(d.resolutions)
+            models.append(HToupcamModelV2(ctypes.cast(name, ctypes.c_wchar_p), 0x00080009, 3, n, n, 0, 0, 2.2, 2.2,
+                                          res))
+        self._models = models
+
+        n = min(len(arr), len(devices))
+        for i in range(n):
+            arr[i].displayname = devices[i].displayname
+            arr[i].id = devices[i].id
+            arr[i].model = ctypes.pointer(models[i])
+        return n
+
+    def Toupcam_HotPlug(self, callback, ctx=None):
+        self._hotplug = (callback, ctx) if callback else None
+
+    def Toupcam_Open(self, cid):
+        cid = _value(cid)
+        if isinstance(cid, bytes):
+            cid = cid.decode()
+        devices = self.connected()
+        if not devices:
+            return
+        if cid is None:
+            d = devices[0]
+        else:
+            d = next((d for d in devices if d.id == cid), None)
+            if d is None:
+                return
+        # a new handle starts from the defaults
+        d.props.clear()
+        d.options.clear()
+        d.corrections.clear()
+        d.esize = 0
+        d.opened = True
+        return d
+
+    def Toupcam_Close(self, h):
+        if h:
+            h.stop()
+            h.opened = False
+
+    # stream
+    def Toupcam_StartPullModeWithCallback(self, h, callback, ctx=None):
+        h.start(callback=callback, ctx=ctx)
+        return S_OK
+
+    def Toupcam_StartPushModeV2(self, h, callback, ctx=None):
+        h.start(push=callback, ctx=ctx)
+        return S_OK
+
+    def Toupcam_Stop(self, h):
+        h.stop()
+        return S_OK
+
+    def Toupcam_Pause(self, h, pause):
+        h.paused = bool(_value(pause))
+        h._wake.set()
+        return S_OK
+
+    def Toupcam_Flush(self, h):
+        return S_OK
+
+    def Toupcam_PullImageV2(self, h, data, bits, info):
+        w, h_ = h.frame_size
+        info = _out(info)
+        h.fill_info(info, w, h_, h.seq)
+        address = _address(data)
+        if address:
+            h.copy_frame(address, w, h_, _value(bits), h.seq)
+        return S_OK
+
+    def Toupcam_PullImage(self, h, data, bits, pw, ph):
+        w, h_ = h.frame_size
+        _put(pw, w)
+        _put(ph, h_)
+        address = _address(data)
+        if address:
+            h.copy_frame(address, w, h_, _value(bits), h.seq)
+        return S_OK
+
+    def Toupcam_PullStillImageV2(self, h, data, bits, info):
+        return h.pull_still(_address(data), _value(bits), _out(info))
+
+    def Toupcam_PullStillImage(self, h, data, bits, pw, ph):
+        info = ToupcamFrameInfoV2()
+        r = h.pull_still(_address(data), _value(bits), info)
+        _put(pw, info.width)
+        _put(ph, info.height)
+        return r
+
+    def Toupcam_Snap(self, h, resolution):
+        return h.snap(_value(resolution))
+
+    def Toupcam_SnapN(self, h, resolution, n):
+        return h.snap(_value(resolution), _value(n))
+
+    def Toupcam_Trigger(self, h, n):
+        if not h.options.get(TOUPCAM_OPTION_TRIGGER):
+            return E_UNEXPECTED
+        return h.trigger(_value(n))
+
+    # geometry
+    def Toupcam_put_eSize(self, h, index):
+        index = _value(index)
+        if not 0 <= index < len(h.resolutions):
+            return E_INVALIDARG
+        h.esize = index
+        h.props.pop('Roi', None)
+        return S_OK
+
+    def Toupcam_get_eSize(self, h, ref):
+        _put(ref, h.esize)
+        return S_OK
+
+    def Toupcam_put_Size(self, h, w, h_):
+        size = (_value(w), _value(h_))
+        if size not in h.resolutions:
+            return E_INVALIDARG
+        h.esize = h.resolutions.index(size)
+        h.props.pop('Roi', None)
+        return S_OK
+
+    def Toupcam_put_Roi(self, h, x, y, w, h_):
+        roi = tuple(_value(v) for v in (x, y, w, h_))
+        if not any(roi):
+            h.props.pop('Roi', None)
+            return S_OK
+
+        width, height = h.size
+        x, y, w, h_ = roi
+        if any(v % 2 for v in roi) or not w or not h_ or x + w > width or y + h_ > height:
+            return E_INVALIDARG
+        h.props['Roi'] = roi
+        return S_OK
+
+    def Toupcam_get_Roi(self, h, px, py, pw, ph):
+        w, h_ = h.size
+        for ref, v in zip((px, py, pw, ph), h.props.get('Roi', (0, 0, w, h_))):
+            _put(ref, v)
+        return S_OK
+
+    def Toupcam_get_Size(self, h, pw, ph):
+        w, h_ = h.size
+        _put(pw, w)
+        _put(ph, h_)
+        return S_OK
+
+    def Toupcam_get_ResolutionNumber(self, h):
+        return len(h.resolutions)
+
+    def Toupcam_get_StillResolutionNumber(self, h):
+        return len(h.resolutions)
+
+    def Toupcam_get_Resolution(self, h, index, pw, ph):
+        index = _value(index)
+        if not 0 <= index < len(h.resolutions):
+            return E_INVALIDARG
+        w, h_ = h.resolutions[index]
+        _put(pw, w)
+        _put(ph, h_)
+        return S_OK
+
+    Toupcam_get_StillResolution = Toupcam_get_Resolution
+
+    def Toupcam_get_RawFormat(self, h, fourcc, bpp):
+        _put(fourcc, FOURCC_RGGB)
+        _put(bpp, h.raw_bits)
+        return S_OK
+
+    # options
+    def Toupcam_put_Option(self, h, option, value):
+        h.options[_value(option)] = _value(value)
+        return S_OK
+
+    def Toupcam_get_Option(self, h, option, ref):
+        _put(ref, h.options.get(_value(option), 0))
+        return S_OK
+
+    # identification
+    def Toupcam_get_SerialNumber(self, h, sn):
+        sn.value = f'SIM{h.index:013d}'.encode()
+        return S_OK
+
+    def Toupcam_get_FwVersion(self, h, fw):
+        fw.value = b'sim-1.0'
+        return S_OK
+
+    def Toupcam_get_HwVersion(self, h, hw):
+        hw.value = b'sim-1.0'
+        return S_OK
+
+    def Toupcam_GetHistogram(self, h, callback, ctx=None):
+        h.histogram = (callback, ctx) if callback else None
+        return S_OK
+
+    def Toupcam_calc_ClarityFactor(self, data, bits, w, h):
+        # mean absolute horizontal and vertical difference of the 8 bit gray image. toupcam.h only
+        # allows bits 8, 24 and 32; the color layouts are not simulated
+        from numpy import ctypeslib, int32
+
+        bits, w, h = _value(bits), _value(w), _value(h)
+        if bits != 8:
+            return 0.
+        a = ctypeslib.as_array(ctypes.cast(_address(data), ctypes.POINTER(ctypes.c_uint8)), (h, w)).astype(int32)
+        return float(abs(a[1:, :] - a[:-1, :]).mean() + abs(a[:, 1:] - a[:, :-1]).mean())
+
+    def Toupcam_FfcOnce(self, h):
+        h.corrections['ffc'] = True
+        return S_OK
+
+    def Toupcam_DfcOnce(self, h):
+        h.corrections['dfc'] = True
+        return S_OK
+
+    def Toupcam_FfcExport(self, h, path):
+        return self._export_correction(h, 'ffc', path)
+
+    def Toupcam_FfcImport(self, h, path):
+        return self._import_correction(h, 'ffc', path)
+
+    def Toupcam_DfcExport(self, h, path):
+        return self._export_correction(h, 'dfc', path)
+
+    def Toupcam_DfcImport(self, h, path):
+        return self._import_correction(h, 'dfc', path)
+
+    def _export_correction(self, h, kind, path):
+        # the simulator's correction files only record that the correction was taken
+        if not h.corrections.get(kind):
+            return E_UNEXPECTED
+        with open(_path(path), 'w') as f:
+            f.write(f'simulated {kind}\n')
+        return S_OK
+
+    def _import_correction(self, h, kind, path):
+        try:
+            with open(_path(path)) as f:
+                ok = f.read().strip() == f'simulated {kind}'
+        except OSError:
+            return E_INVALIDARG
+        if not ok:
+            return E_INVALIDARG
+        h.corrections[kind] = True
+        return S_OK
+
+    def Toupcam_AwbOnePush(self, h, callback, ctx=None):
+        temp, tint = DEFAULTS['TempTint']
+        h.props['TempTint'] = (temp, tint)
+        if callback:
+            callback(temp, tint)
+        return S_OK
+
+# ============= EOF =============================================
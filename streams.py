@@ -0,0 +1,180 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import threading
+from collections import deque
+from concurrent.futures import Future
+# ============= local library imports  ==========================
+
+# backpressure policies
+LATEST = 'latest'  # keep only the newest frame, older undelivered frames are released
+QUEUE = 'queue'  # bounded queue, the oldest undelivered frame is released when it is full
+BLOCK = 'block'  # bounded queue, the acquisition thread waits for the consumer when it is full
+
+POLICIES = (LATEST, QUEUE, BLOCK)
+
+# how long a BLOCK stream may hold up the acquisition thread before giving the frame up
+BLOCK_TIMEOUT = 1.0
+
+
+class AwaitableFuture(Future):
+    """
+        a concurrent.futures.Future that can also be awaited from a coroutine
+    """
+
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self).__await__()
+
+
+class FrameStream(object):
+    """
+        async iterator of live frames.
+
+        the acquisition thread hands pinned frames over and wakes the event loop with
+        call_soon_threadsafe. the frame yielded by the iterator stays valid until the next
+        iteration (or close()); call frame.retain() to keep it longer.
+
+        async with cam.frames() as stream:
+            async for frame in stream:
+                process(frame.data)
+    """
+
+    def __init__(self, cam, policy=LATEST, maxsize=2, loop=None):
+        # asyncio is only imported by processes that actually stream
+        import asyncio
+
+        if policy not in POLICIES:
+            raise ValueError(f'policy needs to be one of {POLICIES}, got {policy!r}')
+        if policy == LATEST:
+            maxsize = 1
+        if maxsize < 1:
+            raise ValueError(f'maxsize needs to be at least 1, got {maxsize}')
+
+        if loop is None:
+            loop = asyncio.get_running_loop()
+
+        self.policy = policy
+        self.maxsize = maxsize
+        self.dropped = 0
+
+        self._cam = cam
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._space = threading.Semaphore(maxsize) if policy == BLOCK else None
+        self._wake_scheduled = False
+        self._current = None
+        self._closed = False
+
+        cam.add_frame_listener(self._on_frame)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self._release_current()
+        while True:
+            frame = self._take()
+            if frame is not None:
+                self._current = frame
+                return frame
+
+            if self._closed:
+                raise StopAsyncIteration
+
+            self._event.clear()
+            # re-check, a frame may have arrived between _take and clear
+            if not self._pending and not self._closed:
+                await self._event.wait()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._cam.remove_frame_listener(self._on_frame)
+        self._release_current()
+        with self._lock:
+            while self._pending:
+                self._pending.popleft().release()
+        if self._space is not None:
+            # unblock an acquisition thread waiting for space
+            self._space.release()
+        self._event.set()
+
+    # private
+    def _take(self):
+        with self._lock:
+            if self._pending:
+                frame = self._pending.popleft()
+            else:
+                return
+
+        if self._space is not None:
+            self._space.release()
+        return frame
+
+    def _release_current(self):
+        if self._current is not None:
+            self._current.release()
+            self._current = None
+
+    def _on_frame(self, frame):
+        # acquisition thread
+        if self._closed:
+            return
+
+        if self._space is not None and not self._space.acquire(timeout=BLOCK_TIMEOUT):
+            self.dropped += 1
+            return
+
+        frame = frame.retain()
+        with self._lock:
+            if self._closed:
+                frame.release()
+                return
+
+            if len(self._pending) >= self.maxsize:
+                self._pending.popleft().release()
+                self.dropped += 1
+
+            self._pending.append(frame)
+            schedule = not self._wake_scheduled
+            self._wake_scheduled = True
+
+        if schedule:
+            # only one wake-up in flight, the consumer drains everything that is pending
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # event loop is closed
+                self._closed = True
+
+    def _wake(self):
+        with self._lock:
+            self._wake_scheduled = False
+        self._event.set()
+
+# ============= EOF =============================================
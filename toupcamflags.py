@@ -2,6 +2,7 @@
 # toupcam.h Version: 33.13977.2019.0224
 
 from enum import Enum
+from functools import lru_cache
 
 class ToupCamFlags(Enum):
     CMOS = 0x00000001  # cmos sensor
@@ -54,12 +55,14 @@ class ToupCamFlags(Enum):
 #         return self.flag_names
 
 
+@lru_cache(maxsize=None)
+def flagNames(flags):
+    """ names of the TOUPCAM_FLAG_xxx bits set in flags, decoded once per distinct value (i.e. per model) """
+    return tuple(name for name, member in ToupCamFlags.__members__.items() if flags & member.value)
+
+
 def getAllFlags(flags=None):
-    flag_names = []
-    for name, member in ToupCamFlags.__members__.items():
-        if (flags & member.value):
-            flag_names.append(name)
-    return flag_names
+    return list(flagNames(flags))
 
 
 """ currently unused """
@@ -109,8 +112,6 @@ class ToupCamConstants(Enum):
 
 
 if __name__ == '__main__':
-    flags = Flags()
-    flags.getAllFlags(2164532329)   # an example flags from my oen camera...
-    print(flags.flag_names)
+    print(getAllFlags(2164532329))   # an example flags from my oen camera...
     exit()
 
@@ -0,0 +1,117 @@
+# ===============================================================================
+# Copyright 2021 Donald Regula
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= standard library imports ========================
+import queue
+import threading
+# ============= local library imports  ==========================
+from streams import AwaitableFuture
+
+DEFAULT_QUEUE_SIZE = 16
+
+
+class StillWriter(object):
+    """
+        encode and save still images on background threads.
+
+        submit() never blocks: when the queue is full the request fails immediately, so a slow
+        disk or network share can not stall the acquisition callback.
+    """
+
+    def __init__(self, to_image, maxsize=DEFAULT_QUEUE_SIZE, workers=1):
+        """
+        :param to_image: callable converting frame data into a PIL image
+        :param maxsize: maximum number of queued stills
+        :param workers: number of writer threads
+        """
+        self._to_image = to_image
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._nworkers = workers
+        self._lock = threading.Lock()
+
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, frame, path, extension='JPEG', future=None, **kw):
+        """
+            queue frame to be saved to path. the writer takes over the frame's pin and hands it
+            on as the future's result; the still buffer is reused once that frame is released
+            (or garbage collected).
+
+        :param frame: Frame
+        :param path: output path
+        :param extension: PIL format name, e.g. JPEG, TIFF, PNG
+        :param future: future to resolve with the frame, a new one is made if None
+        :param kw: passed on to PIL.Image.save, e.g. quality=95
+        :return: future resolved with the frame once it has been written
+        """
+        if future is None:
+            future = AwaitableFuture()
+
+        self._start()
+        try:
+            self._queue.put_nowait((frame, path, extension, kw, future))
+        except queue.Full:
+            self.rejected += 1
+            frame.release()
+            future.set_exception(IOError(f'still writer queue is full, {path} was not written'))
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    # private
+    def _start(self):
+        if self._threads:
+            return
+
+        with self._lock:
+            while len(self._threads) < self._nworkers:
+                t = threading.Thread(target=self._run, name='StillWriter', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            frame, path, extension, kw, future = job
+            try:
+                image = self._to_image(frame.data)
+                image.save(path, extension, **kw)
+            except BaseException as e:
+                self.failed += 1
+                frame.release()
+                future.set_exception(e)
+            else:
+                self.written += 1
+                future.set_result(frame)
+
+# ============= EOF =============================================